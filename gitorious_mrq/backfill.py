@@ -0,0 +1,310 @@
+"""Offline analysis of archived feeds and merge request listings.
+
+Archives are directory trees laid out like the site, as in tests/data:
+
+ maliit.atom.1.txt                              Activity feed of maliit
+ maliit/maliit-framework/merge_requests/*.html  Listings of open merge requests
+
+Feed files are named PROJECT.atom, optionally followed by a suffix.
+A listing is taken to be from the time given in a file next to it,
+named like the listing followed by .time, as YYYY-MM-DDTHH:MM:SSZ.
+Without one, it is taken to be from the time the listing was last
+modified, which is lost if the archives are copied without keeping it.
+
+The files are parsed in a pool of processes, and the results written
+to SQLite by the parent process:
+- events: merge request entries of the feeds, without duplicates
+- merge_requests: each merge request, when it was first and last
+  listed, and the state it was last seen in
+- repository_stats: per repository, the number of merge requests,
+  how many were merged, and the hours from opening to merging
+- state_counts: per repository, the number of merge requests by the
+  state they were last seen in"""
+
+import os, re, time, calendar, sqlite3, itertools, multiprocessing, traceback, HTMLParser
+
+from gitorious_mrq import feedreader, scrape, entries
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+CHUNKSIZE = 16 # Files handed to a worker process at a time
+COMMIT_INTERVAL = 1000 # Files processed between commits of the output
+MERGED_STATES = ('Merged',)
+LISTING_TIME_SUFFIX = '.time' # Of files next to listings, giving the time they were retrieved
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    key TEXT PRIMARY KEY,
+    project TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    mrq TEXT NOT NULL,
+    time TEXT,
+    author TEXT,
+    action TEXT NOT NULL,
+    old_state TEXT,
+    new_state TEXT,
+    title TEXT
+);
+CREATE INDEX IF NOT EXISTS events_mrq ON events (project, repository, mrq);
+CREATE TABLE IF NOT EXISTS merge_requests (
+    project TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    mrq TEXT NOT NULL,
+    summary TEXT,
+    creator TEXT,
+    creation TEXT,
+    first_listed TEXT,
+    last_listed TEXT,
+    status TEXT,
+    PRIMARY KEY (project, repository, mrq)
+);
+CREATE TABLE IF NOT EXISTS repository_stats (
+    project TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    merge_requests INTEGER NOT NULL,
+    merged INTEGER NOT NULL,
+    mean_hours_to_merge REAL,
+    median_hours_to_merge REAL,
+    PRIMARY KEY (project, repository)
+);
+CREATE TABLE IF NOT EXISTS state_counts (
+    project TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    state TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (project, repository, state)
+);
+"""
+
+FEED = 'feed'
+LISTING = 'listing'
+
+mrq_regexp = re.compile(r'merge request ([^/\s]+)/(\S+)\s*#(\d+)')
+state_change_regexp = re.compile(r'State changed from <span class="changed">(.*?)</span> to <span class="changed">(.*?)</span>')
+# States can contain " to ", so this is only used for entries without the summary
+title_state_change_regexp = re.compile(r'State changed from (.+?) to (.+)$')
+
+def find_files(roots):
+    """Yields (kind, path, project, repository) for the archived files below roots."""
+
+    for root in roots:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            parts = directory.rstrip(os.sep).split(os.sep)
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                if '.atom' in filename:
+                    yield FEED, path, filename.split('.atom')[0], None
+                elif filename.endswith('.html') and len(parts) >= 3 and parts[-1] == 'merge_requests':
+                    yield LISTING, path, parts[-3], parts[-2]
+
+def format_time(struct_time):
+    return time.strftime(DATE_FORMAT, struct_time) if struct_time else None
+
+def item_to_event(item, h):
+    """Returns the event tuple for the feed entry item, or None if it is not about a merge request."""
+
+    title = h.unescape(item.get('title', ''))
+    if 'merge request' not in title or 'commented' in title:
+        return None
+    match = mrq_regexp.search(title)
+    if match is None:
+        return None
+    project, repository, mrq = match.groups()
+
+    old_state = new_state = None
+    change = state_change_regexp.search(item.get('summary', '')) or title_state_change_regexp.search(title)
+    if change is not None:
+        action = 'state_changed'
+        old_state, new_state = [h.unescape(state) for state in change.groups()]
+    elif 'requested merge' in title:
+        action = 'opened'
+    else:
+        action = 'updated'
+
+    return (entries.entry_key(item), project, repository, mrq, format_time(item.get('updated_parsed')),
+            item.get('author'), action, old_state, new_state, title)
+
+def process_feed(path):
+    parsed = feedreader.parse_feed(open(path, 'rb').read())
+    h = HTMLParser.HTMLParser()
+    events = []
+    for item in parsed.get('items', []):
+        event = item_to_event(item, h)
+        if event is not None:
+            events.append(event)
+    return events
+
+def listing_time(path):
+    """Returns the time the listing at path was retrieved, in DATE_FORMAT."""
+
+    time_path = path + LISTING_TIME_SUFFIX
+    if os.path.exists(time_path):
+        listed = open(time_path).read().strip()
+        time.strptime(listed, DATE_FORMAT) # Raises ValueError if not valid
+        return listed
+    return format_time(time.gmtime(os.path.getmtime(path)))
+
+def process_listing(path, repository):
+    listed = listing_time(path)
+    mrqs = scrape.scrape_repository_mrqs(open(path, 'rb').read(), repository)
+    return listed, [(mrq['id'], mrq['status'], mrq['summary'], mrq['creator'],
+                     mrq['creation'].strftime(DATE_FORMAT) if mrq.get('creation') else None)
+                    for mrq in mrqs]
+
+def process_file(job):
+    """Parses one archived file, in a worker process.
+    Returns (job, result, None), or (job, None, error) if it failed."""
+
+    kind, path, project, repository = job
+    try:
+        if kind == FEED:
+            return job, process_feed(path), None
+        return job, process_listing(path, repository), None
+    except Exception:
+        return job, None, traceback.format_exc()
+
+def hours_between(start, end):
+    seconds = calendar.timegm(time.strptime(end, DATE_FORMAT)) - calendar.timegm(time.strptime(start, DATE_FORMAT))
+    return seconds / 3600.0
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+class BackfillStore(object):
+    """The SQLite output of a backfill. Events already in it are not added again,
+    so a backfill can be continued with more archives."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        # The output can be made again from the archives, favour speed
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.executescript(SCHEMA)
+
+        # (project, repository, mrq) -> [summary, creator, creation, first_listed, last_listed, status]
+        self.listed = {}
+        self.changed = set() # Keys of listed changed since the last commit
+        for row in self.db.execute('SELECT project, repository, mrq, summary, creator, creation, '
+                                   'first_listed, last_listed, status FROM merge_requests'):
+            self.listed[tuple(row[:3])] = list(row[3:])
+
+    def close(self):
+        self.db.close()
+
+    def addEvents(self, events):
+        """Returns the number of events that were not in the store."""
+        before = self.db.total_changes
+        self.db.executemany('INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', events)
+        return self.db.total_changes - before
+
+    def addListing(self, project, repository, listed, mrqs):
+        for mrq, status, summary, creator, creation in mrqs:
+            key = (project, repository, mrq)
+            row = self.listed.get(key)
+            if row is None:
+                self.listed[key] = [summary, creator, creation, listed, listed, status]
+                self.changed.add(key)
+                continue
+            if listed < row[3]:
+                row[3] = listed
+                self.changed.add(key)
+            if listed >= row[4]:
+                row[0], row[1], row[2], row[4], row[5] = summary, creator, creation, listed, status
+                self.changed.add(key)
+
+    def commit(self):
+        """Writes the merge requests changed since the last commit."""
+        self.db.executemany('INSERT OR REPLACE INTO merge_requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            [key + tuple(self.listed[key]) for key in self.changed])
+        self.db.commit()
+        self.changed.clear()
+
+    def writeStatistics(self):
+        """Computes repository_stats and state_counts from the events and listings."""
+
+        # (project, repository, mrq) -> [opened, merged, (time, state) last seen]
+        mrqs = {}
+        for key, row in self.listed.items():
+            mrqs[key] = [row[2] or row[3], None, (row[4], row[5])]
+
+        for project, repository, mrq, event_time, action, new_state in self.db.execute(
+                'SELECT project, repository, mrq, time, action, new_state FROM events ORDER BY time'):
+            state = mrqs.setdefault((project, repository, mrq), [None, None, ('', None)])
+            if event_time is None:
+                continue
+            if action == 'opened' and (state[0] is None or event_time < state[0]):
+                state[0] = event_time
+            if new_state is not None:
+                if new_state in MERGED_STATES and state[1] is None:
+                    state[1] = event_time
+                if event_time >= state[2][0]:
+                    state[2] = (event_time, new_state)
+
+        repositories = {}
+        for (project, repository, mrq), (opened, merged, (last_time, last_state)) in mrqs.items():
+            stats = repositories.setdefault((project, repository), {'count': 0, 'merged': 0, 'hours': [], 'states': {}})
+            stats['count'] += 1
+            if merged is not None:
+                stats['merged'] += 1
+                if opened is not None and opened <= merged:
+                    stats['hours'].append(hours_between(opened, merged))
+            if last_state is not None:
+                stats['states'][last_state] = stats['states'].get(last_state, 0) + 1
+
+        self.db.execute('DELETE FROM repository_stats')
+        self.db.execute('DELETE FROM state_counts')
+        for (project, repository), stats in sorted(repositories.items()):
+            hours = stats['hours']
+            self.db.execute('INSERT INTO repository_stats VALUES (?, ?, ?, ?, ?, ?)',
+                            (project, repository, stats['count'], stats['merged'],
+                             sum(hours) / len(hours) if hours else None, median(hours) if hours else None))
+            self.db.executemany('INSERT INTO state_counts VALUES (?, ?, ?, ?)',
+                                [(project, repository, state, count) for state, count in sorted(stats['states'].items())])
+        self.db.commit()
+
+def run(roots, output, processes=None, chunksize=CHUNKSIZE):
+    """Backfill output from the archives below roots, parsing in processes
+    worker processes, all cores if None, or in this process if 0.
+    Returns a dict with the numbers of files, events and errors."""
+
+    store = BackfillStore(output)
+    pool = None
+    if processes == 0:
+        results = itertools.imap(process_file, find_files(roots))
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(process_file, find_files(roots), chunksize)
+
+    counts = {'files': 0, 'events': 0, 'new_events': 0, 'listings': 0, 'errors': 0}
+    try:
+        for (kind, path, project, repository), result, error in results:
+            counts['files'] += 1
+            if error is not None:
+                print 'Could not process %s: %s' % (path, error)
+                counts['errors'] += 1
+            elif kind == FEED:
+                counts['events'] += len(result)
+                counts['new_events'] += store.addEvents(result)
+            else:
+                counts['listings'] += 1
+                store.addListing(project, repository, *result)
+
+            if counts['files'] % COMMIT_INTERVAL == 0:
+                store.commit()
+                print 'Processed %d files' % counts['files']
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    store.commit()
+    store.writeStatistics()
+    store.close()
+    return counts
@@ -0,0 +1,160 @@
+"""Diagnostics for callbacks that block the reactor.
+
+Callbacks wrapped with traced() record the stage being processed,
+such as the URL being parsed. A Watchdog thread notices when the
+reactor stops running its heartbeat, and prints the stack of the
+reactor thread along with that stage.
+
+Traced callbacks can also be profiled with cProfile, from the start
+or toggled with SIGUSR1, with the statistics dumped to a file
+periodically."""
+
+import sys, time, threading, traceback, signal, cProfile
+
+from twisted.internet import reactor, task
+
+from gitorious_mrq import metrics
+
+STALL_THRESHOLD = 5.0 # Seconds the reactor can be blocked before the watchdog reports it
+HEARTBEAT_INTERVAL = 0.5
+DUMP_INTERVAL = 60 # Seconds between dumps of the profile
+PROFILE_OUTPUT = 'gitorious-mrq-monitor.prof'
+
+stalls = metrics.registry.counter('reactor_stalls_total', 'Times the reactor was blocked longer than the stall threshold.')
+
+_stage = None # What the reactor thread is processing, when in a traced callback
+
+def current_stage():
+    return _stage
+
+def traced(stage, function):
+    """Returns function wrapped to record stage while it runs,
+    and to be profiled when profiling is enabled."""
+
+    def wrapper(*args, **kwargs):
+        global _stage
+        previous = _stage
+        _stage = stage
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            _stage = previous
+    return wrapper
+
+class Watchdog(object):
+    """Reports when the reactor has not run its heartbeat for threshold seconds."""
+
+    def __init__(self, threshold=STALL_THRESHOLD, interval=HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._last_beat = None
+        self._reactor_thread = None
+        self._reported = False # Whether the current stall has been reported
+        self._stopped = threading.Event()
+        self._thread = None
+        self._heartbeat = task.LoopingCall(self.beat)
+
+    def start(self):
+        self._heartbeat.start(self.interval)
+
+        self._thread = threading.Thread(target=self.watch, name='watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat.running:
+            self._heartbeat.stop()
+        if self._thread is not None:
+            self._thread.join(2 * self.interval)
+
+    def beat(self):
+        if self._reported:
+            print 'Reactor running again after %.1f seconds' % (time.time() - self._last_beat)
+        self._last_beat = time.time()
+        self._reactor_thread = threading.current_thread().ident
+        self._reported = False
+
+    def watch(self):
+        while not self._stopped.wait(self.interval):
+            report = self.check(time.time())
+            if report:
+                print report
+
+    def check(self, now):
+        """Returns a report of the stall if the reactor is stalled, and it has not been reported."""
+
+        if self._last_beat is None or self._reported:
+            return None
+
+        blocked = now - self._last_beat
+        if blocked < self.threshold:
+            return None
+
+        self._reported = True
+        stalls.inc()
+
+        frame = sys._current_frames().get(self._reactor_thread)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(no stack)\n'
+        return 'Reactor blocked for %.1f seconds, in stage: %s\n%s' % (blocked, current_stage(), stack)
+
+class Profiler(object):
+    """Profiles traced callbacks while enabled."""
+
+    def __init__(self):
+        self.profile = None
+        self.enabled = False
+        self.output = PROFILE_OUTPUT
+        self._depth = 0 # Traced callbacks can call each other
+
+    def runcall(self, function, *args, **kwargs):
+        if not self.enabled or self._depth:
+            return function(*args, **kwargs)
+
+        self._depth += 1
+        try:
+            return self.profile.runcall(function, *args, **kwargs)
+        finally:
+            self._depth -= 1
+
+    def enable(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+        self.enabled = True
+        print 'Profiling callbacks, writing to %s' % self.output
+
+    def disable(self):
+        self.enabled = False
+        self.dump()
+        print 'Stopped profiling callbacks'
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def dump(self):
+        if self.profile is not None:
+            self.profile.dump_stats(self.output)
+
+    def dumpIfEnabled(self):
+        if self.enabled:
+            self.dump()
+
+profiler = Profiler()
+
+def start_profiling(output=PROFILE_OUTPUT, enabled=False, dump_interval=DUMP_INTERVAL):
+    """Profile traced callbacks to output, toggled by SIGUSR1, and from the start if enabled."""
+
+    profiler.output = output
+    if enabled:
+        profiler.enable()
+
+    def toggle(signum, frame):
+        reactor.callFromThread(profiler.toggle)
+    signal.signal(signal.SIGUSR1, toggle)
+
+    task.LoopingCall(profiler.dumpIfEnabled).start(dump_interval, now=False)
+    reactor.addSystemEventTrigger('before', 'shutdown', profiler.dumpIfEnabled)
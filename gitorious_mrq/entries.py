@@ -0,0 +1,47 @@
+"""Identifying feed entries, and remembering which ones have been seen."""
+
+import hashlib
+
+from collections import OrderedDict
+
+MAX_SEEN_ENTRIES = 1000 # Should be well above the number of entries in a feed page
+
+def entry_key(item):
+    """Returns a stable key identifying the feed entry item.
+
+    Uses the Atom id, falling back to a hash of the link, time of
+    last update and title for feeds, or pushed events, that lack ids."""
+
+    key = item.get('id')
+    if key:
+        return key
+
+    fallback = u'%s %s %s' % (item.get('link', ''), item.get('updated', ''), item.get('title', ''))
+    return 'sha1:' + hashlib.sha1(fallback.encode('utf-8')).hexdigest()
+
+class SeenEntries(object):
+    """A bounded, insertion-ordered set of entry keys.
+
+    When full, the keys that were added (or seen) longest ago are evicted."""
+
+    def __init__(self, max_size=MAX_SEEN_ENTRIES):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def add(self, key):
+        # Re-adding moves the key to the end, so that entries
+        # still present in the feed are not evicted
+        self._keys.pop(key, None)
+        self._keys[key] = True
+
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
@@ -1,53 +1,77 @@
 from twisted.internet import protocol, defer
-from twisted.web import client
 
 import feedparser
 
+from gitorious_mrq import httpcache, workers, metrics, diagnostics
+
 import time, sys, StringIO
 
+from collections import deque
+
 TIMEOUT = 90 # Timeout in seconds for the web request
 
+def parse_feed(feed):
+    try:
+        parsed = feedparser.parse(StringIO.StringIO(feed))
+    except TypeError:
+        parsed = feedparser.parse(StringIO.StringIO(str(feed)))
+
+    # The exception of a malformed feed can hold the XML parser,
+    # which cannot be passed back from a worker process
+    if 'bozo_exception' in parsed:
+        parsed['bozo_exception'] = str(parsed['bozo_exception'])
+    return parsed
+
+parse_seconds = metrics.registry.summary('parse_seconds', 'Time to parse a page, including waiting for a worker.')
+
 class FeederProtocol(object):
     def __init__(self):
         self.parsed = 1
         self.with_errors = 0
-        self.error_list = []
+        self.error_list = deque(maxlen=metrics.MAX_ERRORS) # Most recent errors
 
     def gotError(self, traceback, extra_args):
         print traceback, extra_args
         self.with_errors += 1
         self.error_list.append(extra_args)
+        metrics.errors.inc(stage='feed')
+
+    def notModified(self, failure):
+        failure.trap(httpcache.NotModified)
+        return None # Nothing to parse or process
 
     def parseFeed(self, feed):
-        try:
-            parsed = feedparser.parse(StringIO.StringIO(feed))
-        except TypeError:
-            parsed = feedparser.parse(StringIO.StringIO(str(feed)))
-        return parsed
-
-    def getPage(self, data, args):
-        # TODO: be nice and use HTTP conditional GET to reduce load
-        # http://fishbowl.pastiche.org/2002/10/21/http_conditional_get_for_rss_hackers/
-        # http://www.phppatterns.com/docs/develop/twisted_aggregator
-        return client.getPage(args, timeout=TIMEOUT)
+        if feed is None:
+            return None
+        return parse_seconds.time(workers.run(parse_feed, feed), page='feed')
+
+    def getPage(self, data, args, conditional=True):
+        return httpcache.getPage(args, conditional=conditional, timeout=TIMEOUT, remember=True)
+
+    def processFeed(self, parsed, callback):
+        if parsed is None:
+            return None
+        return callback(parsed)
 
     def printStatus(self, data=None):
-        print "Reading feed"
+        print "Reading feed (%s)" % httpcache.default_cache.stats()
 
-    def start(self, feeds, callback):
+    def start(self, feeds, callback, conditional=True):
+        """With conditional False, the feeds are retrieved even if they did not change."""
         d = defer.succeed(self.printStatus())
 
         for feed in feeds:
             # Fetch page
-            d.addCallback(self.getPage, feed)
+            d.addCallback(diagnostics.traced('getting %s' % feed, self.getPage), feed, conditional)
+            d.addErrback(self.notModified)
             d.addErrback(self.gotError, (feed, 'getting'))
 
             # Parse the feed
-            d.addCallback(self.parseFeed)
+            d.addCallback(diagnostics.traced('parsing %s' % feed, self.parseFeed))
             d.addErrback(self.gotError, (feed, 'parsing'))
 
             # Process it
-            d.addCallback(callback)
+            d.addCallback(diagnostics.traced('processing %s' % feed, self.processFeed), callback)
             d.addErrback(self.gotError, (feed, 'processing'))
 
         return d
@@ -57,5 +81,5 @@ class FeederFactory(protocol.ClientFactory):
     def __init__(self):
         self.protocol.factory = self
 
-    def start(self, feeds, callback):
-        return self.protocol.start(feeds, callback)
+    def start(self, feeds, callback, conditional=True):
+        return self.protocol.start(feeds, callback, conditional)
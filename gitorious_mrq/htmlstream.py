@@ -0,0 +1,252 @@
+"""Streaming extraction of elements from Gitorious pages.
+
+Instead of building a tree of the whole page like BeautifulSoup,
+only the elements of interest are built, and handed out as soon as
+they have been parsed. The elements support the parts of the
+BeautifulSoup Tag API used by gitorious_mrq.scrape, so the same
+extraction code works on both."""
+
+import HTMLParser
+
+CHUNK_SIZE = 16*1024
+
+# Tags that never have contents
+SELF_CLOSING_TAGS = set(['br', 'hr', 'input', 'img', 'meta', 'spacer',
+                         'link', 'frame', 'base', 'col', 'area', 'param'])
+
+# Starting one of these tags closes an open tag of the same kind,
+# unless one of the listed tags was opened after it
+RESET_NESTING_TAGS = {
+    'tr': ('table', 'tbody', 'thead', 'tfoot'),
+    'td': ('tr',),
+    'th': ('tr',),
+    'li': ('ul', 'ol'),
+}
+
+class UnsupportedMarkup(Exception):
+    """The page uses markup the streaming parser does not handle."""
+
+class _StopParsing(Exception):
+    pass
+
+class Comment(unicode):
+    pass
+
+class Element(object):
+    """A parsed element, with a subset of the BeautifulSoup Tag API."""
+
+    __slots__ = ('name', 'attrs', 'contents')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.contents = []
+
+    def find(self, name):
+        """Returns the first descendant element called name, or None."""
+        for child in self.contents:
+            if isinstance(child, Element):
+                if child.name == name:
+                    return child
+                found = child.find(name)
+                if found is not None:
+                    return found
+        return None
+
+    def findAll(self, name):
+        """Returns all descendant elements called name, in document order."""
+        found = []
+        for child in self.contents:
+            if isinstance(child, Element):
+                if child.name == name:
+                    found.append(child)
+                found.extend(child.findAll(name))
+        return found
+
+    __call__ = findAll
+
+    def __getattr__(self, name):
+        return self.find(name)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+    @property
+    def string(self):
+        """The text of the element if it is the only child, else None."""
+        if len(self.contents) != 1 or isinstance(self.contents[0], Element):
+            return None
+
+        text = self.contents[0]
+        if not isinstance(text, Comment) and not text.strip():
+            # Like BeautifulSoup, whitespace-only text is collapsed
+            return u'\n' if '\n' in text else u' '
+        return text
+
+class ElementStreamParser(HTMLParser.HTMLParser):
+    """Builds the elements that isRoot accepts, including their descendants.
+
+    Completed root elements are collected in self.completed."""
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.open_elements = []
+        self.completed = []
+
+    def isRoot(self, name, attrs):
+        raise NotImplementedError
+
+    def handle_starttag(self, name, attrs):
+        reset_by = RESET_NESTING_TAGS.get(name)
+        if reset_by:
+            for element in reversed(self.open_elements):
+                if element.name in reset_by:
+                    break
+                if element.name == name:
+                    self.closeElement(element)
+                    break
+
+        if not self.open_elements and not self.isRoot(name, attrs):
+            return
+
+        element = Element(name, attrs)
+        if self.open_elements:
+            self.open_elements[-1].contents.append(element)
+        if name in SELF_CLOSING_TAGS:
+            if not self.open_elements:
+                self.completed.append(element)
+        else:
+            self.open_elements.append(element)
+
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs)
+        if name not in SELF_CLOSING_TAGS:
+            self.handle_endtag(name)
+
+    def handle_endtag(self, name):
+        for element in reversed(self.open_elements):
+            if element.name == name:
+                self.closeElement(element)
+                break
+
+    def closeElement(self, element):
+        """Close element, and all elements opened after it."""
+        while self.open_elements:
+            closed = self.open_elements.pop()
+            if not self.open_elements:
+                self.completed.append(closed)
+            if closed is element:
+                break
+
+    def closeAll(self):
+        if self.open_elements:
+            self.closeElement(self.open_elements[0])
+
+    def addText(self, text, text_class=unicode):
+        if not self.open_elements:
+            return
+
+        contents = self.open_elements[-1].contents
+        if text_class is unicode and contents and type(contents[-1]) is unicode:
+            contents[-1] += text
+        else:
+            contents.append(text_class(text))
+
+    def handle_data(self, data):
+        self.addText(data)
+
+    # Entities are left as-is, like BeautifulSoup does by default
+    def handle_entityref(self, name):
+        self.addText(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        self.addText(u'&#%s;' % name)
+
+    def handle_comment(self, data):
+        self.addText(data, Comment)
+
+class FirstTableRowParser(ElementStreamParser):
+    """Parses the rows of the first table in the page,
+    and stops when that table ends."""
+
+    def __init__(self):
+        ElementStreamParser.__init__(self)
+        self.in_table = False
+
+    def isRoot(self, name, attrs):
+        return self.in_table and name == 'tr'
+
+    def handle_starttag(self, name, attrs):
+        if name == 'table':
+            if self.in_table:
+                raise UnsupportedMarkup('Nested tables')
+            self.in_table = True
+        ElementStreamParser.handle_starttag(self, name, attrs)
+
+    def handle_endtag(self, name):
+        if name == 'table' and self.in_table:
+            self.closeAll()
+            raise _StopParsing()
+        ElementStreamParser.handle_endtag(self, name)
+
+class AttributeMatchParser(ElementStreamParser):
+    """Parses all elements having the given attribute values."""
+
+    def __init__(self, **attribute_matching):
+        ElementStreamParser.__init__(self)
+        self.attribute_matching = attribute_matching.items()
+
+    def isRoot(self, name, attrs):
+        attrs = dict(attrs)
+        for key, value in self.attribute_matching:
+            if attrs.get(key) != value:
+                return False
+        return True
+
+    def handle_starttag(self, name, attrs):
+        if self.open_elements and self.isRoot(name, attrs):
+            raise UnsupportedMarkup('Nested matching elements')
+        ElementStreamParser.handle_starttag(self, name, attrs)
+
+def _chunks(html_page):
+    if isinstance(html_page, str):
+        html_page = html_page.decode('utf-8')
+
+    for start in range(0, len(html_page), CHUNK_SIZE):
+        yield html_page[start:start+CHUNK_SIZE]
+
+def iter_elements(parser, html_page):
+    """Feed html_page to parser, yielding root elements as they are completed.
+
+    Raises UnicodeDecodeError for pages that are not UTF-8,
+    and UnsupportedMarkup or HTMLParseError for markup that
+    BeautifulSoup should be used for instead."""
+
+    try:
+        for chunk in _chunks(html_page):
+            parser.feed(chunk)
+            for element in parser.completed:
+                yield element
+            del parser.completed[:]
+
+        parser.close()
+        parser.closeAll()
+    except _StopParsing:
+        pass
+
+    for element in parser.completed:
+        yield element
+
+def table_rows(html_page):
+    """Yields the rows of the first table in html_page."""
+
+    parser = FirstTableRowParser()
+    for row in iter_elements(parser, html_page):
+        yield row
+
+    if not parser.in_table:
+        raise UnsupportedMarkup('No table in page')
+
+def matching_elements(html_page, **attribute_matching):
+    """Yields the elements of html_page having the given attribute values."""
+    return iter_elements(AttributeMatchParser(**attribute_matching), html_page)
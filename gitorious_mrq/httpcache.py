@@ -0,0 +1,146 @@
+"""HTTP conditional GET support.
+
+Remembers the ETag and Last-Modified validators of the pages we
+retrieve, so that the next request for the same URL can ask the server
+to only send the page if it changed.
+See http://fishbowl.pastiche.org/2002/10/21/http_conditional_get_for_rss_hackers/"""
+
+import os, json
+
+from twisted.internet import reactor
+
+from gitorious_mrq import httpclient, scheduler
+
+TIMEOUT = 90 # Timeout in seconds for the web request
+SAVE_DELAY = 10 # Seconds changed validators are collected before saving them
+
+class NotModified(Exception):
+    """Raised when the server responded 304 Not Modified."""
+
+class ValidatorCache(object):
+    """Stores the validators for each URL, optionally persisted
+    to a JSON file so that they survive restarts.
+    Changes are saved at most save_delay seconds after they happen,
+    or when flush is called."""
+
+    def __init__(self, path=None, save_delay=SAVE_DELAY, clock=reactor):
+        self.path = path
+        self.save_delay = save_delay
+        self.clock = clock
+        self._save_call = None
+        self.validators = {}
+        self.last_headers = {} # Headers of the response to the last request for each URL, not persisted
+        self.hits = 0 # Requests answered with 304 Not Modified
+        self.misses = 0 # Requests answered with the full page
+
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def load(self):
+        try:
+            self.validators = json.load(open(self.path))
+        except ValueError:
+            print 'Warning: Ignoring corrupt validator cache %s' % self.path
+            self.validators = {}
+
+    def scheduleSave(self):
+        if self.path and self._save_call is None:
+            self._save_call = self.clock.callLater(self.save_delay, self.flush)
+
+    def flush(self):
+        """Save pending changes now."""
+        if self._save_call is None:
+            return
+        if self._save_call.active():
+            self._save_call.cancel()
+        self._save_call = None
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+
+        # Write to a temporary file first, so a crash cannot leave
+        # behind a half-written cache
+        tmp_path = self.path + '.tmp'
+        f = open(tmp_path, 'w')
+        json.dump(self.validators, f)
+        f.close()
+        os.rename(tmp_path, self.path)
+
+    def headersFor(self, url):
+        """Returns the request headers for a conditional GET of url."""
+
+        headers = {}
+        validators = self.validators.get(url, {})
+
+        if validators.get('etag'):
+            headers['If-None-Match'] = str(validators['etag'])
+        if validators.get('last-modified'):
+            headers['If-Modified-Since'] = str(validators['last-modified'])
+
+        return headers
+
+    def update(self, url, response_headers):
+        """Remember the validators from response_headers,
+        a dict mapping lower-case header names to lists of values."""
+
+        validators = {}
+        for name in ('etag', 'last-modified'):
+            values = response_headers.get(name)
+            if values:
+                validators[name] = values[-1]
+
+        if self.validators.get(url) != validators:
+            if validators:
+                self.validators[url] = validators
+            else:
+                self.validators.pop(url, None)
+            self.scheduleSave()
+
+    def stats(self):
+        return '%d not modified, %d retrieved' % (self.hits, self.misses)
+
+default_cache = ValidatorCache()
+
+def getPage(url, cache=None, conditional=True, timeout=TIMEOUT, remember=None):
+    """Retrieve url using a conditional GET.
+
+    Returns a Deferred that fires with the page contents,
+    or fails with NotModified if the page did not change since it
+    was last retrieved.
+
+    The validators of the response are remembered if remember is true,
+    by default only for conditional GETs. Pass remember=True for pages
+    retrieved unconditionally that will be requested again."""
+
+    if cache is None:
+        cache = default_cache
+    if remember is None:
+        remember = conditional
+
+    headers = {}
+    if conditional:
+        headers = cache.headersFor(url)
+
+    def gotPage(page):
+        cache.last_headers[url] = page.headers
+        if page.code == 304:
+            cache.hits += 1
+            raise NotModified(url)
+
+        cache.misses += 1
+        if remember:
+            cache.update(url, page.headers)
+        return page.body
+
+    def gotError(failure):
+        failure.trap(httpclient.HTTPError)
+        cache.last_headers[url] = failure.value.headers
+        return failure
+
+    # No headers are left from an earlier response if this request gets none
+    cache.last_headers.pop(url, None)
+    d = scheduler.getScheduler().fetch(url, headers, timeout=timeout)
+    d.addCallbacks(gotPage, gotError)
+    return d
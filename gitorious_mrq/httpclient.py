@@ -0,0 +1,205 @@
+"""Shared HTTP client used for all retrieval of feeds and pages.
+
+Keeps connections to the Gitorious host open between requests
+and asks for gzip compressed responses. The number of concurrent
+requests per host is limited by gitorious_mrq.scheduler."""
+
+import os, json, hashlib
+
+from twisted.internet import reactor, defer, task
+from twisted.web import client, error
+from twisted.web.http_headers import Headers
+
+TIMEOUT = 90 # Timeout in seconds for the web request
+CONNECT_TIMEOUT = 30
+MAX_PER_HOST = 4 # Maximum number of connections kept open to one host
+USER_AGENT = 'gitorious-mrq-monitor'
+
+class Page(object):
+    """A retrieved page.
+
+    headers maps lower-case header names to lists of values."""
+
+    def __init__(self, url, code, headers, body):
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self.body = body
+
+class HTTPError(error.Error):
+    """An error response. headers is like for Page."""
+
+    def __init__(self, code, message, response, headers):
+        error.Error.__init__(self, code, message, response)
+        self.headers = headers
+
+class HTTPClient(object):
+
+    def __init__(self, max_per_host=MAX_PER_HOST):
+        self.pool = client.HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_per_host
+
+        agent = client.Agent(reactor, connectTimeout=CONNECT_TIMEOUT, pool=self.pool)
+        self.agent = client.ContentDecoderAgent(agent, [('gzip', client.GzipDecoder)])
+
+    def request(self, url, headers=None, timeout=TIMEOUT):
+        """Retrieve url with a GET request.
+
+        Returns a Deferred firing with a Page. Fails with
+        HTTPError for responses that are not 2xx or 304."""
+
+        headers = headers or {}
+        request_headers = Headers({'User-Agent': [USER_AGENT]})
+        for name, value in headers.items():
+            request_headers.setRawHeaders(name, [value])
+
+        d = self.agent.request('GET', url, request_headers)
+        d.addCallback(self._readBody, url)
+        d.addTimeout(timeout, reactor)
+        return d
+
+    def _readBody(self, response, url):
+        d = client.readBody(response)
+        d.addErrback(self._partialBody)
+        d.addCallback(self._gotBody, response, url)
+        return d
+
+    def _partialBody(self, failure):
+        # Servers that close the connection without sending a
+        # Content-Length still gave us the whole page
+        failure.trap(client.PartialDownloadError)
+        return failure.value.response
+
+    def _gotBody(self, body, response, url):
+        headers = {}
+        for name, values in response.headers.getAllRawHeaders():
+            headers[name.lower()] = values
+
+        if not (200 <= response.code < 300 or response.code == 304):
+            raise HTTPError(str(response.code), response.phrase, body, headers)
+
+        return Page(url, response.code, headers, body)
+
+    def close(self):
+        """Close the cached connections. Returns a Deferred."""
+        return self.pool.closeCachedConnections()
+
+class RecordingClient(object):
+    """Wraps another client, writing every response to a directory.
+
+    Each response is stored as NNNNNN-HASH.json with the metadata, and
+    NNNNNN-HASH.body with the body as retrieved. NNNNNN is the sequence
+    number of the request, HASH identifies the URL."""
+
+    def __init__(self, client, directory):
+        self.client = client
+        self.directory = directory
+        self.sequence = 0
+        self.url_sequence = {}
+        self.started = reactor.seconds()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def request(self, url, headers=None, timeout=TIMEOUT):
+        d = self.client.request(url, headers, timeout)
+        d.addCallbacks(self._gotPage, self._gotError, callbackArgs=(url,), errbackArgs=(url,))
+        return d
+
+    def _gotPage(self, page, url):
+        self.record(url, page.code, page.headers, page.body)
+        return page
+
+    def _gotError(self, failure, url):
+        if failure.check(HTTPError):
+            self.record(url, int(failure.value.status), failure.value.headers, failure.value.response)
+        else:
+            self.record(url, None, {}, '', failure.getErrorMessage())
+        return failure
+
+    def close(self):
+        return self.client.close()
+
+    def record(self, url, code, headers, body, error_message=None):
+        self.sequence += 1
+        self.url_sequence[url] = self.url_sequence.get(url, 0) + 1
+
+        name = '%06d-%s' % (self.sequence, hashlib.sha1(url).hexdigest()[:12])
+        meta = {
+            'url': url,
+            'sequence': self.url_sequence[url],
+            'time': reactor.seconds() - self.started,
+            'code': code,
+            'headers': headers,
+            'error': error_message,
+        }
+
+        with open(os.path.join(self.directory, name + '.body'), 'wb') as f:
+            f.write(body or '')
+        with open(os.path.join(self.directory, name + '.json'), 'w') as f:
+            json.dump(meta, f, indent=1, sort_keys=True)
+
+class ReplayedError(Exception):
+    """A recorded failure that was not an HTTP error response, like a timeout."""
+
+class ReplayClient(object):
+    """Serves responses written by RecordingClient, without network access.
+
+    Responses for a URL are served in the order they were recorded.
+    When they run out, the last one is served again. With realtime,
+    responses are delayed until the time they were originally received."""
+
+    def __init__(self, directory, realtime=False):
+        self.realtime = realtime
+        self.started = reactor.seconds()
+        self.responses = {} # url -> list of recorded responses
+
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json'):
+                continue
+
+            path = os.path.join(directory, filename)
+            meta = json.load(open(path))
+            meta['body'] = open(path[:-len('.json')] + '.body', 'rb').read()
+            self.responses.setdefault(str(meta['url']), []).append(meta)
+
+    def request(self, url, headers=None, timeout=TIMEOUT):
+        responses = self.responses.get(url)
+        if not responses:
+            return defer.fail(HTTPError('404', 'No recorded response for %s' % url, '', {}))
+
+        response = responses[0]
+        if len(responses) > 1:
+            responses.pop(0)
+
+        delay = 0
+        if self.realtime:
+            delay = max(0, response['time'] - (reactor.seconds() - self.started))
+        return task.deferLater(reactor, delay, self._respond, url, response)
+
+    def _respond(self, url, response):
+        if response['error'] is not None:
+            raise ReplayedError(response['error'])
+
+        headers = dict((str(name), [str(value) for value in values])
+                       for name, values in response['headers'].items())
+        code = response['code']
+        if not (200 <= code < 300 or code == 304):
+            raise HTTPError(str(code), 'Replayed error', response['body'], headers)
+        return Page(url, code, headers, response['body'])
+
+    def close(self):
+        return defer.succeed(None)
+
+_client = None
+
+def getClient():
+    """Returns the HTTP client shared by the whole process."""
+    global _client
+    if _client is None:
+        _client = HTTPClient()
+    return _client
+
+def setClient(http_client):
+    global _client
+    _client = http_client
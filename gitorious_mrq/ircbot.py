@@ -1,30 +1,50 @@
-import HTMLParser, re
+import HTMLParser, re, string
 
+from collections import OrderedDict, deque
+
+from zope.interface import implementer
 from twisted.words.protocols import irc
-from twisted.internet import protocol, task
+from twisted.internet import protocol, reactor, defer
+
+from gitorious_mrq import feedreader, scrape, entries, scheduler, polling, httpcache, outqueue, metrics, workers, model, mentions, monitor, routing
 
-from gitorious_mrq import feedreader, scrape
+feed_items = metrics.registry.counter('feed_items_total', 'Feed entries read, new or already seen.')
+feed_gaps = metrics.registry.counter('feed_gaps_total', 'Polls of the feed with no entry seen before, and whether the gap was closed.')
+catchup_pages = metrics.registry.counter('feed_catchup_pages_total', 'Older pages of the feed fetched to close gaps.')
+messages = metrics.registry.counter('messages_total', 'Messages reported about merge requests.')
+irc_queue_depth = metrics.registry.gauge('irc_queue_depth', 'Lines waiting to be sent to IRC.')
+irc_lines = metrics.registry.counter('irc_lines_total', 'Lines sent to IRC, and broadcasts dropped or merged into digests.')
+snapshot_changes = metrics.registry.counter('snapshot_changes_total', 'Merge requests opened, closed or changing state between snapshots.')
 
 class GitoriousMergeRequestMessager(object):
     """Process Gitorious RSS and report messages for new merge requests.
 
     Call processRss on it to let it process an updated RSS feed.
     For each new message, message_callback as passed in the constructor
-    will be called."""
+    will be called.
+
+    If a store is given, the seen entries are kept in it,
+    so that entries are not reported again after a restart."""
 
     @staticmethod
     def items_equal(item1, item2):
         return False
 
-    def __init__(self, host, project, message_callback):
+    def __init__(self, host, project, message_callback, store=None):
         self.callback = message_callback
         self.project = project
         self.host = host
-        self.old_items = []
+        self.seen = entries.SeenEntries()
+        self.mrq_regexp = re.compile(r'.*(merge request %(project)s/(\S*)\s*#(\d*)).*' % {'project': re.escape(project)})
+
+        self.store = store
+        self.store_key = scrape.project_page_url_template % dict(host=host, project=project)
+        if self.store is not None:
+            self.store.loadSeenEntries(self.store_key, self.seen)
 
         # Used to avoid outputting RSS items that exists in the feed
-        # at startup
-        self.first_run = True
+        # at startup. Not needed if we know what was seen before.
+        self.first_run = not self.seen
 
     def getNewItems(self, parsed_feed):
         items = parsed_feed.get('items', [])
@@ -33,24 +53,79 @@ class GitoriousMergeRequestMessager(object):
             print 'Warning: No items found in feed, likely error'
             return []
 
-        new_items = []
-        for item in items:
-            # TODO: implement more robust way of identifying entries
-            if not item in self.old_items:
-                new_items.append(item)
+        keys = [entries.entry_key(item) for item in items]
+        new_items = [item for item, key in zip(items, keys) if key not in self.seen]
+        feed_items.inc(len(new_items), result='new')
+        feed_items.inc(len(items) - len(new_items), result='seen')
+
+        # Feed is newest first, add the oldest keys first
+        keys.reverse()
+        for key in keys:
+            self.seen.add(key)
 
-        self.old_items = items
         return new_items
 
+    def hasGap(self, parsed_feed):
+        """Whether entries could be missing between parsed_feed and the entries seen
+        before, because none of its entries have been seen."""
+
+        items = parsed_feed.get('items', [])
+        if self.first_run or not self.seen or not items:
+            return False
+        return not self.overlapsSeen(items)
+
+    def overlapsSeen(self, items):
+        return any(entries.entry_key(item) in self.seen for item in items)
+
     def processRss(self, parsed_feed):
+        """Returns the new items in parsed_feed."""
         new_items = self.getNewItems(parsed_feed)
+        self.reportItems(new_items, quiet=self.first_run)
+        self.first_run = False
+        return new_items
+
+    def processPushedItems(self, items):
+        """Like processRss, for feed-like items pushed to us, newest first.
+        New items are reported even before the feed has been read."""
+        new_items = self.getNewItems({'items': items})
+        self.reportItems(new_items)
+        return new_items
 
-        for item in new_items:
+    def reportItems(self, new_items, quiet=False):
+        # Report the oldest first
+        for item in reversed(new_items):
             msg = self.itemToMessage(item)
-            if msg and not self.first_run:
+            if msg and not quiet:
+                messages.inc()
                 self.callback(msg)
 
-        self.first_run = False
+        if self.store is not None and new_items:
+            keys = [entries.entry_key(item) for item in new_items]
+            keys.reverse()
+            self.store.addSeenEntries(self.store_key, keys)
+
+    @staticmethod
+    def isMergeRequestItem(title):
+        # We are only interested in merge requests,
+        # but not in comments on them (too noisy)
+        return 'merge request' in title and not 'commented' in title
+
+    def mentionedRepositories(self, items):
+        """Returns the set of repositories with merge request activity in items."""
+
+        repositories = set()
+        h = HTMLParser.HTMLParser()
+
+        for item in items:
+            title = item.get('title', '')
+            if not self.isMergeRequestItem(title):
+                continue
+
+            match = self.mrq_regexp.match(h.unescape(title))
+            if match is not None:
+                repositories.add(match.group(2))
+
+        return repositories
 
     def itemToMessage(self, item):
 
@@ -59,11 +134,9 @@ class GitoriousMergeRequestMessager(object):
         # Typical title
         """jonnor updated merge request maliit/maliit-buildbot-configuration #1&#x2192; State changed from Go ahead and merge to Updated"""
 
-        # We are only interested in merge requests,
-        # but not in comments on them (too noisy)
         title = item.get('title', '')
 
-        if 'merge request' in title and not 'commented' in title:
+        if self.isMergeRequestItem(title):
             msg = '%s' % title
 
             h = HTMLParser.HTMLParser()
@@ -71,10 +144,7 @@ class GitoriousMergeRequestMessager(object):
 
             mrq_link = '%(host)s/%(project)s/%(repository)s/merge_requests/%(mrq)s'
 
-            # PERF: Could compile the RE
-            regexp = r'.*(merge request %(project)s/(\S*)\s*#(\d*)).*' % {'project': self.project}
-
-            match = re.match(regexp, msg)
+            match = self.mrq_regexp.match(msg)
 
             if match is None:
                 print msg
@@ -87,86 +157,463 @@ class GitoriousMergeRequestMessager(object):
 
         return msg
 
-# TODO: fix up the design
-# Issue: It is hard to add a monitor that is independent from the ircbot
-# Mainly because IrcBot should not be owned by the IrcBotFactory
-#
-# Solution: Invert the ownership of IrcBot and IrcBotFactory
-# Create class Monitor(IService)
-# Make it have the responsibility IrcBot has now
-# Have a getIrcBot() method that returns
-#
-# See http://twistedmatrix.com/documents/current/core/howto/tutorial/style.html
-
-# NOTE: If there is a need to make this stuff 'general'
-# one could refactor the responsibilities of the service into two aspects:
-# IMrqStatusProvider - provides updates about (example impl: RSS feed, gitorious webhooks*)
-# IMrqStatusNotifier - notifies about such updates (example impl: IRC, stdout, website)
-#
-# * if they ever materialize
-#
-# The Monitor service is then responsible for creating instances of such components
-# and hooking them up to eachother.
-#
-# For this to work sanely there would need to be a generic data-structure
-# describing the merge request. As long as the only way to get the data is RSS
-# this is very likely not worth it.
+FULL_RESCAN_INTERVAL = 60*60 # Seconds between rescans of all repositories
+MAX_POLL_INTERVAL = 30*60 # Longest interval between polls of a quiet feed
+SNAPSHOT_TTL = 10*60 # Seconds a full scan is answered from without refreshing it
+COLD_TIMEOUT = 30 # Seconds to wait for a scan when there is no data
+PUSHED_POLL_INTERVAL = 30*60 # Shortest interval between polls while events are pushed to us
+PUSH_EXPIRY = 2 # Pushed poll intervals without pushes before polling at the normal rate
+MAX_FEED_PAGES = 5 # Pages of the feed to read, at most, to catch up on missed entries
+MAX_JOIN_LENGTH = 400 # Channels are joined with as few JOIN lines as fit in this
 
 class IrcBot(object):
     """Bot "business logic". Periodically polls the RSS feed and
-    processes it."""
+    processes it.
 
-    def __init__(self, host, project, poll_interval):
-        self.check_rss_task = task.LoopingCall(self.checkForUpdates)
-        self.processor = GitoriousMergeRequestMessager(host, project, self.outputMessage)
-        self.protocol = None
+    The feed is polled every poll_interval while there is activity,
+    backing off up to max_poll_interval while it stays unchanged.
+
+    The open merge requests are kept as a snapshot per repository.
+    Only the repositories mentioned in new feed items are scraped again,
+    with a full rescan of the project every FULL_RESCAN_INTERVAL.
+
+    Listings of the open merge requests are served stale-while-revalidate:
+    a snapshot older than SNAPSHOT_TTL is answered from while it is
+    being refreshed, and without a snapshot the answer waits for it.
+
+    When none of the entries in the feed have been seen before, entries
+    could have been missed. Older pages of the feed are then read, up to
+    max_feed_pages in all, until they reach entries seen before.
+
+    Events can also be pushed to the bot with processPushedItems.
+    While they are, the feed is only polled as a safety net, at most
+    every pushed_poll_interval.
+
+    The merge requests in the snapshot are also indexed by (repository, id).
+    Each update of the snapshot is compared with the previous one, and
+    the opened, closed and state changed merge requests are passed to
+    the listeners added with addChangeListener.
+
+    Messages about feed entries and changes of the snapshot are published
+    as monitor.Events to the Monitor the bot is added to.
+
+    Merge requests mentioned in the channels are answered from the
+    snapshot, at most once every mention_cooldown.seconds per channel."""
+
+    def __init__(self, host, project, poll_interval, max_poll_interval=MAX_POLL_INTERVAL, store=None,
+                 channels=None):
+        self.poller = polling.AdaptivePoller(self.checkForUpdates, poll_interval, max_poll_interval)
+        self.processor = GitoriousMergeRequestMessager(host, project, self.outputMessage, store)
+        self.monitor = None
         self.host = host
         self.project = project
+        self.channels = channels or []
         self.poll_interval = poll_interval
         self.is_running = False
-        self._open_merge_requests = None # None meaning invalid data
+        self.clock = reactor
+        self._repo_snapshot = None # None meaning invalid data
+        self._index = {} # (repository, id) -> MergeRequest, for the snapshot
+        self._change_listeners = []
+        self._mention_matcher = None # (snapshot version, MentionMatcher)
+        self.mention_cooldown = mentions.Cooldown()
+        self._snapshot_time = None # Time of the last full scan
+        self.snapshot_version = 0 # Increased on every change of the snapshot
+        self._listing = None # (snapshot version, formatted listing)
+        self._waiting = [] # Deferreds waiting for a snapshot
+        self._last_full_rescan = None
+        self.pushed_poll_interval = PUSHED_POLL_INTERVAL
+        self.max_feed_pages = MAX_FEED_PAGES
+        self._last_push = None
+
+        # Start with the state from the previous run
+        self.store = store
+        self.store_key = self.processor.store_key
+        if self.store is not None:
+            self.setSnapshot(self.store.loadSnapshot(self.store_key))
+            self._snapshot_time = self.store.getValue(self.store_key, 'snapshot_time')
+            self._last_full_rescan = self.store.getValue(self.store_key, 'last_full_rescan')
 
     def start(self):
-        self.check_rss_task.start(self.poll_interval)
+        self.poller.start()
         self.is_running = True
 
     def stop(self):
         if self.is_running:
-            self.check_rss_task.stop()
+            self.poller.stop()
         self.is_running = False
 
+    @property
+    def effective_poll_interval(self):
+        """The current interval between polls of the feed, in seconds."""
+        return self.poller.interval
+
     def checkForUpdates(self):
+        """Returns a Deferred firing with whether there was new activity."""
+
+        if self.fullRescanDue():
+            self.triggerOpenMergeRequestsUpdate()
+
+        self.checkPushExpiry()
+
         # Check feed for activity
         feed = scrape.project_activity_feed_template % dict(host=self.host, project=self.project)
+        self._had_activity = False
         f = feedreader.FeederFactory()
-        d = f.start([feed], self.processNewRss)
+        # Until the feed has been read once, there is no baseline to compare
+        # a 304 against, like after a restart with saved validators
+        d = f.start([feed], self.processNewRss, conditional=not self.processor.first_run)
+        d.addCallback(self.polledFeed, feed)
+        return d
+
+    def checkPushExpiry(self):
+        if self._last_push is not None and self.clock.seconds() - self._last_push >= PUSH_EXPIRY*self.pushed_poll_interval:
+            print 'No events pushed for %s, polling at the normal rate' % self.project
+            self._last_push = None
+            self.poller.setMinInterval(self.poll_interval)
+
+    def polledFeed(self, result, feed):
+        hint = polling.poll_hint(httpcache.default_cache.last_headers.get(feed, {}))
+        if hint:
+            self.poller.serverHint(hint)
+        return self._had_activity
 
     def processNewRss(self, parsed_feed):
-        self.processor.processRss(parsed_feed)
-        # There was some new activity, update our state
-        self.triggerOpenMergeRequestsUpdate()
-    
+        if self.processor.hasGap(parsed_feed) and self.max_feed_pages > 1:
+            print 'No entry in the feed of %s seen before, reading older pages' % self.project
+            items = list(parsed_feed.get('items', []))
+            d = self.fetchOlderPages(items, 2)
+            d.addCallback(self.processItems)
+            return d
+
+        self.processItems(parsed_feed)
+
+    def getFeedPage(self, page):
+        """Returns a Deferred firing with page number page of the feed, parsed."""
+
+        url = scrape.project_activity_feed_page_template % dict(host=self.host, project=self.project, page=page)
+        d = httpcache.getPage(url, conditional=False)
+        d.addCallback(lambda feed: feedreader.parse_seconds.time(workers.run(feedreader.parse_feed, feed), page='feed'))
+        return d
+
+    def fetchOlderPages(self, items, page):
+        """Returns a Deferred firing with a feed of items followed by the
+        entries of older pages, starting at page, until one of them has been seen."""
+
+        catchup_pages.inc()
+        d = self.getFeedPage(page)
+        d.addCallback(self.gotOlderPage, items, page)
+        d.addErrback(self.olderPageFailed, items, page)
+        return d
+
+    def gotOlderPage(self, parsed_feed, items, page):
+        # New entries shift the pages, skip those we already have
+        keys = set(entries.entry_key(item) for item in items)
+        older = [item for item in parsed_feed.get('items', []) if entries.entry_key(item) not in keys]
+        items.extend(older)
+
+        if self.processor.overlapsSeen(older):
+            feed_gaps.inc(result='closed')
+        elif not older:
+            print 'No older entries in the feed of %s, the gap could not be closed' % self.project
+            feed_gaps.inc(result='open')
+        elif page >= self.max_feed_pages:
+            print 'Read %d pages of the feed of %s without closing the gap, entries may be missed' % (
+                page, self.project)
+            feed_gaps.inc(result='open')
+        else:
+            return self.fetchOlderPages(items, page + 1)
+
+        return {'items': items}
+
+    def olderPageFailed(self, failure, items, page):
+        print 'Could not read page %d of the feed of %s: %s' % (page, self.project, failure.getErrorMessage())
+        feed_gaps.inc(result='open')
+        return {'items': items}
+
+    def processItems(self, parsed_feed):
+        new_items = self.processor.processRss(parsed_feed)
+        self._had_activity = bool(new_items)
+        self.updateForItems(new_items)
+
+    def processPushedItems(self, items):
+        """Handle feed-like items pushed to us, newest first.
+        Returns the items that had not been seen before."""
+
+        if self._last_push is None:
+            print 'Events pushed for %s, polling every %d seconds' % (self.project, self.pushed_poll_interval)
+            self.poller.setMinInterval(max(self.poll_interval, self.pushed_poll_interval))
+        self._last_push = self.clock.seconds()
+
+        new_items = self.processor.processPushedItems(items)
+        self.updateForItems(new_items)
+        return new_items
+
+    def updateForItems(self, new_items):
+        # Update our state for the repositories with new activity
+        repositories = set(self.snapshotRepositoryName(repo) for repo in
+                           self.processor.mentionedRepositories(new_items))
+        if self._repo_snapshot is None:
+            self.triggerOpenMergeRequestsUpdate()
+        elif repositories:
+            self.triggerRepositoriesUpdate(repositories)
+
+    def snapshotRepositoryName(self, repo):
+        """The feed names repositories without the project,
+        the project page may name them with it."""
+        if self._repo_snapshot is not None:
+            prefixed = '%s/%s' % (self.project, repo)
+            if repo not in self._repo_snapshot and prefixed in self._repo_snapshot:
+                return prefixed
+        return repo
+
+    def fullRescanDue(self):
+        if self._last_full_rescan is None:
+            return True
+        return self.clock.seconds() - self._last_full_rescan >= FULL_RESCAN_INTERVAL
+
     def triggerOpenMergeRequestsUpdate(self):
+        self._last_full_rescan = self.clock.seconds()
+        if self.store is not None:
+            self.store.setValue(self.store_key, 'last_full_rescan', self._last_full_rescan)
         f = scrape.MergeRequestRetriever()
-        d = f.start(self.host, self.project)
+        key = ('refresh', self.host, self.project)
+        d = scheduler.getScheduler().coalesce(key, f.start, self.host, self.project)
         d.addCallback(self.updateOpenMergeRequests)
 
+    def triggerRepositoriesUpdate(self, repositories):
+        f = scrape.MergeRequestRetriever()
+        key = ('refresh', self.host, self.project, tuple(sorted(repositories)))
+        d = scheduler.getScheduler().coalesce(key, f.startRepositories, self.host, self.project, repositories)
+        d.addCallback(self.updateRepositories, repositories)
+
+    @staticmethod
+    def groupByRepository(mrqs):
+        """Returns an OrderedDict of repository -> list of MergeRequest."""
+        grouped = OrderedDict()
+        for mrq in mrqs:
+            mrq = model.MergeRequest.fromDict(mrq)
+            grouped.setdefault(mrq.repository, []).append(mrq)
+        return grouped
+
+    def setSnapshot(self, snapshot):
+        """Replace the snapshot, which may be None, and its index."""
+
+        if snapshot is not None:
+            snapshot = OrderedDict((repo, [model.MergeRequest.fromDict(mrq) for mrq in mrqs])
+                                   for repo, mrqs in snapshot.items())
+        self._repo_snapshot = snapshot
+        self._index = model.index(self.snapshotMergeRequests()) if snapshot is not None else {}
+
     def updateOpenMergeRequests(self, mrqs):
-        self._open_merge_requests = mrqs
+        if mrqs is None:
+            self.notifyWaiting()
+            return
+
+        previous = self.snapshotMergeRequests() if self._repo_snapshot is not None else None
+        self._repo_snapshot = self.groupByRepository(mrqs)
+        self._index = model.index(self.snapshotMergeRequests())
+        self._snapshot_time = self.clock.seconds()
+        if previous is not None:
+            self.reportChanges(model.diff(previous, self.snapshotMergeRequests()))
+        self.snapshotChanged(None)
+
+    def updateRepositories(self, mrqs, repositories):
+        if mrqs is None or self._repo_snapshot is None:
+            return
+
+        grouped = self.groupByRepository(mrqs)
+        changes = []
+        for repo in repositories:
+            previous = self._repo_snapshot.get(repo, [])
+            current = grouped.get(repo, [])
+            for mrq in previous:
+                self._index.pop(mrq.key, None)
+            for mrq in current:
+                self._index[mrq.key] = mrq
+            changes.extend(model.diff(previous, current))
+
+            if current:
+                self._repo_snapshot[repo] = current
+            else:
+                self._repo_snapshot.pop(repo, None)
+        self.reportChanges(changes)
+        self.snapshotChanged(repositories)
+
+    def getMergeRequest(self, repository, id):
+        """Returns the open MergeRequest in the snapshot, or None."""
+        return self._index.get((repository, id))
+
+    def addChangeListener(self, listener):
+        """Call listener(bot, changes) with the model.Change list of every update of the snapshot."""
+        self._change_listeners.append(listener)
+
+    def reportChanges(self, changes):
+        if not changes:
+            return
+
+        for change in changes:
+            snapshot_changes.inc(kind=change.kind)
+        for listener in self._change_listeners:
+            listener(self, changes)
+
+        for change in changes:
+            self.publish(monitor.Event(change.kind, self, self.changeToMessage(change), change))
+
+    def mrqUrl(self, mrq):
+        return scrape.mrq_page_url_template % dict(
+            host=self.host, repo=scrape.repository_path(self.project, mrq.repository), id=mrq.id)
+
+    def changeToMessage(self, change):
+        return model.format_change(change, self.mrqUrl(change.mrq))
+
+    def mentionMatcher(self):
+        """The MentionMatcher for the repositories in the snapshot, or None without a snapshot."""
+
+        if self._repo_snapshot is None:
+            return None
+        if self._mention_matcher is None or self._mention_matcher[0] != self.snapshot_version:
+            matcher = self._mention_matcher[1] if self._mention_matcher is not None else None
+            repositories = tuple(self._repo_snapshot)
+            if matcher is None or matcher.repositories != repositories:
+                matcher = mentions.MentionMatcher(self.project, repositories)
+            self._mention_matcher = (self.snapshot_version, matcher)
+        return self._mention_matcher[1]
+
+    def mentionMessages(self, channel, text):
+        """Returns messages with the summary and link of the open merge
+        requests mentioned in text, unless recently answered in channel."""
+
+        matcher = self.mentionMatcher()
+        if matcher is None:
+            return []
+
+        messages = []
+        for repo, id in matcher.findMentions(text):
+            mrq = self.getMergeRequest(repo, id)
+            if mrq is None or not self.mention_cooldown.ready((channel, repo, id), self.clock.seconds()):
+                continue
+            messages.append('%s #%s: %s (%s) %s' % (
+                mrq.repository, mrq.id, (mrq.summary or '').strip(), mrq.status, self.mrqUrl(mrq)))
+        return messages
+
+    def snapshotChanged(self, repositories):
+        """repositories are those refreshed, or None after a full scan."""
+        self.snapshot_version += 1
+        self.saveSnapshot(repositories)
+        self.notifyWaiting()
+
+    def saveSnapshot(self, repositories=None):
+        if self.store is None:
+            return
+        if repositories is None:
+            self.store.saveSnapshot(self.store_key, self._repo_snapshot, self._snapshot_time)
+        else:
+            self.store.saveRepositories(self.store_key, self._repo_snapshot, repositories)
+
+    def notifyWaiting(self):
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            if not d.called: # Could have timed out
+                d.callback(self.listing())
+
+    def snapshotMergeRequests(self):
+        mrqs = []
+        for repo_mrqs in self._repo_snapshot.values():
+            mrqs.extend(repo_mrqs)
+        return mrqs
+
+    def cachedMergeRequests(self):
+        """The merge requests in the snapshot, or None without one.
+        Unlike open_merge_requests, never starts a scan."""
+        if self._repo_snapshot is None:
+            return None
+        return self.snapshotMergeRequests()
 
     @property
     def open_merge_requests(self):
-        if self._open_merge_requests is None:
+        if self._repo_snapshot is None:
             self.triggerOpenMergeRequestsUpdate()
-        
-        return self._open_merge_requests
+            return None
+        return self.snapshotMergeRequests()
+
+    def isStale(self):
+        if self._snapshot_time is None:
+            return True
+        return self.clock.seconds() - self._snapshot_time >= SNAPSHOT_TTL
+
+    def listing(self):
+        """The open merge requests formatted for output, or None if there is no data."""
+
+        if self._repo_snapshot is None:
+            return None
+        if self._listing is None or self._listing[0] != self.snapshot_version:
+            self._listing = (self.snapshot_version, format_mrq_status_listing(self.snapshotMergeRequests()))
+        return self._listing[1]
+
+    def getListing(self, timeout=COLD_TIMEOUT):
+        """Returns a Deferred firing with the listing of open merge requests.
+
+        A stale snapshot is answered from at once, while it is refreshed.
+        Without a snapshot, fires when the scan completes,
+        or with None if that takes longer than timeout."""
+
+        if self._repo_snapshot is not None:
+            if self.isStale():
+                self.triggerOpenMergeRequestsUpdate()
+            return defer.succeed(self.listing())
+
+        d = defer.Deferred()
+        d.addTimeout(timeout, self.clock, onTimeoutCancel=lambda result, timeout: None)
+        self._waiting.append(d)
+        self.triggerOpenMergeRequestsUpdate()
+        return d
 
     def outputMessage(self, message):
-        # FIXME: should not have knowledge about the protocol
-        # Instead pass in a callback that gets called here?
-        # XXX: Probably better to have state update notifications
-        # here, and let consumers subscribe to them
-        self.protocol.msg(self.protocol.factory.channel, message.encode('ascii', 'ignore'))
+        key, summary = message_key(message)
+        repository = summary.rsplit('#', 1)[0] if summary else None
+        change = model.parse_state_change(message)
+        state = change[1] if change else None
+        self.publish(monitor.Event(monitor.MESSAGE, self, message, repository=repository, state=state))
+
+    def publish(self, event):
+        if self.monitor is not None:
+            self.monitor.publish(event)
+
+def parse_project_spec(spec, default_host, default_channel='#$project'):
+    """Parse a project given on the command line as
+    [HOST/]PROJECT[=CHANNEL[,CHANNEL...]], where HOST is a URL.
+    Returns (host, project, channels).
+
+    $project in default_channel is replaced by the project name."""
+
+    spec, _, channels = spec.partition('=')
+
+    host = default_host
+    if '://' in spec:
+        host, _, project = spec.rstrip('/').rpartition('/')
+    else:
+        project = spec
+
+    if channels:
+        channels = [channel.strip() for channel in channels.split(',') if channel.strip()]
+    else:
+        channels = [string.Template(default_channel).safe_substitute(project=project)]
+
+    return host, project, channels
+
+mrq_url_regexp = re.compile(r'(\S+)/merge_requests/(\d+)')
+
+def message_key(message):
+    """Returns a key identifying the merge request message is about,
+    and a short summary of the message, or (None, None)."""
+
+    match = mrq_url_regexp.search(message)
+    if match is None:
+        return None, None
+
+    url, id = match.groups()
+    repo = url.rsplit('/', 1)[-1]
+    return match.group(0), '%s#%s' % (repo, id)
 
 def url_for_mrq(host, project, id):
     return scrape.mrq_page_url_template % {'host': host, 'project': project, 'id': id}
@@ -195,25 +642,57 @@ class IrcProtocol(irc.IRCClient):
     def nickname(self):
         return self.factory.nickname
 
-    @property
-    def lineRate(self):
-        return 1 # Limit rate to 1 line per second
+    # Lines are rate limited by the output queue instead
+    lineRate = None
+    output = None
+    signed_on = False # Messages sent before are rejected by the server
+
+    def connectionMade(self):
+        irc.IRCClient.connectionMade(self)
+        self.output = outqueue.OutputQueue(self.msg)
+
+        output = self.output
+        irc_queue_depth.setFunction(lambda: output.depth)
+        for result in ('sent', 'superseded', 'digested', 'overflowed'):
+            irc_lines.setFunction(lambda result=result: output.stats()[result], result=result)
+
+    def connectionLost(self, reason):
+        irc.IRCClient.connectionLost(self, reason)
+        self.output.stop()
+        if self.factory.connection is self:
+            self.factory.connection = None
 
     def signedOn(self):
-        self.join(self.factory.channel)
+        # Join in batches, there can be hundreds of channels
+        batch = []
+        for channel in self.factory.channels:
+            if batch and len(','.join(batch + [channel])) > MAX_JOIN_LENGTH:
+                self.join(','.join(batch))
+                batch = []
+            batch.append(channel)
+        if batch:
+            self.join(','.join(batch))
         print "Signed on as %s." % (self.factory.nickname,)
+        self.signed_on = True
+        self.factory.notifier.flush()
 
     def privmsg(self, user, channel, msg):
 
         if msg.strip().startswith(self.nickname):
-            self.parseCommand(user, msg)
+            self.parseCommand(user, channel, msg)
 
-        else:
-            # TODO: try to match discussion about merge requests
-            # and enrich by adding link and summary
-            pass
+        elif channel != self.nickname:
+            self.enrichMentions(channel, msg)
+
+    def enrichMentions(self, channel, msg):
+        """Answer merge requests mentioned in channel with their summary and link."""
 
-    def parseCommand(self, user, msg):
+        for bot in self.factory.botsForChannel(channel):
+            for message in bot.mentionMessages(channel, msg):
+                # A reply to the chat, never folded into a digest of updates
+                self.output.reply(channel, message.encode('ascii', 'ignore'))
+
+    def parseCommand(self, user, channel, msg):
             msg = re.compile(self.nickname + "[:,]* ?", re.I).sub('', msg)
 
             split = msg.split()
@@ -236,16 +715,16 @@ class IrcProtocol(irc.IRCClient):
 
                 valid_commands = commands.keys()
                 valid_commands.remove('dance')
-                self.respondToUser(user, 'Valid commands: %s' % ' '.join(valid_commands))
+                self.respondToUser(user, channel, 'Valid commands: %s' % ' '.join(valid_commands))
 
             def command_list(command, args):
                 """List all open merge requests."""
                 
-                self.printOpenMergeRequests(user)
+                self.printOpenMergeRequests(user, channel)
 
             def command_dance(command, args):
                 # Easteregg. Even if it is only just Christmas
-                self.respondToUser(user, "Norwegians don't dance")
+                self.respondToUser(user, channel, "Norwegians don't dance")
 
             commands.update({
                 'list': command_list,
@@ -255,62 +734,165 @@ class IrcProtocol(irc.IRCClient):
             })
 
             def unknown_command(command, args):
-                self.respondToUser(user, 'Unknown command: "%s". Try "help" instead.' % command)
+                self.respondToUser(user, channel, 'Unknown command: "%s". Try "help" instead.' % command)
 
             cmd_func = commands.get(command, unknown_command)
             cmd_func(command, args)
 
-    def respondToUser(self, user, msg):
+    def respondToUser(self, user, channel, msg):
         response_prefix = "%s: " % (user.split('!', 1)[0], )
         response = response_prefix + msg
         encoded = msg.encode('ascii', 'ignore')
-        self.msg(self.factory.channel, encoded)
+        if channel == self.nickname:
+            # Private message
+            channel = user.split('!', 1)[0]
+        self.output.reply(channel, encoded)
+
+    def printOpenMergeRequests(self, user, channel):
+        if channel == self.nickname:
+            bots = self.factory.bots
+        else:
+            bots = self.factory.botsForChannel(channel)
 
-    def printOpenMergeRequests(self, user):
-        mrqs = self.factory.bot.open_merge_requests
-        if mrqs is None:
-            # TODO: just handle this case properly: async call to
-            # get new information from the monitor
-            self.respondToUser(user, 'No data available...')
+        d = defer.gatherResults([bot.getListing() for bot in bots])
+        d.addCallback(self.respondWithListings, user, channel)
+
+    def respondWithListings(self, listings, user, channel):
+        if None in listings:
+            self.respondToUser(user, channel, 'No data available...')
             return
-        elif not mrqs:
-            self.respondToUser(user, 'No open merge requests')
+
+        listings = [listing for listing in listings if listing]
+        if not listings:
+            self.respondToUser(user, channel, 'No open merge requests')
         else:
-            self.respondToUser(user, 'Open merge requests:\n' + format_mrq_status_listing(mrqs))
+            self.respondToUser(user, channel, 'Open merge requests:\n' + '\n'.join(listings))
 
     def joined(self, channel):
         print "Joined %s." % (channel,)
-        self.factory.bot.start()
 
     def left(self, channel):
         print 'Left %s.' % (channel,)
 
+@implementer(monitor.IMrqStatusNotifier)
+class IrcNotifier(object):
+    """Sends events to the channels of their project, and the channels
+    subscribed to them in factory.routing, over the connection of factory.
+    Changes of the snapshot are only sent to the channels of their project
+    with report_changes.
+
+    While not connected and signed on, the latest max_pending events are kept,
+    and sent by flush once signed on again."""
+
+    name = 'irc'
+
+    def __init__(self, factory, report_changes=False, max_pending=outqueue.MAX_PENDING):
+        self.factory = factory
+        self.report_changes = report_changes
+        self.pending = deque(maxlen=max_pending)
+
+    def connectedOutput(self):
+        """Returns the output queue of the connection, once signed on, or None."""
+        connection = self.factory.connection
+        if connection is None or not connection.signed_on:
+            return None
+        return connection.output
+
+    def notify(self, events):
+        output = self.connectedOutput()
+        if output is None:
+            print 'Not connected to IRC, keeping %d events' % len(events)
+            self.pending.extend(events)
+            return
+        self.send(output, events)
+
+    def flush(self):
+        """Send the events kept while not connected."""
+        output = self.connectedOutput()
+        if output is None or not self.pending:
+            return
+        events = list(self.pending)
+        self.pending.clear()
+        self.send(output, events)
+
+    def send(self, output, events):
+        for event in events:
+            channels = []
+            if event.kind == monitor.MESSAGE or self.report_changes:
+                channels.extend(event.channels)
+            for channel in self.factory.routing.route(event):
+                if channel not in event.channels:
+                    channels.append(channel)
+
+            key, summary = message_key(event.text)
+            for channel in channels:
+                output.broadcast(channel, event.text.encode('ascii', 'ignore'), key, summary)
+
 class IrcBotFactory(protocol.ClientFactory):
     """Responsible for connecting to IRC, handling reconnects,
-    and creating a protocol instance and associated business logic."""
+    and creating a protocol instance and associated business logic.
+
+    Any number of projects, on any number of Gitorious hosts, can be
+    monitored over the one connection. Add them with addProject.
+    All of them share the fetch scheduler and the HTTP client.
+    The bots are run by the monitor service, whether connected or not."""
 
     protocol = IrcProtocol
 
-    def __init__(self, channel, nickname, host_url, project, poll_interval):
+    def __init__(self, nickname, store=None, monitor_service=None):
 
-        self.channel = channel
         self.nickname = nickname
+        self.store = store
+        self.connection = None
+        self.routing = routing.RoutingIndex()
+        self.monitor = monitor_service or monitor.Monitor()
+        self.notifier = IrcNotifier(self)
+        # The output queue of the connection batches lines itself
+        self.monitor.addNotifier(self.notifier, delay=None)
 
-        self.bot = IrcBot(host_url, project, poll_interval)
+    @property
+    def bots(self):
+        return self.monitor.bots
+
+    def addProject(self, host_url, project, channels, poll_interval,
+                   max_poll_interval=MAX_POLL_INTERVAL):
+        """Monitor project, reporting to each of channels. Returns the IrcBot."""
+
+        bot = IrcBot(host_url, project, poll_interval, max_poll_interval, self.store, channels)
+        return self.monitor.addBot(bot)
+
+    def subscribe(self, subscriptions):
+        """Route events to channels by the routing.Subscriptions, in addition to the channels of their project."""
+        self.routing = routing.RoutingIndex(self.routing.subscriptions + list(subscriptions))
+
+    @property
+    def channels(self):
+        channels = OrderedDict()
+        for bot in self.bots:
+            for channel in bot.channels:
+                channels[channel] = True
+        for channel in self.routing.channels:
+            channels[channel] = True
+        return channels.keys()
+
+    def botsForChannel(self, channel):
+        return [bot for bot in self.bots
+                if channel in bot.channels or self.routing.subscribes(channel, bot.project)]
+
+    def findBot(self, project, host=None):
+        """Returns the bot monitoring project, on host if given, or None."""
+        return self.monitor.findBot(project, host)
 
     def buildProtocol(self, addr):
         protocol = IrcProtocol()
         protocol.factory = self
-        self.bot.protocol = protocol
+        self.connection = protocol
         return protocol
 
     def clientConnectionLost(self, connector, reason):
         print "Lost connection (%s), reconnecting." % (reason,)
-        self.bot.stop()
         connector.connect()
 
     def clientConnectionFailed(self, connector, reason):
         print "Could not connect: (%s), reconnecting" % (reason,)
-        self.bot.stop()
         connector.connect()
-
@@ -0,0 +1,62 @@
+"""Find merge requests mentioned in chat.
+
+Merge requests are mentioned like "maliit-framework #12",
+"maliit-framework mrq 12", or by the URL of the merge request page.
+A MentionMatcher matches the repositories of one project with a
+single regular expression, so it should be kept while the list of
+repositories stays the same."""
+
+import re
+
+COOLDOWN = 10*60 # Seconds before a mention of the same merge request is answered again
+MAX_COOLDOWN_ENTRIES = 1000 # Expired entries are dropped above this
+
+class MentionMatcher(object):
+    """Finds mentions of merge requests in repositories of project."""
+
+    def __init__(self, project, repositories):
+        self.repositories = tuple(repositories)
+
+        # Repositories can be named with or without the project
+        self.aliases = {}
+        for repo in self.repositories:
+            self.aliases[repo.lower()] = repo
+            self.aliases.setdefault(repo.rsplit('/', 1)[-1].lower(), repo)
+
+        names = '|'.join(re.escape(name) for name in sorted(self.aliases, key=len, reverse=True))
+        self.regexp = re.compile(r'(?:/(?:%(project)s/)?(%(names)s)/merge_requests/'
+                                 r'|(?<![\w/.-])(%(names)s)(?:\s*#|\s+mrqs?\s*#?|\s+merge\s+requests?\s*#?))'
+                                 r'(\d+)\b' % dict(project=re.escape(project), names=names), re.I)
+
+    def findMentions(self, text):
+        """Returns the (repository, id) mentioned in text, without duplicates."""
+
+        if not self.repositories:
+            return []
+
+        mentions = []
+        for url_name, name, id in self.regexp.findall(text):
+            mention = (self.aliases[(url_name or name).lower()], id)
+            if mention not in mentions:
+                mentions.append(mention)
+        return mentions
+
+class Cooldown(object):
+    """Tells whether something was seen in the last seconds."""
+
+    def __init__(self, seconds=COOLDOWN):
+        self.seconds = seconds
+        self._seen = {} # key -> time last let through
+
+    def ready(self, key, now):
+        """Whether key was not let through in the last seconds.
+        If it was not, it is now."""
+
+        last = self._seen.get(key)
+        if last is not None and now - last < self.seconds:
+            return False
+
+        self._seen[key] = now
+        if len(self._seen) > MAX_COOLDOWN_ENTRIES:
+            self._seen = dict((k, t) for k, t in self._seen.items() if now - t < self.seconds)
+        return True
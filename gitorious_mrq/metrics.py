@@ -0,0 +1,207 @@
+"""Counters and timings of the stages of the monitor.
+
+Modules declare their metrics on the shared registry, like
+
+ fetches = metrics.registry.counter('fetches_total', 'Number of fetches.')
+ fetches.inc(kind='feed')
+
+The metrics can be served in the Prometheus text format by
+MetricsResource, and printed periodically as a log line."""
+
+import time
+
+from collections import OrderedDict
+
+from twisted.internet import reactor, task
+from twisted.web import resource
+
+PREFIX = 'gitorious_mrq_'
+MAX_ERRORS = 50 # Number of recent errors kept by the protocols
+LAG_INTERVAL = 1.0 # Seconds between measurements of reactor lag
+LOG_INTERVAL = 10*60 # Seconds between log lines with the metrics
+
+class Metric(object):
+    """A counter, gauge or summary, with values per set of labels."""
+
+    def __init__(self, name, kind, help):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.values = OrderedDict() # Sorted label items -> value, or [count, sum] for summaries
+        self.functions = OrderedDict() # Sorted label items -> function returning the value
+
+    @staticmethod
+    def key(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def setFunction(self, function, **labels):
+        """Let the value be what function() returns when it is read."""
+        self.functions[self.key(labels)] = function
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        if key not in self.values:
+            self.values[key] = [0, 0.0]
+        self.values[key][0] += 1
+        self.values[key][1] += value
+
+    def time(self, d, **labels):
+        """Observe the seconds until the Deferred d fires."""
+
+        started = time.time()
+        def done(result):
+            self.observe(time.time() - started, **labels)
+            return result
+        d.addBoth(done)
+        return d
+
+    def get(self, **labels):
+        key = self.key(labels)
+        if key in self.functions:
+            return self.functions[key]()
+        return self.values.get(key)
+
+    def samples(self):
+        """Yields (name, label items, value)."""
+
+        items = self.values.items() + [(key, function()) for key, function in self.functions.items()]
+        for key, value in items:
+            if self.kind == 'summary':
+                yield self.name + '_count', key, value[0]
+                yield self.name + '_sum', key, value[1]
+            else:
+                yield self.name, key, value
+
+    def total(self):
+        """The value summed over all labels. For summaries, the mean."""
+
+        if self.kind == 'summary':
+            count = sum(value[0] for value in self.values.values())
+            if not count:
+                return None
+            return sum(value[1] for value in self.values.values()) / count
+
+        return sum(value for key, value in self.samples())
+
+def format_labels(key):
+    if not key:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in key)
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def declare(self, name, kind, help):
+        name = PREFIX + name
+        if name not in self.metrics:
+            self.metrics[name] = Metric(name, kind, help)
+        return self.metrics[name]
+
+    def counter(self, name, help):
+        return self.declare(name, 'counter', help)
+
+    def gauge(self, name, help):
+        return self.declare(name, 'gauge', help)
+
+    def summary(self, name, help):
+        return self.declare(name, 'summary', help)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format."""
+
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, key, value in metric.samples():
+                lines.append('%s%s %s' % (name, format_labels(key), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def logLine(self):
+        """Returns a one line summary of the metrics, with counters
+        per label, and the mean of summaries."""
+
+        parts = []
+        for metric in self.metrics.values():
+            short_name = metric.name[len(PREFIX):]
+            if metric.kind == 'summary':
+                mean = metric.total()
+                if mean is not None:
+                    parts.append('%s=%.3f' % (short_name, mean))
+                continue
+
+            for name, key, value in metric.samples():
+                labels = ','.join(str(value) for label, value in key)
+                if labels:
+                    parts.append('%s[%s]=%s' % (short_name, labels, format_value(value)))
+                else:
+                    parts.append('%s=%s' % (short_name, format_value(value)))
+        return 'Metrics: ' + ' '.join(parts)
+
+registry = MetricsRegistry()
+
+errors = registry.counter('errors_total', 'Number of errors, per stage.')
+
+reactor_lag = registry.gauge('reactor_lag_seconds', 'How late the reactor ran the last periodic call.')
+reactor_lag_summary = registry.summary('reactor_lag', 'How late the reactor runs periodic calls, in seconds.')
+
+class LagMonitor(object):
+    """Measures how late the reactor runs a call scheduled every interval."""
+
+    def __init__(self, interval=LAG_INTERVAL, clock=reactor):
+        self.interval = interval
+        self.clock = clock
+        self._expected = None
+        self._task = task.LoopingCall(self.tick)
+        self._task.clock = clock
+
+    def start(self):
+        self._expected = self.clock.seconds()
+        self._task.start(self.interval)
+
+    def stop(self):
+        if self._task.running:
+            self._task.stop()
+
+    def tick(self):
+        now = self.clock.seconds()
+        lag = max(0, now - self._expected)
+        self._expected = now + self.interval
+        reactor_lag.set(lag)
+        reactor_lag_summary.observe(lag)
+
+def print_metrics():
+    print registry.logLine()
+
+def start(log_interval=LOG_INTERVAL):
+    """Start measuring reactor lag, and logging the metrics every log_interval seconds."""
+
+    LagMonitor().start()
+    if log_interval:
+        task.LoopingCall(print_metrics).start(log_interval, now=False)
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, metrics_registry=None):
+        resource.Resource.__init__(self)
+        self.registry = metrics_registry or registry
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.registry.render()
@@ -0,0 +1,160 @@
+"""Compact records of merge requests, and changes between snapshots of them.
+
+Scraping gives a dict per merge request. For big projects, keeping
+those for the life of the process costs much more memory than a
+record with __slots__, where values repeated across merge requests,
+like the state and the repository, are shared.
+
+MergeRequest also supports the dict access used for the scraped dicts,
+like mrq['status'] and dict(mrq)."""
+
+import re
+
+from collections import OrderedDict
+
+FIELDS = ('repository', 'id', 'status', 'summary', 'creator', 'creation', 'target_branch')
+
+_shared = {}
+
+def share(value):
+    """Returns an equal value, the same object for all equal values."""
+    return _shared.setdefault(value, value)
+
+class MergeRequest(object):
+    __slots__ = FIELDS
+
+    def __init__(self, repository=None, id=None, status=None, summary=None,
+                 creator=None, creation=None, target_branch=None):
+        self.repository = share(repository)
+        self.id = id
+        self.status = share(status)
+        self.summary = summary
+        self.creator = share(creator)
+        self.creation = creation
+        self.target_branch = share(target_branch)
+
+    @classmethod
+    def fromDict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(**dict((name, data.get(name)) for name in FIELDS))
+
+    @property
+    def key(self):
+        return (self.repository, self.id)
+
+    def keys(self):
+        return [name for name in FIELDS if getattr(self, name) is not None]
+
+    def __getitem__(self, name):
+        if name not in FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in FIELDS else None
+        return default if value is None else value
+
+    def __eq__(self, other):
+        if isinstance(other, (MergeRequest, dict)):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return 'MergeRequest(%s)' % ', '.join('%s=%r' % (name, self[name]) for name in self.keys())
+
+# States of merge requests on Gitorious. Some of them contain " to ".
+STATES = ('New', 'Reviewing', 'Revise and update', 'Recommended to merge', 'Go ahead and merge',
+          'Updated', 'Need info', 'Hold', 'Merged', 'Rejected', 'Closed')
+
+state_change_regexp = re.compile(r'State changed from (.+) to (.+?)\s*$')
+
+def parse_state_change(text):
+    """Returns (old state, new state) from text like
+    "... State changed from Recommended to merge to Go ahead and merge",
+    or None if it does not describe a change of state."""
+
+    match = state_change_regexp.search(text)
+    if match is None:
+        return None
+
+    # Split at the " to " that gives known states
+    words = match.group(1) + ' to ' + match.group(2)
+    parts = words.split(' to ')
+    splits = [(' to '.join(parts[:i]), ' to '.join(parts[i:])) for i in range(1, len(parts))]
+    for old, new in splits:
+        if old in STATES and new in STATES:
+            return old, new
+    for old, new in splits:
+        if old in STATES or new in STATES:
+            return old, new
+    return splits[0]
+
+def index(mrqs):
+    """Returns an OrderedDict of mrqs keyed by (repository, id)."""
+    return OrderedDict((mrq.key, mrq) for mrq in mrqs)
+
+OPENED = 'opened'
+CLOSED = 'closed'
+STATE_CHANGED = 'state_changed'
+
+class Change(object):
+    """A change to a merge request between two snapshots.
+    old is None for opened merge requests, new is None for closed ones."""
+
+    __slots__ = ('kind', 'old', 'new')
+
+    def __init__(self, kind, old, new):
+        self.kind = kind
+        self.old = old
+        self.new = new
+
+    @property
+    def mrq(self):
+        return self.new if self.new is not None else self.old
+
+    def __eq__(self, other):
+        return isinstance(other, Change) and (self.kind, self.old, self.new) == (other.kind, other.old, other.new)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Change(%s, %r, %r)' % (self.kind, self.old, self.new)
+
+def diff(old_mrqs, new_mrqs):
+    """Returns the Changes from the merge requests old_mrqs to new_mrqs:
+    the opened and state changed ones in the order of new_mrqs,
+    followed by the closed ones."""
+
+    old_index = index(old_mrqs)
+    changes = []
+
+    for mrq in new_mrqs:
+        old = old_index.pop(mrq.key, None)
+        if old is None:
+            changes.append(Change(OPENED, None, mrq))
+        elif old.status != mrq.status:
+            changes.append(Change(STATE_CHANGED, old, mrq))
+
+    # What is left was not in the new snapshot
+    for old in old_index.values():
+        changes.append(Change(CLOSED, old, None))
+
+    return changes
+
+def format_change(change, url):
+    """Returns a message describing change, with the url of the merge request."""
+
+    mrq = change.mrq
+    if change.kind == OPENED:
+        action = 'opened (%s)' % mrq.status
+    elif change.kind == CLOSED:
+        action = 'closed'
+    else:
+        action = 'state changed from %s to %s' % (change.old.status, change.new.status)
+    return '%s #%s %s: %s %s' % (mrq.repository, mrq.id, action, (mrq.summary or '').strip(), url)
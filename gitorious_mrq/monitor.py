@@ -0,0 +1,188 @@
+"""Service monitoring projects, independent of how updates are reported.
+
+The Monitor runs the bots polling and scraping the projects, and passes
+what they report as Events to any number of notifiers, like IRC, stdout,
+or a file of JSON lines. Each notifier gets the events in batches.
+
+ m = monitor.Monitor()
+ m.addNotifier(monitor.StdoutNotifier())
+ m.addBot(ircbot.IrcBot(host, project, poll_interval))
+ m.startService()"""
+
+import sys, json
+
+from zope.interface import Interface, implementer
+from twisted.application import service
+from twisted.internet import reactor
+
+from gitorious_mrq import metrics
+
+BATCH_DELAY = 1.0 # Seconds events are collected before passing them to a notifier
+MAX_BATCH = 100 # Events passed to a notifier at once, at most
+
+MESSAGE = 'message' # Kind of events for messages about feed entries
+
+events = metrics.registry.counter('events_total', 'Events reported by the bots, per kind.')
+notified = metrics.registry.counter('notified_events_total', 'Events passed to notifiers, per notifier.')
+
+class Event(object):
+    """Something to report about a project.
+    kind is MESSAGE, or the kind of a model.Change, which is then given as change.
+    repository and state are those of the merge request, when known."""
+
+    __slots__ = ('kind', 'host', 'project', 'channels', 'text', 'change', 'repository', 'state', 'time')
+
+    def __init__(self, kind, bot, text, change=None, repository=None, state=None):
+        self.kind = kind
+        self.host = bot.host
+        self.project = bot.project
+        self.channels = bot.channels
+        self.text = text
+        self.change = change
+        if change is not None:
+            repository, state = change.mrq.repository, change.mrq.status
+        self.repository = repository
+        self.state = state
+        self.time = None # Set when published
+
+    def toJson(self):
+        data = {'kind': self.kind, 'host': self.host, 'project': self.project, 'text': self.text, 'time': self.time,
+                'repository': self.repository, 'state': self.state}
+        if self.change is not None:
+            mrq = self.change.mrq
+            data.update(id=mrq.id, status=mrq.status,
+                        old_status=self.change.old.status if self.change.old is not None else None)
+        return data
+
+class IMrqStatusNotifier(Interface):
+    """Reports events about merge requests."""
+
+    def notify(events):
+        """Report the list of Events."""
+
+class NotifierQueue(object):
+    """Collects events for notifier, passing them on at most delay seconds
+    after the first one, or at once when there are max_batch of them.
+    With a delay of None, events are passed on one by one as they come."""
+
+    def __init__(self, notifier, delay=BATCH_DELAY, max_batch=MAX_BATCH, clock=reactor):
+        self.notifier = notifier
+        self.delay = delay
+        self.max_batch = max_batch
+        self.clock = clock
+        self.pending = []
+        self._call = None
+
+    def put(self, event):
+        self.pending.append(event)
+        if self.delay is None or len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self._call is None:
+            self._call = self.clock.callLater(self.delay, self._flushLater)
+
+    def _flushLater(self):
+        self._call = None
+        self.flush()
+
+    def flush(self):
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        notified.inc(len(batch), notifier=self.notifier.name)
+        try:
+            self.notifier.notify(batch)
+        except Exception, e:
+            print 'Notifier %s failed: %s' % (self.notifier.name, e)
+            metrics.errors.inc(stage='notify')
+
+class Monitor(service.Service):
+    """Runs bots, passing the events they report to the notifiers."""
+
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self.bots = []
+        self.queues = []
+
+    def addBot(self, bot):
+        bot.monitor = self
+        self.bots.append(bot)
+        if self.running:
+            bot.start()
+        return bot
+
+    def findBot(self, project, host=None):
+        """Returns the bot monitoring project, on host if given, or None."""
+        for bot in self.bots:
+            if bot.project == project and (host is None or bot.host.rstrip('/') == host.rstrip('/')):
+                return bot
+        return None
+
+    def addNotifier(self, notifier, delay=BATCH_DELAY, max_batch=MAX_BATCH):
+        """Pass events to notifier, providing IMrqStatusNotifier, in batches.
+        Returns its NotifierQueue."""
+
+        queue = NotifierQueue(notifier, delay, max_batch, self.clock)
+        self.queues.append(queue)
+        return queue
+
+    def publish(self, event):
+        event.time = self.clock.seconds()
+        events.inc(kind=event.kind)
+        for queue in self.queues:
+            queue.put(event)
+
+    def startService(self):
+        service.Service.startService(self)
+        for bot in self.bots:
+            if not bot.is_running:
+                bot.start()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.stopBots()
+        self.flush()
+
+    def stopBots(self):
+        for bot in self.bots:
+            bot.stop()
+
+    def flush(self):
+        """Pass pending events to the notifiers now."""
+        for queue in self.queues:
+            queue.flush()
+
+@implementer(IMrqStatusNotifier)
+class StdoutNotifier(object):
+    """Prints the events, one line each."""
+
+    name = 'stdout'
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def notify(self, events):
+        stream = self.stream or sys.stdout
+        for event in events:
+            stream.write(('%s: %s\n' % (event.project, event.text)).encode('utf-8'))
+        stream.flush()
+
+@implementer(IMrqStatusNotifier)
+class JsonLinesNotifier(object):
+    """Writes the events to a file, or pipe, as one JSON object per line.
+    A path of - means stdout."""
+
+    name = 'jsonl'
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = sys.stdout if path == '-' else open(path, 'a')
+
+    def notify(self, events):
+        for event in events:
+            self.stream.write(json.dumps(event.toJson(), sort_keys=True) + '\n')
+        self.stream.flush()
@@ -0,0 +1,127 @@
+"""Rate limited, prioritised output of lines to IRC.
+
+Replies to users are sent before broadcasts. Pending broadcasts about
+the same thing are merged, so only the latest one is sent, and bursts
+of broadcasts to a target collapse into a single digest line.
+
+Lines are sent at the rate allowed by a token bucket, which lets a few
+lines out at once and then limits to a steady rate, like the flood
+protection of IRC servers."""
+
+from collections import deque, OrderedDict
+
+from twisted.internet import reactor
+
+RATE = 1.0 # Lines per second, sustained
+BURST = 4 # Lines that can be sent at once after being idle
+DIGEST_THRESHOLD = 5 # Pending broadcasts to one target that are sent as one digest line
+MAX_PENDING = 1000 # Pending broadcasts above this are dropped, oldest first
+MAX_LINE_LENGTH = 400 # Leaves room for the PRIVMSG prefix within the 512 bytes IRC allows
+
+DIGEST_FORMAT = '%(count)d merge request updates: %(summaries)s'
+
+class OutputQueue(object):
+    """Queue of lines to be sent with send(target, line)."""
+
+    def __init__(self, send, rate=RATE, burst=BURST, digest_threshold=DIGEST_THRESHOLD,
+                 max_pending=MAX_PENDING, clock=reactor):
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        self.digest_threshold = digest_threshold
+        self.max_pending = max_pending
+        self.clock = clock
+
+        self.tokens = float(burst)
+        self._last_refill = clock.seconds()
+        self._call = None
+
+        self._replies = deque() # (target, line)
+        self._broadcasts = OrderedDict() # (target, key) -> (line, summary)
+        self._next_key = 0 # For broadcasts without a key
+
+        self.sent = 0
+        self.superseded = 0 # Broadcasts replaced by a later one with the same key
+        self.digested = 0 # Broadcasts sent as part of a digest
+        self.overflowed = 0 # Broadcasts dropped because too many were pending
+
+    @property
+    def depth(self):
+        return len(self._replies) + len(self._broadcasts)
+
+    def stats(self):
+        return dict(depth=self.depth, sent=self.sent, superseded=self.superseded,
+                    digested=self.digested, overflowed=self.overflowed)
+
+    def reply(self, target, message):
+        """Queue message, which may have several lines, ahead of all broadcasts."""
+
+        for line in message.split('\n'):
+            self._replies.append((target, line))
+        self.pump()
+
+    def broadcast(self, target, line, key=None, summary=None):
+        """Queue line. A pending broadcast to target with the same key is replaced.
+        summary is a short form of line, used in digests."""
+
+        if key is None:
+            self._next_key += 1
+            key = ('unique', self._next_key)
+
+        if (target, key) in self._broadcasts:
+            self.superseded += 1
+            del self._broadcasts[(target, key)]
+        self._broadcasts[(target, key)] = (line, summary or line)
+
+        while len(self._broadcasts) > self.max_pending:
+            self._broadcasts.popitem(last=False)
+            self.overflowed += 1
+
+        self.pump()
+
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def pump(self):
+        self.refill()
+
+        while self.tokens >= 1 and self.depth:
+            target, line = self.nextLine()
+            self.send(target, line)
+            self.sent += 1
+            self.tokens -= 1
+
+        if self.depth and self._call is None:
+            self._call = self.clock.callLater((1 - self.tokens) / self.rate, self._pumpLater)
+
+    def _pumpLater(self):
+        self._call = None
+        self.pump()
+
+    def nextLine(self):
+        if self._replies:
+            return self._replies.popleft()
+
+        # The oldest broadcast decides the target
+        (target, key), (line, summary) = self._broadcasts.popitem(last=False)
+        pending = [k for k in self._broadcasts if k[0] == target]
+        if len(pending) + 1 < self.digest_threshold:
+            return target, line
+
+        summaries = [summary]
+        for k in pending:
+            summaries.append(self._broadcasts.pop(k)[1])
+        self.digested += len(summaries)
+        print 'Sending %d broadcasts to %s as a digest' % (len(summaries), target)
+
+        digest = DIGEST_FORMAT % dict(count=len(summaries), summaries=', '.join(summaries))
+        if len(digest) > MAX_LINE_LENGTH:
+            digest = digest[:MAX_LINE_LENGTH - 3] + '...'
+        return target, digest
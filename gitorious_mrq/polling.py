@@ -0,0 +1,124 @@
+"""Adaptive scheduling of feed polls.
+
+Polls often while there is activity, and backs off exponentially
+while the feed stays unchanged. Each poll is jittered so that
+many monitors started together do not poll in bursts."""
+
+import random, re, time
+
+from email.utils import parsedate_tz, mktime_tz
+
+from twisted.internet import reactor, defer
+
+BACKOFF = 2.0 # Factor to increase the interval with when there is no activity
+JITTER = 0.1 # Polls are spread randomly by this fraction of the interval
+
+max_age_regexp = re.compile(r'max-age\s*=\s*(\d+)')
+
+def poll_hint(headers, now=None):
+    """Returns the number of seconds the server asks us to wait before
+    requesting the page again, or None.
+
+    headers maps lower-case header names to lists of values."""
+
+    if now is None:
+        now = time.time()
+
+    hints = []
+
+    for value in headers.get('retry-after', []):
+        if value.strip().isdigit():
+            hints.append(int(value))
+        else:
+            date = parsedate_tz(value)
+            if date is not None:
+                hints.append(max(0, mktime_tz(date) - now))
+
+    for value in headers.get('cache-control', []):
+        match = max_age_regexp.search(value)
+        if match:
+            hints.append(int(match.group(1)))
+
+    if not hints:
+        return None
+    return max(hints)
+
+class AdaptivePoller(object):
+    """Calls function repeatedly, with an interval depending on activity.
+
+    function should return True (or a Deferred firing with True) if
+    there was activity."""
+
+    def __init__(self, function, min_interval, max_interval, backoff=BACKOFF, jitter=JITTER):
+        self.function = function
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+
+        self.interval = min_interval
+        self.server_delay = 0
+        self.clock = reactor
+        self._call = None
+        self._generation = 0 # Polls started before the last start or stop are ignored
+
+    @property
+    def is_running(self):
+        return self._call is not None
+
+    def start(self):
+        self._generation += 1
+        # Spread the first poll, for monitors started at the same time
+        self.schedule(random.uniform(0, self.jitter * self.min_interval))
+
+    def stop(self):
+        self._generation += 1
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def schedule(self, delay):
+        self._call = self.clock.callLater(delay, self.poll)
+
+    def poll(self):
+        d = defer.maybeDeferred(self.function)
+        d.addErrback(self.pollFailed)
+        d.addCallback(self.polled, self._generation)
+
+    def pollFailed(self, failure):
+        print 'Poll failed: %s' % failure.getErrorMessage()
+        return False
+
+    def polled(self, activity, generation=None):
+        if self._call is None or generation not in (None, self._generation):
+            return # Stopped, or restarted, while polling
+
+        if activity:
+            self.interval = self.min_interval
+        else:
+            max_interval = max(self.min_interval, self.max_interval)
+            self.interval = min(max_interval, self.interval * self.backoff)
+
+        delay = self.nextDelay()
+        print 'Next poll in %d seconds' % delay
+        self.schedule(delay)
+
+    def setMinInterval(self, seconds):
+        """Change the shortest interval, taking effect from the next poll."""
+        if seconds < self.min_interval:
+            self.interval = seconds
+        else:
+            self.interval = max(self.interval, seconds)
+        self.min_interval = seconds
+
+    def serverHint(self, seconds):
+        """Do not poll again sooner than seconds from now,
+        or than the longest interval, if that is sooner."""
+        seconds = min(seconds, max(self.min_interval, self.max_interval))
+        self.server_delay = max(self.server_delay, seconds)
+
+    def nextDelay(self):
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        delay = max(delay, self.server_delay)
+        self.server_delay = 0
+        return delay
@@ -0,0 +1,184 @@
+"""Routing of events to channels subscribed to them.
+
+A subscription sends events about repositories matching a glob, in
+states matching a pattern, of some kinds, to a channel. It is given as
+
+ CHANNEL:REPOSITORIES[:STATES[:KINDS]]
+
+where each part is a comma separated list, and * or an empty part
+matches anything. Repository globs may be prefixed with the project,
+like maliit/maliit-*. States are matched without regard to case.
+KINDS are message, for entries of the feed, and opened, closed and
+state_changed, for changes of the snapshot. Without KINDS, only
+messages are routed. For instance
+
+ #maliit-merges:maliit-*:Go ahead and merge:message,state_changed
+
+The subscriptions are compiled into a RoutingIndex, which finds the
+subscriptions matching an event by looking up its repository, and
+only checks the states of those. Globs other than a literal name, a
+prefix followed by *, or * are matched one by one."""
+
+import re, fnmatch
+
+from collections import OrderedDict
+
+from gitorious_mrq import model, monitor
+
+KINDS = (monitor.MESSAGE, model.OPENED, model.CLOSED, model.STATE_CHANGED)
+WILDCARDS = '*?['
+
+def is_literal(pattern):
+    return not any(c in pattern for c in WILDCARDS)
+
+def compile_glob(pattern):
+    return re.compile(fnmatch.translate(pattern), re.I)
+
+class Subscription(object):
+
+    def __init__(self, channel, repositories=('*',), states=('*',), kinds=(monitor.MESSAGE,)):
+        self.channel = channel
+        self.repositories = tuple(repositories)
+        self.states = tuple(states)
+        self.kinds = tuple(kinds)
+
+        self._any_state = '*' in self.states
+        self._states = [compile_glob(state) for state in self.states]
+
+    def matchesState(self, state):
+        if self._any_state:
+            return True
+        return state is not None and any(regexp.match(state) for regexp in self._states)
+
+    def __repr__(self):
+        return 'Subscription(%r, %r, %r, %r)' % (self.channel, self.repositories, self.states, self.kinds)
+
+def parse_subscription(spec):
+    """Returns the Subscription for spec, given as CHANNEL:REPOSITORIES[:STATES[:KINDS]].
+    Raises ValueError if it is not valid."""
+
+    parts = spec.split(':')
+    if len(parts) < 2 or len(parts) > 4 or not parts[0].strip():
+        raise ValueError('Expected CHANNEL:REPOSITORIES[:STATES[:KINDS]], got %r' % spec)
+
+    def items(part):
+        values = [value.strip() for value in part.split(',') if value.strip()]
+        return values or ['*']
+
+    channel = parts[0].strip()
+    repositories = items(parts[1])
+    states = items(parts[2]) if len(parts) > 2 else ['*']
+    kinds = items(parts[3]) if len(parts) > 3 else [monitor.MESSAGE]
+
+    if '*' in kinds:
+        kinds = list(KINDS)
+    for kind in kinds:
+        if kind not in KINDS:
+            raise ValueError('Unknown kind %r, expected one of %s' % (kind, ', '.join(KINDS)))
+
+    return Subscription(channel, repositories, states, kinds)
+
+def parse_subscriptions_file(lines):
+    """Returns the Subscriptions in lines, skipping empty lines and
+    comments, which start with # followed by a space."""
+
+    return [parse_subscription(line.strip()) for line in lines
+            if line.strip() and not line.startswith('# ')]
+
+class RepositoryIndex(object):
+    """Subscriptions by the repositories they match."""
+
+    def __init__(self):
+        self.exact = {} # (project or None, repository) -> [Subscription]
+        self.prefixes = {} # (project or None, prefix) -> [Subscription]
+        self.prefix_lengths = set()
+        self.any = {} # project or None -> [Subscription]
+        self.globs = OrderedDict() # glob -> (regexp, with project, [Subscription])
+
+    def add(self, glob, subscription):
+        project = None
+        repository = glob
+        if '/' in glob:
+            project, repository = glob.split('/', 1)
+            if not is_literal(project):
+                self.addGlob(glob, subscription)
+                return
+            project = project.lower()
+
+        repository = repository.lower()
+        if repository == '*':
+            self.any.setdefault(project, []).append(subscription)
+        elif is_literal(repository):
+            self.exact.setdefault((project, repository), []).append(subscription)
+        elif repository.endswith('*') and is_literal(repository[:-1]):
+            prefix = repository[:-1]
+            self.prefixes.setdefault((project, prefix), []).append(subscription)
+            self.prefix_lengths.add(len(prefix))
+        else:
+            self.addGlob(glob, subscription)
+
+    def addGlob(self, glob, subscription):
+        if glob not in self.globs:
+            self.globs[glob] = (compile_glob(glob), '/' in glob, [])
+        self.globs[glob][2].append(subscription)
+
+    def lookup(self, project, repository):
+        """Returns the Subscriptions matching repository of project, possibly repeated."""
+
+        project = project.lower()
+        repository = repository.lower()
+        found = []
+        for key in (None, project):
+            found.extend(self.any.get(key, ()))
+            found.extend(self.exact.get((key, repository), ()))
+            for length in self.prefix_lengths:
+                if length <= len(repository):
+                    found.extend(self.prefixes.get((key, repository[:length]), ()))
+
+        for regexp, with_project, subscriptions in self.globs.values():
+            if regexp.match('%s/%s' % (project, repository) if with_project else repository):
+                found.extend(subscriptions)
+        return found
+
+class RoutingIndex(object):
+    """Finds the channels subscribed to events."""
+
+    def __init__(self, subscriptions=()):
+        self.subscriptions = list(subscriptions)
+        self.indexes = dict((kind, RepositoryIndex()) for kind in KINDS)
+        self.channel_projects = OrderedDict() # channel -> [project or None]
+
+        for subscription in self.subscriptions:
+            for glob in subscription.repositories:
+                for kind in subscription.kinds:
+                    self.indexes[kind].add(glob, subscription)
+
+                project = glob.split('/', 1)[0] if '/' in glob and is_literal(glob.split('/', 1)[0]) else None
+                self.channel_projects.setdefault(subscription.channel, []).append(project)
+
+    @property
+    def channels(self):
+        return self.channel_projects.keys()
+
+    def subscribes(self, channel, project):
+        """Whether channel has subscriptions that can match events of project."""
+        projects = self.channel_projects.get(channel, ())
+        return None in projects or project in projects
+
+    def route(self, event):
+        """Returns the channels subscribed to event."""
+
+        index = self.indexes.get(event.kind)
+        if index is None or event.repository is None:
+            return []
+
+        # Snapshots may name repositories with the project
+        repository = event.repository.rsplit('/', 1)[-1]
+
+        channels = []
+        seen = set()
+        for subscription in index.lookup(event.project, repository):
+            if subscription.channel not in seen and subscription.matchesState(event.state):
+                seen.add(subscription.channel)
+                channels.append(subscription.channel)
+        return channels
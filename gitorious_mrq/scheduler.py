@@ -0,0 +1,160 @@
+"""Scheduling of fetches from Gitorious.
+
+Limits the number of concurrent requests per host, retries failed
+requests with exponential backoff, and lets concurrent callers asking
+for the same thing share a single request."""
+
+import random, urlparse, time
+
+from twisted.internet import reactor, defer, task, error as internet_error
+from twisted.web import client, error
+
+from gitorious_mrq import httpclient, polling, metrics
+
+TIMEOUT = httpclient.TIMEOUT
+MAX_PER_HOST = 4 # Maximum number of concurrent requests to one host
+RETRIES = 3
+BACKOFF = 2.0 # Delay before the first retry (in seconds), doubled for each retry
+MAX_BACKOFF = 60.0
+
+fetch_seconds = metrics.registry.summary('fetch_seconds', 'Time to fetch a page, per kind of page.')
+fetch_bytes = metrics.registry.counter('fetch_bytes_total', 'Bytes of pages fetched, per kind of page.')
+fetch_responses = metrics.registry.counter('fetch_responses_total', 'Fetches per kind of page and HTTP status.')
+
+def url_kind(url):
+    """Classifies url as 'feed', 'merge_requests' or 'page'."""
+
+    path = urlparse.urlparse(url).path.rstrip('/')
+    if path.endswith('.atom'):
+        return 'feed'
+    if path.endswith('/merge_requests'):
+        return 'merge_requests'
+    return 'page'
+
+def is_retryable(failure):
+    """Whether the failed request could succeed if tried again."""
+
+    if failure.check(error.Error):
+        # Server errors may be temporary, client errors will not go away
+        try:
+            status = int(failure.value.status)
+        except ValueError:
+            return False
+        return status >= 500 or status == 429 # Too Many Requests
+
+    return failure.check(defer.TimeoutError, defer.CancelledError,
+                         internet_error.ConnectError, internet_error.ConnectionLost,
+                         internet_error.DNSLookupError, client.ResponseFailed,
+                         client.RequestTransmissionFailed) is not None
+
+class FetchScheduler(object):
+
+    def __init__(self, max_per_host=MAX_PER_HOST, retries=RETRIES,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._host_slots = {}
+        self._in_flight = {} # key -> list of Deferreds waiting for the result
+        self.coalesced = 0 # Number of calls that shared an in-flight call
+        self.retried = 0
+
+    @property
+    def in_flight(self):
+        """Number of distinct calls in flight."""
+        return len(self._in_flight)
+
+    def coalesce(self, key, function, *args):
+        """Call function(*args), unless a call with the same key is in flight.
+        In that case, return a Deferred firing with the result of that call."""
+
+        if key in self._in_flight:
+            self.coalesced += 1
+            d = defer.Deferred()
+            self._in_flight[key].append(d)
+            return d
+
+        waiting = self._in_flight[key] = []
+
+        def done(result):
+            del self._in_flight[key]
+            for d in waiting:
+                d.callback(result)
+            return result
+
+        d = defer.maybeDeferred(function, *args)
+        d.addBoth(done)
+        return d
+
+    def fetch(self, url, headers=None, timeout=TIMEOUT):
+        """Retrieve url, like HTTPClient.request.
+
+        Concurrent fetches of the same url with the same headers share one request."""
+
+        headers = headers or {}
+        key = ('fetch', url, tuple(sorted(headers.items())))
+        return self.coalesce(key, self._fetch, url, headers, timeout, 0)
+
+    def _slotsFor(self, url):
+        host = urlparse.urlparse(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = defer.DeferredSemaphore(self.max_per_host)
+        return self._host_slots[host]
+
+    def _fetch(self, url, headers, timeout, attempt):
+        slots = self._slotsFor(url)
+        d = slots.run(self._request, url, headers, timeout)
+        d.addErrback(self._retry, url, headers, timeout, attempt)
+        return d
+
+    def _request(self, url, headers, timeout):
+        d = httpclient.getClient().request(url, headers, timeout)
+        d.addBoth(self._recordFetch, url, time.time())
+        return d
+
+    def _recordFetch(self, result, url, started):
+        kind = url_kind(url)
+        fetch_seconds.observe(time.time() - started, kind=kind)
+
+        if isinstance(result, httpclient.Page):
+            fetch_responses.inc(kind=kind, status=result.code)
+            fetch_bytes.inc(len(result.body or ''), kind=kind)
+        elif result.check(httpclient.HTTPError):
+            fetch_responses.inc(kind=kind, status=result.value.status)
+        else:
+            fetch_responses.inc(kind=kind, status='error')
+        return result
+
+    def retryDelay(self, attempt):
+        # Full jitter, so that failed requests to one host do not retry in lockstep
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, delay)
+
+    def _retry(self, failure, url, headers, timeout, attempt):
+        if attempt >= self.retries or not is_retryable(failure):
+            return failure
+
+        self.retried += 1
+        delay = self.retryDelay(attempt)
+        if failure.check(httpclient.HTTPError):
+            delay = max(delay, polling.poll_hint(failure.value.headers) or 0)
+        print 'Retrying %s in %.1f seconds: %s' % (url, delay, failure.getErrorMessage())
+        return task.deferLater(reactor, delay, self._fetch, url, headers, timeout, attempt + 1)
+
+_scheduler = None
+
+def getScheduler():
+    """Returns the fetch scheduler shared by the whole process."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FetchScheduler()
+    return _scheduler
+
+def setScheduler(fetch_scheduler):
+    global _scheduler
+    _scheduler = fetch_scheduler
+
+in_flight = metrics.registry.gauge('fetches_in_flight', 'Distinct fetches and refreshes in flight.')
+in_flight.setFunction(lambda: getScheduler().in_flight)
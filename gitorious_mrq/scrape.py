@@ -3,10 +3,14 @@ import datetime
 from BeautifulSoup import BeautifulSoup
 
 from twisted.internet import protocol, defer
-from twisted.web import client
+
+from collections import deque
+
+from gitorious_mrq import httpcache, workers, htmlstream, metrics, diagnostics
 
 project_page_url_template = '%(host)s/%(project)s'
 project_activity_feed_template = '%(host)s/%(project)s.atom'
+project_activity_feed_page_template = '%(host)s/%(project)s.atom?page=%(page)d'
 mrq_overview_page_url_template = '%(host)s/%(repo)s/merge_requests'
 mrq_page_url_template = '%(host)s/%(repo)s/merge_requests/%(id)s'
 
@@ -24,54 +28,98 @@ class UTC(datetime.tzinfo):
 
 utc = UTC()
 
+def _text(string):
+    """Plain unicode for a BeautifulSoup string.
+    Does not keep the parse tree alive, and can be pickled."""
+    if string is None:
+        return None
+    return unicode(string)
+
+def _merge_request_from_row(row):
+    tds = row('td')
+
+    # print tds
+    """[<td><a href="/maliit/maliit-framework/merge_requests/127">#127</a></td>,
+    <td style="color:#0080ff"> New      </td>,
+    <td><a href="/maliit/maliit-framework/merge_requests/127">Allow QML plugins to add custom import paths for QML files and QML modules </a> </td>,
+    <td>master</td>,
+    <td><a href="/~mikhas">mikhas</a></td>,
+    <td><abbr class="timeago" title="2011-12-17T15:35:14Z">2011-12-17 15:35:14 UTC</abbr></td>]"""
+
+    # Columns: ID, Status, Summary, Target branch, Creator, Age
+    # Older pages, like those archived, have the target branch
+    mrq_id = tds[0].a.string.strip('#')
+    status = tds[1].string.strip()
+    summary = _text(tds[2].a.string)
+    if len(tds) > 5:
+        target_branch = _text(tds[3].string).strip()
+        tds = tds[:3] + tds[4:]
+    else:
+        target_branch = "" # Not on the page anymore
+    creator = _text(tds[3].a.string)
+    creation = datetime.datetime.strptime(tds[4].abbr['title'], '%Y-%m-%dT%H:%M:%SZ')
+
+    return {'id': mrq_id, 'status': status,
+            'summary': summary, 'target_branch': target_branch,
+            'creator': creator, 'creation': creation}
+
+def soup_scrape_mrq_status_from_mrq_page(html_page):
+    """Like scrape_mrq_status_from_mrq_page, using BeautifulSoup."""
+
+    soup = BeautifulSoup(html_page)
+    return [_merge_request_from_row(row) for row in soup('table')[0].findAll('tr')]
+
+def stream_scrape_mrq_status_from_mrq_page(html_page):
+    """Like scrape_mrq_status_from_mrq_page, parsing only the first table."""
+
+    return [_merge_request_from_row(row) for row in htmlstream.table_rows(html_page)]
 
 def scrape_mrq_status_from_mrq_page(html_page):
     """Returns a list of the open merge requests and their status."""
 
-    merge_requests = []
+    try:
+        return stream_scrape_mrq_status_from_mrq_page(html_page)
+    except Exception:
+        return soup_scrape_mrq_status_from_mrq_page(html_page)
+
+repository_attribute_matching = {'class': 'repository'}
+
+def soup_scrape_repositories_from_project_page(html_page):
+    """Like scrape_repositories_from_project_page, using BeautifulSoup."""
+
     soup = BeautifulSoup(html_page)
+    return [_text(tag.a.string) for tag in soup(**repository_attribute_matching)]
 
-    for row in soup('table')[0].findAll('tr'):
-      tds = row('td')
-
-      # print tds
-      """[<td><a href="/maliit/maliit-framework/merge_requests/127">#127</a></td>,
-      <td style="color:#0080ff"> New      </td>,
-      <td><a href="/maliit/maliit-framework/merge_requests/127">Allow QML plugins to add custom import paths for QML files and QML modules </a> </td>,
-      <td>master</td>,
-      <td><a href="/~mikhas">mikhas</a></td>,
-      <td><abbr class="timeago" title="2011-12-17T15:35:14Z">2011-12-17 15:35:14 UTC</abbr></td>]"""
-
-      # Columns: ID, Status, Summary, Target branch, Creator, Age
-      mrq_id = tds[0].a.string.strip('#')
-      status = tds[1].string.strip()
-      summary = tds[2].a.string
-      target_branch = "" # Not on the page anymore
-      creator = tds[3].a.string
-      creation = datetime.datetime.strptime(tds[4].abbr['title'], '%Y-%m-%dT%H:%M:%SZ')
-
-      merge_requests.append({'id': mrq_id, 'status': status,
-            'summary': summary, 'target_branch': target_branch,
-            'creator': creator, 'creation': creation})
+def stream_scrape_repositories_from_project_page(html_page):
+    """Like scrape_repositories_from_project_page, without building a tree of the page."""
 
-    return merge_requests
+    elements = htmlstream.matching_elements(html_page, **repository_attribute_matching)
+    return [_text(tag.a.string) for tag in elements]
 
 def scrape_repositories_from_project_page(html_page):
     """Returns a list of the repositories in this project."""
 
-    repositories = []
-    soup = BeautifulSoup(html_page)
-
-    attribute_matching = {'class': 'repository'}
-    for tag in soup(**attribute_matching):
-        repositories.append(tag.a.string)
+    try:
+        return stream_scrape_repositories_from_project_page(html_page)
+    except Exception:
+        return soup_scrape_repositories_from_project_page(html_page)
 
-    return repositories
+def repository_path(project, repo):
+    """Returns the path of repo below the host.
+    Repository names may be bare, or prefixed with the project."""
+    if '/' in repo:
+        return repo
+    return '%s/%s' % (project, repo)
 
 def add_repo_info_to_mrqs(mrqs, repo):
     for mrq in mrqs:
         mrq['repository'] = repo
 
+def scrape_repository_mrqs(html_page, repo):
+    open_mrqs = scrape_mrq_status_from_mrq_page(html_page)
+    add_repo_info_to_mrqs(open_mrqs, repo)
+    return open_mrqs
+
 def open_merge_requests(host, project):
 
     mrqs = []
@@ -82,7 +130,7 @@ def open_merge_requests(host, project):
     repositories = scrape_repositories_from_project_page(html)
 
     for repo in repositories:
-        mrq_overview_url = mrq_overview_page_url_template % dict(host=host, project=project, repo=repo)
+        mrq_overview_url = mrq_overview_page_url_template % dict(host=host, repo=repository_path(project, repo))
         html = urllib2.urlopen(mrq_overview_url)
         open_mrqs = scrape_mrq_status_from_mrq_page(html)
         add_repo_info_to_mrqs(open_mrqs, repo)
@@ -92,34 +140,45 @@ def open_merge_requests(host, project):
 
 TIMEOUT=40
 
+parse_seconds = metrics.registry.summary('parse_seconds', 'Time to parse a page, including waiting for a worker.')
+
 class MergeRequestRetrieverProtocol(object):
     def __init__(self):
         self.with_errors = 0
-        self.error_list = []
+        self.error_list = deque(maxlen=metrics.MAX_ERRORS) # Most recent errors
+        # Last scrape result for each URL, reused when the page is not modified
+        self.scraped = {}
 
     def gotError(self, traceback, extra_args):
         print traceback, extra_args
         self.with_errors += 1
         self.error_list.append(extra_args)
+        metrics.errors.inc(stage='scrape')
+
+    def notModified(self, failure):
+        failure.trap(httpcache.NotModified)
+        return None # Use the previous scrape result
 
     def getPage(self, url):
-        # TODO: be nice and use HTTP conditional GET to reduce load
-        # http://fishbowl.pastiche.org/2002/10/21/http_conditional_get_for_rss_hackers/
-        # http://www.phppatterns.com/docs/develop/twisted_aggregator
-        return client.getPage(url, timeout=TIMEOUT)
+        # Only ask for changes if we still have the previous result
+        conditional = url in self.scraped
+        # Listings are requested again, remember their validators even if retrieved unconditionally
+        return httpcache.getPage(url, conditional=conditional, timeout=TIMEOUT, remember=True)
 
     def start(self, host, project):
 
         project_url = project_page_url_template % dict(host=host, project=project)
         d = defer.succeed(project_url)
 
-        d.addCallback(self.getPage)
+        d.addCallback(diagnostics.traced('getting %s' % project_url, self.getPage))
+        d.addErrback(self.notModified)
         d.addErrback(self.gotError, (project_url, 'getting project page'))
 
-        d.addCallback(self.scrapeProjectPage)
+        d.addCallback(diagnostics.traced('scraping %s' % project_url, self.scrapeProjectPage), project_url)
         d.addErrback(self.gotError, (project_url, 'scraping project page'))
 
-        d.addCallback(self.processRepositoryList, host, project)
+        d.addCallback(diagnostics.traced('listing repositories of %s' % project_url, self.processRepositoryList),
+                      host, project)
         d.addErrback(self.gotError, (project_url, ''))
 
         d.addCallback(self.unNestList)
@@ -127,30 +186,54 @@ class MergeRequestRetrieverProtocol(object):
 
         return d
 
-    def scrapeProjectPage(self, html):
-        return scrape_repositories_from_project_page(html)
+    def startRepositories(self, host, project, repositories):
+        """Like start, but only retrieves the merge requests of the given repositories."""
+
+        d = self.processRepositoryList(repositories, host, project)
+
+        d.addCallback(self.unNestList)
+        d.addErrback(self.gotError, (repositories, ''))
+
+        return d
+
+    def scrapeProjectPage(self, html, url):
+        if html is None:
+            return self.scraped.get(url)
+
+        d = parse_seconds.time(workers.run(scrape_repositories_from_project_page, html), page='project')
+        d.addCallback(self.storeScraped, url)
+        return d
 
     def processRepositoryList(self, repositories, host, project):
         deferred_list = []
 
         for repo in repositories:
-            mrq_overview_url = str(mrq_overview_page_url_template % dict(host=host, project=project, repo=repo))
+            mrq_overview_url = str(mrq_overview_page_url_template % dict(host=host, repo=repository_path(project, repo)))
             d = defer.succeed(mrq_overview_url)
 
-            d.addCallback(self.getPage)
+            d.addCallback(diagnostics.traced('getting %s' % mrq_overview_url, self.getPage))
+            d.addErrback(self.notModified)
             d.addErrback(self.gotError, (mrq_overview_url, 'retrieving %s' % mrq_overview_url))
 
-            d.addCallback(self.scrapeMergeRequestPage, host, project, repo)
+            d.addCallback(diagnostics.traced('scraping %s' % mrq_overview_url, self.scrapeMergeRequestPage),
+                          mrq_overview_url, repo)
             d.addErrback(self.gotError, (mrq_overview_url, 'scraping merge requests for %s' % repo))
 
             deferred_list.append(d)
 
         return defer.gatherResults(deferred_list)
 
-    def scrapeMergeRequestPage(self, html, host, project, repo):
-        open_mrqs = scrape_mrq_status_from_mrq_page(html)
-        add_repo_info_to_mrqs(open_mrqs, repo)
-        return open_mrqs
+    def scrapeMergeRequestPage(self, html, url, repo):
+        if html is None:
+            return self.scraped.get(url)
+
+        d = parse_seconds.time(workers.run(scrape_repository_mrqs, html, repo), page='merge_requests')
+        d.addCallback(self.storeScraped, url)
+        return d
+
+    def storeScraped(self, result, url):
+        self.scraped[url] = result
+        return result
 
     def unNestList(self, nested_list):
         flat = []
@@ -172,6 +255,9 @@ class MergeRequestRetriever(protocol.ClientFactory):
     def start(self, project, host):
         return self.protocol.start(project, host)
 
+    def startRepositories(self, host, project, repositories):
+        return self.protocol.startRepositories(host, project, repositories)
+
 if __name__ == '__main__':
 
     from twisted.internet import reactor
@@ -0,0 +1,156 @@
+"""Status of the open merge requests, as a HTML widget and as JSON,
+for embedding into websites.
+
+The status is rendered from the snapshots of the bots, never causing
+a scan of the site. Each format is rendered and compressed once per
+version of the snapshots, and served with a strong ETag, so that
+clients revalidate it with a 304 response."""
+
+import json, gzip, hashlib, StringIO, cgi
+
+from twisted.web import resource
+
+from gitorious_mrq import metrics
+
+MAX_AGE = 60 # Seconds clients and proxies may use the status without revalidating it
+
+responses = metrics.registry.counter('status_responses_total', 'Responses to requests for the status, per format and code.')
+
+HTML_TEMPLATE = '''<div class="gitorious-mrq-status">
+%s
+</div>
+'''
+HTML_PROJECT_TEMPLATE = '''<h3>%(project)s</h3>
+%(body)s'''
+HTML_TABLE_TEMPLATE = '''<table>
+%s
+</table>'''
+HTML_ROW_TEMPLATE = '<tr><td><a href="%(url)s">%(repository)s #%(id)s</a></td><td>%(status)s</td><td>%(summary)s</td></tr>'
+HTML_NO_DATA = '<p>No data available</p>'
+
+def mrq_data(bot, mrq):
+    data = dict(mrq)
+    data['url'] = bot.mrqUrl(mrq)
+    if data.get('creation') is not None:
+        data['creation'] = data['creation'].strftime('%Y-%m-%dT%H:%M:%SZ')
+    return data
+
+def render_json(bots):
+    projects = []
+    for bot in bots:
+        mrqs = bot.cachedMergeRequests()
+        projects.append({'host': bot.host, 'project': bot.project,
+                         'merge_requests': None if mrqs is None else [mrq_data(bot, mrq) for mrq in mrqs]})
+    return json.dumps({'projects': projects}, sort_keys=True)
+
+def render_html(bots):
+    projects = []
+    for bot in bots:
+        mrqs = bot.cachedMergeRequests()
+        if mrqs is None:
+            body = HTML_NO_DATA
+        else:
+            rows = '\n'.join(HTML_ROW_TEMPLATE % dict((name, cgi.escape(unicode(value or ''), quote=True))
+                                                      for name, value in mrq_data(bot, mrq).items())
+                             for mrq in mrqs)
+            body = HTML_TABLE_TEMPLATE % rows
+        projects.append(HTML_PROJECT_TEMPLATE % dict(project=cgi.escape(bot.project), body=body))
+    return (HTML_TEMPLATE % '\n'.join(projects)).encode('utf-8')
+
+FORMATS = {
+    'html': ('text/html; charset=utf-8', render_html),
+    'json': ('application/json', render_json),
+}
+
+def gzip_body(body):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb', mtime=0)
+    f.write(body)
+    f.close()
+    return out.getvalue()
+
+def accepts_gzip(request):
+    for coding in (request.getHeader('Accept-Encoding') or '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() != 'gzip':
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def etag_matches(request, etag):
+    header = request.getHeader('If-None-Match')
+    if header is None:
+        return False
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
+
+class Rendering(object):
+    """A body rendered for a version of the snapshots, plain and compressed."""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.gzipped = gzip_body(body)
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzipped_etag = '"%s-gzip"' % digest
+
+class StatusResource(resource.Resource):
+    """Serves the status of the projects of factory in format, 'html' or 'json'.
+    The projects can be limited to one with the project argument."""
+
+    isLeaf = True
+
+    def __init__(self, factory, format='html', max_age=MAX_AGE):
+        resource.Resource.__init__(self)
+        self.factory = factory
+        self.format = format
+        self.content_type, self.render_body = FORMATS[format]
+        self.max_age = max_age
+        self._renderings = {} # project or None -> Rendering
+        self.renders = 0
+
+    def rendering(self, project):
+        """Returns the Rendering for project, or all projects if None."""
+
+        bots = [bot for bot in self.factory.bots if project is None or bot.project == project]
+        version = tuple((bot.project, bot.snapshot_version) for bot in bots)
+
+        cached = self._renderings.get(project)
+        if cached is None or cached.version != version:
+            self.renders += 1
+            cached = Rendering(version, self.render_body(bots))
+            self._renderings[project] = cached
+        return cached
+
+    def render_GET(self, request):
+        project = request.args.get('project', [None])[0]
+        if project is not None and self.factory.findBot(project) is None:
+            request.setResponseCode(404)
+            responses.inc(format=self.format, code=404)
+            return 'Project not monitored'
+
+        rendering = self.rendering(project)
+        compressed = accepts_gzip(request)
+        etag = rendering.gzipped_etag if compressed else rendering.etag
+
+        request.setHeader('Content-Type', self.content_type)
+        request.setHeader('Cache-Control', 'public, max-age=%d' % self.max_age)
+        request.setHeader('Vary', 'Accept-Encoding')
+        request.setHeader('ETag', etag)
+
+        if etag_matches(request, etag):
+            request.setResponseCode(304)
+            responses.inc(format=self.format, code=304)
+            return ''
+
+        responses.inc(format=self.format, code=200)
+        if compressed:
+            request.setHeader('Content-Encoding', 'gzip')
+            return rendering.gzipped
+        return rendering.body
@@ -0,0 +1,144 @@
+"""Persistent state of the monitor, stored in SQLite.
+
+Keeps the keys of the feed entries that have been seen, and the latest
+snapshot of open merge requests per repository, so that a restarted
+monitor neither repeats nor misses events, and can answer at once.
+
+State is stored per project, identified by the URL of the project page."""
+
+import sqlite3, json, datetime
+
+from collections import OrderedDict
+
+from gitorious_mrq import entries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project TEXT NOT NULL,
+    key TEXT NOT NULL,
+    UNIQUE (project, key)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    project TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    merge_requests TEXT NOT NULL,
+    PRIMARY KEY (project, repository)
+);
+CREATE TABLE IF NOT EXISTS project_state (
+    project TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (project, name)
+);
+"""
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def mrq_to_json(mrq):
+    data = dict(mrq)
+    if isinstance(data.get('creation'), datetime.datetime):
+        data['creation'] = data['creation'].strftime(DATE_FORMAT)
+    return data
+
+def mrq_from_json(data):
+    mrq = dict(data)
+    if mrq.get('creation'):
+        mrq['creation'] = datetime.datetime.strptime(mrq['creation'], DATE_FORMAT)
+    return mrq
+
+class StateStore(object):
+
+    def __init__(self, path, max_seen_entries=entries.MAX_SEEN_ENTRIES):
+        self.path = path
+        self.max_seen_entries = max_seen_entries
+        self.db = sqlite3.connect(path)
+        # Write-ahead logging makes the frequent small writes cheap
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def loadSeenEntries(self, project, seen):
+        """Add the stored keys for project to the SeenEntries seen, oldest first."""
+
+        cursor = self.db.execute('SELECT key FROM seen_entries WHERE project = ? ORDER BY id', (project,))
+        for (key,) in cursor:
+            seen.add(key)
+
+    def addSeenEntries(self, project, keys):
+        """Store keys, given oldest first, as seen. The oldest keys are pruned."""
+
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO seen_entries (project, key) VALUES (?, ?)',
+                                [(project, key) for key in keys])
+            self.db.execute("""DELETE FROM seen_entries WHERE project = ? AND id NOT IN
+                               (SELECT id FROM seen_entries WHERE project = ? ORDER BY id DESC LIMIT ?)""",
+                            (project, project, self.max_seen_entries))
+
+    def loadSnapshot(self, project):
+        """Returns the stored open merge requests of project as an OrderedDict
+        mapping repository to a list of merge requests, or None if not stored."""
+
+        if self.getValue(project, 'snapshot_time') is None:
+            return None
+
+        snapshot = OrderedDict()
+        cursor = self.db.execute("""SELECT repository, merge_requests FROM snapshots
+                                    WHERE project = ? ORDER BY position""", (project,))
+        for repository, merge_requests in cursor:
+            snapshot[repository] = [mrq_from_json(mrq) for mrq in json.loads(merge_requests)]
+        return snapshot
+
+    def saveSnapshot(self, project, snapshot, timestamp):
+        """Store snapshot, as returned by loadSnapshot, replacing the stored one.
+        timestamp is the time of the full scan it was made from."""
+
+        rows = []
+        for position, (repository, mrqs) in enumerate(snapshot.items()):
+            rows.append((project, repository, position, json.dumps([mrq_to_json(mrq) for mrq in mrqs])))
+
+        with self.db:
+            self.db.execute('DELETE FROM snapshots WHERE project = ?', (project,))
+            self.db.executemany("""INSERT INTO snapshots (project, repository, position, merge_requests)
+                                   VALUES (?, ?, ?, ?)""", rows)
+            self._setValue(project, 'snapshot_time', timestamp)
+
+    def saveRepositories(self, project, snapshot, repositories):
+        """Store the merge requests of repositories in snapshot, after refreshing only those.
+        Repositories not in snapshot are removed. The time of the snapshot is kept."""
+
+        with self.db:
+            for repository in repositories:
+                mrqs = snapshot.get(repository)
+                if mrqs is None:
+                    self.db.execute('DELETE FROM snapshots WHERE project = ? AND repository = ?',
+                                    (project, repository))
+                    continue
+
+                merge_requests = json.dumps([mrq_to_json(mrq) for mrq in mrqs])
+                cursor = self.db.execute('UPDATE snapshots SET merge_requests = ? WHERE project = ? AND repository = ?',
+                                         (merge_requests, project, repository))
+                if cursor.rowcount == 0:
+                    # New repositories come last, like in the snapshot
+                    self.db.execute("""INSERT INTO snapshots (project, repository, position, merge_requests)
+                                       SELECT ?, ?, COALESCE(MAX(position), -1) + 1, ? FROM snapshots WHERE project = ?""",
+                                    (project, repository, merge_requests, project))
+
+    def getValue(self, project, name):
+        row = self.db.execute('SELECT value FROM project_state WHERE project = ? AND name = ?',
+                              (project, name)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def _setValue(self, project, name, value):
+        self.db.execute('INSERT OR REPLACE INTO project_state (project, name, value) VALUES (?, ?, ?)',
+                        (project, name, json.dumps(value)))
+
+    def setValue(self, project, name, value):
+        with self.db:
+            self._setValue(project, name, value)
@@ -0,0 +1,82 @@
+"""Endpoint for merge request events pushed to us, as an alternative
+to waiting for them to show up in the polled activity feed.
+
+Events are POSTed as JSON, from a relay of the feed or a Gitorious hook:
+
+ {"project": "maliit",
+  "host": "http://gitorious.org",
+  "events": [{"id": "tag:gitorious.org,2005:Event/1234",
+              "title": "jonnor updated merge request maliit/maliit-plugins #12&#x2192; State changed from New to Merged",
+              "link": "http://gitorious.org/maliit/maliit-plugins/merge_requests/12",
+              "updated": "2012-01-19T12:00:00Z"}]}
+
+host is optional. Events are like the entries of the feed, newest first,
+and only title is required. Events that have the id of the feed entry
+are not reported again when the feed is read.
+
+If a token is configured, it must be given in the X-Webhook-Token header."""
+
+import json, hmac
+
+from twisted.web import resource
+
+TOKEN_HEADER = 'X-Webhook-Token'
+
+class BadRequest(Exception):
+    pass
+
+def parse_events(body):
+    """Returns (project, host, events) from the JSON body of a request.
+    Raises BadRequest if it is not valid."""
+
+    try:
+        data = json.loads(body)
+    except ValueError, e:
+        raise BadRequest('Invalid JSON: %s' % e)
+
+    if not isinstance(data, dict) or not isinstance(data.get('project'), basestring):
+        raise BadRequest('Expected an object with a project')
+
+    events = data.get('events')
+    if not isinstance(events, list):
+        raise BadRequest('Expected a list of events')
+    for event in events:
+        if not isinstance(event, dict) or not isinstance(event.get('title'), basestring):
+            raise BadRequest('Expected events with a title')
+
+    return data['project'], data.get('host'), events
+
+class WebhookResource(resource.Resource):
+    """Passes pushed events to the IrcBot of their project, found with factory.findBot."""
+
+    isLeaf = True
+
+    def __init__(self, factory, token=None):
+        resource.Resource.__init__(self)
+        self.factory = factory
+        self.token = token
+        self.received = 0
+
+    def respond(self, request, code, data):
+        request.setResponseCode(code)
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(data)
+
+    def render_POST(self, request):
+        if self.token is not None:
+            given = request.getHeader(TOKEN_HEADER) or ''
+            if not hmac.compare_digest(given, self.token):
+                return self.respond(request, 403, {'error': 'Invalid token'})
+
+        try:
+            project, host, events = parse_events(request.content.read())
+        except BadRequest, e:
+            return self.respond(request, 400, {'error': str(e)})
+
+        bot = self.factory.findBot(project, host)
+        if bot is None:
+            return self.respond(request, 404, {'error': 'Project not monitored: %s' % project})
+
+        self.received += len(events)
+        new_items = bot.processPushedItems(events) if events else []
+        return self.respond(request, 202, {'events': len(events), 'new': len(new_items)})
@@ -0,0 +1,13 @@
+"""Embedded web server for endpoints like webhooks.
+
+Endpoints are added to root with putChild, and served
+on the port given to listen."""
+
+from twisted.internet import reactor
+from twisted.web import server, resource
+
+root = resource.Resource()
+
+def listen(port, interface=''):
+    print 'Serving HTTP on port %d' % port
+    return reactor.listenTCP(port, server.Site(root), interface=interface)
@@ -0,0 +1,103 @@
+"""Executors for running parsing outside of the reactor thread.
+
+Parsing feeds and scraping pages can take hundreds of milliseconds
+for big projects. Doing it in the reactor thread delays everything
+else, like answering IRC PINGs.
+
+Functions run in a ProcessExecutor must be module-level functions,
+and their arguments and results must be picklable."""
+
+import multiprocessing, traceback, cPickle
+
+from twisted.internet import reactor, defer, threads
+from twisted.python import threadpool
+
+DEFAULT_SIZE = 2
+PROCESS_TIMEOUT = 5*60 # Seconds to wait for a worker process, which may have died
+
+class WorkerError(Exception):
+    """An exception raised in a worker process, with its traceback as message."""
+
+class InlineExecutor(object):
+    """Runs the function directly in the reactor thread."""
+
+    def run(self, function, *args):
+        return defer.maybeDeferred(function, *args)
+
+class ThreadExecutor(object):
+    """Runs the function in a pool of threads."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.pool = threadpool.ThreadPool(minthreads=1, maxthreads=size, name='parse')
+
+    def run(self, function, *args):
+        if not self.pool.started:
+            self.pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+        return threads.deferToThreadPool(reactor, self.pool, function, *args)
+
+def _call(function, args):
+    # The result is pickled here, as the pool never calls back
+    # for results it fails to pickle
+    try:
+        return True, cPickle.dumps(function(*args), cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False, traceback.format_exc()
+
+class ProcessExecutor(object):
+    """Runs the function in a pool of processes.
+    Avoids contention on the GIL for CPU bound parsing.
+
+    Should be created before the reactor is started, as forking
+    while other threads hold locks can deadlock the workers.
+
+    If a worker process dies, its result never comes, so the Deferreds
+    fail with defer.TimeoutError after timeout seconds."""
+
+    def __init__(self, size=DEFAULT_SIZE, timeout=PROCESS_TIMEOUT):
+        self.pool = multiprocessing.Pool(size)
+        self.timeout = timeout
+        reactor.addSystemEventTrigger('during', 'shutdown', self.pool.terminate)
+
+    def run(self, function, *args):
+        d = defer.Deferred()
+
+        def gotResult(result):
+            # Called in a thread of the pool, pass it to the reactor thread
+            succeeded, value = result
+            if succeeded:
+                value = cPickle.loads(value)
+            reactor.callFromThread(self._fire, d, (succeeded, value))
+
+        self.pool.apply_async(_call, (function, args), callback=gotResult)
+        d.addTimeout(self.timeout, reactor)
+        return d
+
+    def _fire(self, d, result):
+        if d.called:
+            return # Timed out
+        succeeded, value = result
+        if succeeded:
+            d.callback(value)
+        else:
+            d.errback(WorkerError(value))
+
+executor = ThreadExecutor()
+
+def configure(size, processes=False):
+    """Set the executor used for parsing.
+    A size of 0 means to parse in the reactor thread."""
+    global executor
+
+    if size <= 0:
+        executor = InlineExecutor()
+    elif processes:
+        executor = ProcessExecutor(size)
+    else:
+        executor = ThreadExecutor(size)
+
+def run(function, *args):
+    """Run function(*args) using the configured executor.
+    Returns a Deferred firing with the result."""
+    return executor.run(function, *args)
@@ -23,6 +23,6 @@ setup(name='gitorious-mrq-monitor',
     author_email='jononor@gmail.com',
     url='https://github.com/jonnor/gitorious-mrq-monitor',
     packages=['gitorious_mrq'],
-    scripts=['bin/gitorious-mrq-monitor'],
+    scripts=['bin/gitorious-mrq-monitor', 'bin/gitorious-mrq-backfill'],
     classifiers=classifiers,
 )
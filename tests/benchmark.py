@@ -0,0 +1,256 @@
+"""Benchmarks for the feed-to-message and scrape pipelines.
+
+Runs each benchmark in its own process, and reports throughput,
+latency percentiles and peak memory. Results can be saved as JSON,
+and compared against results saved earlier, for instance from
+another commit:
+
+ python tests/benchmark.py --output before.json
+ (change code)
+ python tests/benchmark.py --compare before.json
+"""
+
+import optparse, os, sys, time, json, resource, subprocess, multiprocessing, platform, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from gitorious_mrq import feedreader, scrape, ircbot, model, entries
+
+import generate
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+
+PROJECT = 'maliit'
+TIMEOUT = 10*60 # Seconds a benchmark may take, at most
+HOST = 'http://gitorious.org'
+
+def fixture_feeds():
+    return [open(os.path.join(data_dir, 'maliit.atom.%d.txt' % i)).read() for i in range(1, 5)]
+
+def synthetic_feed(entries):
+    repositories = generate.repository_names(40)
+    return generate.feed(PROJECT, generate.feed_entries(PROJECT, repositories, entries))
+
+def synthetic_merge_request_page(mrqs):
+    return generate.merge_request_page(PROJECT, 'repository-0', generate.merge_request_rows(mrqs))
+
+def synthetic_mrqs(mrqs):
+    rows = generate.merge_request_rows(mrqs)
+    page = generate.merge_request_page(PROJECT, 'repository-0', rows)
+    return scrape.scrape_repository_mrqs(page, 'repository-0')
+
+# Each benchmark is a function taking the options, returning (setup, run, items)
+# setup() creates the input outside of the measurement,
+# run(input) is measured, items is the number of items processed per run
+
+def bench_parse_feed_fixtures(options):
+    return fixture_feeds, lambda feeds: [feedreader.parse_feed(feed) for feed in feeds], 4*30
+
+def bench_parse_feed_synthetic(options):
+    return (lambda: synthetic_feed(options.entries)), feedreader.parse_feed, options.entries
+
+def bench_new_items_and_messages(options):
+    def setup():
+        return feedreader.parse_feed(synthetic_feed(options.entries))
+
+    def run(parsed):
+        messager = ircbot.GitoriousMergeRequestMessager(HOST, PROJECT, lambda msg: None)
+        messager.first_run = False
+        # Remember all entries, so that none are new the second time
+        messager.seen = entries.SeenEntries(max_size=options.entries)
+        messager.processRss(parsed)
+        # A second poll of the same feed, where nothing is new
+        messager.processRss(parsed)
+
+    return setup, run, options.entries
+
+def bench_new_items_fixtures(options):
+    def setup():
+        return [feedreader.parse_feed(feed) for feed in fixture_feeds()]
+
+    def run(parsed_feeds):
+        messager = ircbot.GitoriousMergeRequestMessager(HOST, PROJECT, lambda msg: None)
+        for parsed in parsed_feeds:
+            messager.processRss(parsed)
+
+    return setup, run, 4*30
+
+def bench_scrape_merge_requests(options):
+    return (lambda: synthetic_merge_request_page(options.mrqs)), scrape.scrape_mrq_status_from_mrq_page, options.mrqs
+
+def bench_scrape_merge_requests_soup(options):
+    return (lambda: synthetic_merge_request_page(options.mrqs)), scrape.soup_scrape_mrq_status_from_mrq_page, options.mrqs
+
+def bench_scrape_repositories(options):
+    repositories = options.mrqs // 5
+    def setup():
+        return generate.project_page(PROJECT, generate.repository_names(repositories))
+    return setup, scrape.scrape_repositories_from_project_page, repositories
+
+def bench_scrape_repositories_fixture(options):
+    def setup():
+        return open(os.path.join(data_dir, 'maliit', 'index.html')).read()
+    return setup, scrape.scrape_repositories_from_project_page, 1
+
+def bench_format_listing(options):
+    return (lambda: synthetic_mrqs(options.mrqs)), ircbot.format_mrq_status_listing, options.mrqs
+
+def bench_snapshot(options):
+    def setup():
+        return [dict(mrq, repository='repository-%d' % (i % 40)) for i, mrq in enumerate(synthetic_mrqs(options.mrqs))]
+    return setup, ircbot.IrcBot.groupByRepository, options.mrqs
+
+def bench_diff_snapshots(options):
+    def setup():
+        old = [model.MergeRequest.fromDict(mrq) for mrq in synthetic_mrqs(options.mrqs)]
+        new = [model.MergeRequest.fromDict(dict(mrq, status='Merged') if i % 10 == 0 else mrq)
+               for i, mrq in enumerate(old) if i % 7]
+        return old, new
+    return setup, lambda (old, new): model.diff(old, new), options.mrqs
+
+benchmarks = [
+    ('parse_feed_fixtures', bench_parse_feed_fixtures),
+    ('parse_feed_synthetic', bench_parse_feed_synthetic),
+    ('new_items_fixtures', bench_new_items_fixtures),
+    ('new_items_and_messages', bench_new_items_and_messages),
+    ('scrape_merge_requests', bench_scrape_merge_requests),
+    ('scrape_merge_requests_soup', bench_scrape_merge_requests_soup),
+    ('scrape_repositories', bench_scrape_repositories),
+    ('scrape_repositories_fixture', bench_scrape_repositories_fixture),
+    ('format_listing', bench_format_listing),
+    ('snapshot', bench_snapshot),
+    ('diff_snapshots', bench_diff_snapshots),
+]
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_benchmark(name, factory, options, results):
+    """Run in a child process, so that peak memory is measured per benchmark."""
+
+    setup, run, items = factory(options)
+    data = setup()
+
+    rss_before = max_rss_kb()
+    run(data) # Warm up
+    latencies = []
+    started = time.time()
+    for i in range(options.repeat):
+        t = time.time()
+        run(data)
+        latencies.append(time.time() - t)
+    total = time.time() - started
+    latencies.sort()
+
+    results.put({
+        'name': name,
+        'items': items,
+        'repeat': options.repeat,
+        'throughput': items * options.repeat / total, # Items per second
+        'latency_mean': total / options.repeat,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p90': percentile(latencies, 0.9),
+        'latency_p99': percentile(latencies, 0.99),
+        'peak_memory_kb': max_rss_kb() - rss_before, # Growth of peak RSS over that after setup
+    })
+
+def wait_for_result(process, queue, timeout):
+    """Returns the result put in queue by process, or None if it failed or timed out."""
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result could have been put just before exiting
+            try:
+                return queue.get(timeout=1)
+            except Queue.Empty:
+                return None
+        if time.time() > deadline:
+            process.terminate()
+            return None
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(__file__)).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    old = dict((r['name'], r) for r in baseline['results'])
+    print
+    print 'Compared to %s (%s):' % (baseline.get('commit'), baseline.get('date'))
+    for result in results:
+        before = old.get(result['name'])
+        if before is None:
+            continue
+        print '%-30s throughput %6.2fx  p50 latency %6.2fx  peak memory %+d kB' % (
+            result['name'], result['throughput'] / before['throughput'],
+            result['latency_p50'] / before['latency_p50'],
+            result['peak_memory_kb'] - before['peak_memory_kb'])
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [BENCHMARK...]')
+    parser.add_option('', '--entries', default=10000, type='int',
+                      help='Number of entries in the synthetic feed.')
+    parser.add_option('', '--mrqs', default=1000, type='int',
+                      help='Number of open merge requests per repository.')
+    parser.add_option('', '--repeat', default=10, type='int',
+                      help='Number of measured runs of each benchmark.')
+    parser.add_option('', '--timeout', default=TIMEOUT, type='int',
+                      help='Seconds a benchmark may take before it is stopped.')
+    parser.add_option('', '--output', default=None,
+                      help='Save the results as JSON to this file.')
+    parser.add_option('', '--compare', default=None,
+                      help='Compare against results saved earlier with --output.')
+    (options, args) = parser.parse_args()
+
+    selected = [(name, factory) for name, factory in benchmarks if not args or name in args]
+
+    results = []
+    failed = []
+    print '%-30s %12s %10s %10s %10s %10s' % ('benchmark', 'items/s', 'p50 ms', 'p90 ms', 'p99 ms', 'peak kB')
+    for name, factory in selected:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_benchmark, args=(name, factory, options, queue))
+        process.start()
+        result = wait_for_result(process, queue, options.timeout)
+        process.join()
+        if result is None:
+            print '%-30s failed, exit code %s' % (name, process.exitcode)
+            failed.append(name)
+            continue
+        results.append(result)
+
+        print '%-30s %12.0f %10.2f %10.2f %10.2f %10d' % (name, result['throughput'],
+            result['latency_p50']*1000, result['latency_p90']*1000, result['latency_p99']*1000,
+            result['peak_memory_kb'])
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'options': {'entries': options.entries, 'mrqs': options.mrqs, 'repeat': options.repeat},
+        'results': results,
+    }
+
+    if options.output:
+        json.dump(report, open(options.output, 'w'), indent=2, sort_keys=True)
+
+    if options.compare:
+        compare(results, json.load(open(options.compare)))
+
+    if failed:
+        sys.exit('Failed benchmarks: %s' % ', '.join(failed))
+
+if __name__ == '__main__':
+    main()
@@ -1,76 +1,54 @@
-import os
+"""Verify the essential functionality of the bot, under load.
 
-from twisted.web import server, resource, static
-from twisted.internet import reactor, protocol
+Runs the monitor in-process against a fake Gitorious site and a fake
+IRC server, generates merge request activity and reports latency,
+throughput and load. See loadharness."""
 
-import gitorious_mrq
-import gitorious_mrq.ircbot
+import optparse, os, sys, json
 
-"""Verify the essential functionality of the bot."""
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
 
-# TODO: make into an automated test
-# Either
-# 1. Implement channels for Twisted Words IRC server
-# 2. Find another Python IRC server implementation
-#
-# Then hook up the IRC server in code and verify behavior programatically
+from twisted.internet import reactor
 
-monitor_executable = 'gitorious-mrq-monitor'
+from gitorious_mrq import workers
 
-class Feed(resource.Resource):
-    isLead = True
-    
-    def __init__(self):
-        resource.Resource.__init__(self)
-        self.request_no = 0
-    
-    def render_GET(self, request):
-        
-        # FIXME: unhardcode, make more general
-        self.request_no += 1
-        if self.request_no > 4:
-            self.request_no = 1
-        return open("tests/data/maliit.atom.%d.txt" % self.request_no).read()
+import loadharness
 
+def run(options):
+    projects = [loadharness.FakeProject('project%d' % i, options.repositories, options.mrqs, seed=i)
+                for i in range(options.projects)]
+    driver = loadharness.LoadDriver(projects, options.rate, options.poll_interval)
+    driver.start()
 
-class MonitorProcessProtocol(protocol.ProcessProtocol):
+    # Let the bots take their first look at the feeds before making activity
+    reactor.callLater(options.warmup, driver.startActivity)
 
-    def __init__(self):
-        pass
+    def finish():
+        driver.stop()
+        report = driver.report(options.duration)
+        print json.dumps(report, indent=2, sort_keys=True)
+        reactor.stop()
 
-
-def run_mrq_monitor():
-    
-    args = [monitor_executable, 'maliit',
-            '--host=http://localhost:8080', '--poll-interval=15', '--irc-channel=#gitorious-mrq-monitor-test',]
-    executable = monitor_executable
-    
-    #executable = 'which'
-    #args = [executable, 'gitorious-mrq-monitor']
-    print args
-    
-    # Hook up child process file descriptions to the parent
-    childFDs = { 0: 0, 1: 1, 2: 2}
-    
-    # FIXME: refactory gitorious-mrq-monitor such that we can call it directly as Python here?
-
-    processProtocol = MonitorProcessProtocol()
-    reactor.spawnProcess(processProtocol, executable, args=args, childFDs=childFDs, env=os.environ)
-
-def setup_feedserver():
-
-    root = static.File('./tests/data')
-    feed = Feed()
-    root.putChild("maliit.atom", feed)
-    site = server.Site(root)
-    reactor.listenTCP(8080, site)
-
-def setup_monitor():
-    reactor.callLater(3, run_mrq_monitor)
+    reactor.callLater(options.warmup + options.duration, finish)
+    reactor.run()
 
 if __name__ == '__main__':
-
-    setup_feedserver()  
-    setup_monitor()
-
-    reactor.run()
+    parser = optparse.OptionParser()
+    parser.add_option('', '--projects', default=1, type='int')
+    parser.add_option('', '--repositories', default=10, type='int',
+                      help='Repositories per project.')
+    parser.add_option('', '--mrqs', default=20, type='int',
+                      help='Open merge requests per repository.')
+    parser.add_option('', '--rate', default=0.5, type='float',
+                      help='Merge request state changes per second, over all projects.')
+    parser.add_option('', '--poll-interval', default=5, type='float')
+    parser.add_option('', '--warmup', default=5, type='float',
+                      help='Seconds to wait before starting activity.')
+    parser.add_option('', '--duration', default=60, type='float',
+                      help='Seconds to run with activity.')
+    parser.add_option('', '--parse-workers', default=workers.DEFAULT_SIZE, type='int')
+    (options, args) = parser.parse_args()
+
+    workers.configure(options.parse_workers)
+    run(options)
@@ -0,0 +1,114 @@
+"""Generators for synthetic Gitorious feeds and pages.
+
+Produces pages in the format scraped by gitorious_mrq.scrape,
+and feeds in the format of tests/data/maliit.atom.*.txt"""
+
+import datetime, random
+
+STATES = ['New', 'Reviewing', 'Revise and update', 'Recommended to merge',
+          'Go ahead and merge', 'Updated', 'Need info', 'Hold']
+
+def repository_names(count):
+    return ['repository-%d' % i for i in range(count)]
+
+def project_page(project, repositories):
+    items = []
+    for repo in repositories:
+        items.append('<li class="repository"><a href="/%s/%s">%s</a></li>' % (project, repo, repo))
+
+    return """<html><head><title>%(project)s - Gitorious</title></head><body>
+<div id="content"><h1>%(project)s</h1>
+<ul class="repositories">
+%(items)s
+</ul></div></body></html>""" % dict(project=project, items='\n'.join(items))
+
+def merge_request_rows(count, seed=0):
+    """Returns count tuples of (id, status, summary, creator, creation)"""
+
+    rand = random.Random(seed)
+    start = datetime.datetime(2011, 12, 1)
+    rows = []
+    for i in range(count, 0, -1):
+        creation = start + datetime.timedelta(minutes=rand.randint(0, 60*24*30))
+        rows.append((str(i), rand.choice(STATES), 'Fix &amp; improve component %d ' % i,
+                     'user%d' % rand.randint(0, 20), creation))
+    return rows
+
+def merge_request_page(project, repo, rows):
+    html_rows = []
+    for i, (mrq_id, status, summary, creator, creation) in enumerate(rows):
+        link = '/%s/%s/merge_requests/%s' % (project, repo, mrq_id)
+        html_rows.append("""<tr class="%(parity)s" id="merge_request_%(id)s">
+      <td><a href="%(link)s">#%(id)s</a></td>
+      <td style="color:#0080ff"> %(status)s      </td>
+      <td><a href="%(link)s">%(summary)s</a> </td>
+      <td><a href="/~%(creator)s">%(creator)s</a></td>
+      <td><abbr class="timeago" title="%(iso)s">%(utc)s</abbr></td>
+    </tr>""" % dict(parity=['even', 'odd'][i % 2], id=mrq_id, link=link, status=status,
+                    summary=summary, creator=creator,
+                    iso=creation.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    utc=creation.strftime('%Y-%m-%d %H:%M:%S UTC')))
+
+    return """<html><head><title>Merge requests in %(project)s/%(repo)s - Gitorious</title></head><body>
+<div id="content">
+  <table class="listing">
+  <tbody>
+%(rows)s
+  </tbody>
+  </table>
+  <table class="meta"><tr><td>Not a merge request</td></tr></table>
+</div></body></html>""" % dict(project=project, repo=repo, rows='\n'.join(html_rows))
+
+def feed_entries(project, repositories, count, seed=0, first_event=1):
+    """Returns count entries as (event id, title, updated), newest first."""
+
+    rand = random.Random(seed)
+    start = datetime.datetime(2011, 12, 1)
+    entries = []
+    for i in range(first_event, first_event + count):
+        repo = rand.choice(repositories)
+        mrq_id = rand.randint(1, 100)
+        kind = rand.randint(0, 3)
+        if kind == 0:
+            title = 'user requested merge of ~user/%s/%s with %s in merge request %s/%s #%d' % (project, repo, repo, project, repo, mrq_id)
+        elif kind == 1:
+            old, new = rand.sample(STATES, 2)
+            title = 'user updated merge request %s/%s #%d&amp;#x2192; State changed from %s to %s' % (project, repo, mrq_id, old, new)
+        elif kind == 2:
+            title = 'user commented  on merge request %s/%s #%d' % (project, repo, mrq_id)
+        else:
+            title = 'user pushed 2 commits  to ~user/%s/%s:master. View diff' % (project, repo)
+        updated = start + datetime.timedelta(minutes=i)
+        entries.append((i, title, updated))
+
+    entries.reverse()
+    return entries
+
+def feed(project, entries, host='http://gitorious.org'):
+    xml_entries = []
+    for event_id, title, updated in entries:
+        xml_entries.append("""  <entry>
+    <id>tag:gitorious.org,2005:Event/%(id)d</id>
+    <published>%(updated)s</published>
+    <updated>%(updated)s</updated>
+    <link type="text/html" rel="alternate" href="%(host)s/%(project)s"/>
+    <title>%(title)s</title>
+    <content type="html">%(title)s</content>
+    <author>
+      <name>user</name>
+    </author>
+  </entry>""" % dict(id=event_id, updated=updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                     host=host, project=project, title=title))
+
+    updated = entries[0][2] if entries else datetime.datetime(2011, 12, 1)
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<feed xml:lang="en-US" xmlns="http://www.w3.org/2005/Atom" xmlns:gts="http://gitorious.org/schema">
+  <id>tag:gitorious.org,2005:/%(project)s</id>
+  <link type="text/html" rel="alternate" href="%(host)s"/>
+  <link type="application/atom+xml" rel="self" href="%(host)s/%(project)s.atom"/>
+  <title>Gitorious: %(project)s activity</title>
+  <updated>%(updated)s</updated>
+%(entries)s
+</feed>
+""" % dict(project=project, host=host, updated=updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+           entries='\n'.join(xml_entries))
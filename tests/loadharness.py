@@ -0,0 +1,271 @@
+"""In-process end-to-end harness for the monitor.
+
+Consists of a fake Gitorious site with generated projects and activity,
+a minimal IRC server, and a driver that runs IrcBotFactory against them
+and measures:
+- latency from a change in the feed to the PRIVMSG reporting it
+- messages per second
+- HTTP requests per poll of the feed
+- reactor lag"""
+
+import random, re, datetime
+
+from twisted.internet import reactor, protocol, task, defer
+from twisted.protocols import basic
+from twisted.web import server, resource
+
+from gitorious_mrq import ircbot, scheduler
+
+import generate
+
+FEED_SIZE = 30 # Number of entries in a feed page, like Gitorious
+FEED_PAGES = 10 # Number of feed pages kept
+
+class FakeProject(object):
+    """A project with repositories, open merge requests and an activity feed."""
+
+    def __init__(self, name, repositories, mrqs_per_repository, seed=0):
+        self.name = name
+        self.random = random.Random(seed)
+        self.repositories = generate.repository_names(repositories)
+        self.rows = {}
+        for repo in self.repositories:
+            self.rows[repo] = [list(row) for row in generate.merge_request_rows(mrqs_per_repository, seed)]
+        self.events = [] # (event id, title, updated), newest first
+        self.event_times = {} # event id -> time the event was made
+        self.version = 0
+
+    def addEvent(self):
+        """Changes the state of a merge request, reporting it in the feed.
+        Returns the id of the event."""
+
+        repo = self.random.choice(self.repositories)
+        row = self.random.choice(self.rows[repo])
+        old_state = row[1]
+        row[1] = self.random.choice([s for s in generate.STATES if s != old_state])
+
+        event_id = len(self.event_times) + 1
+        # The event id in the user name lets the driver match messages to events
+        title = 'user%d updated merge request %s/%s #%s&amp;#x2192; State changed from %s to %s' % (
+            event_id, self.name, repo, row[0], old_state, row[1])
+        self.events.insert(0, (event_id, title, datetime.datetime.utcnow()))
+        del self.events[FEED_SIZE * FEED_PAGES:]
+        self.event_times[event_id] = reactor.seconds()
+        self.version += 1
+        return event_id
+
+class CountingResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, site, kind, render):
+        resource.Resource.__init__(self)
+        self.site = site
+        self.kind = kind
+        self.render_page = render
+
+    def render_GET(self, request):
+        self.site.requests[self.kind] = self.site.requests.get(self.kind, 0) + 1
+        etag, body = self.render_page(request)
+        if request.setETag(etag):
+            self.site.requests['not_modified'] = self.site.requests.get('not_modified', 0) + 1
+            return ''
+        return body
+
+class FakeGitorious(resource.Resource):
+    """Serves project pages, activity feeds and merge request listings."""
+
+    def __init__(self, projects):
+        resource.Resource.__init__(self)
+        self.projects = dict((p.name, p) for p in projects)
+        self.host = None
+        self.requests = {}
+
+    def getChild(self, name, request):
+        path = request.prepath + request.postpath
+        if len(path) == 1 and path[0].endswith('.atom') and path[0][:-5] in self.projects:
+            project = self.projects[path[0][:-5]]
+            kind = 'feed_pages' if 'page' in request.args else 'feed'
+            return CountingResource(self, kind, lambda request: self.renderFeed(project, request))
+
+        if len(path) == 1 and path[0] in self.projects:
+            project = self.projects[path[0]]
+            return CountingResource(self, 'project', lambda request: (
+                'project-%d' % len(project.repositories), generate.project_page(project.name, project.repositories)))
+
+        if len(path) == 3 and path[0] in self.projects and path[2] == 'merge_requests':
+            project = self.projects[path[0]]
+            repo = path[1]
+            if repo in project.rows:
+                return CountingResource(self, 'merge_requests', lambda request: (
+                    'mrqs-%d' % project.version, generate.merge_request_page(project.name, repo, project.rows[repo])))
+
+        return resource.NoResource()
+
+    def renderFeed(self, project, request):
+        page = int(request.args.get('page', ['1'])[0])
+        events = project.events[(page - 1) * FEED_SIZE:page * FEED_SIZE]
+        return 'feed-%d-%d' % (project.version, page), generate.feed(project.name, events, self.host)
+
+class FakeIrcServerProtocol(basic.LineReceiver):
+    """Just enough of an IRC server for the bot: registration, joining, PING and PRIVMSG."""
+
+    delimiter = '\n'
+
+    def connectionMade(self):
+        self.nick = None
+        self.factory.clients.append(self)
+
+    def connectionLost(self, reason):
+        self.factory.clients.remove(self)
+
+    def send(self, line):
+        self.transport.write(line + '\r\n')
+
+    def lineReceived(self, line):
+        line = line.rstrip('\r')
+        command, _, rest = line.partition(' ')
+        command = command.upper()
+
+        if command == 'NICK':
+            self.nick = rest.strip()
+        elif command == 'USER':
+            self.send(':fake.server 001 %s :Welcome' % self.nick)
+        elif command == 'JOIN':
+            for channel in rest.split()[0].split(','):
+                self.send(':%s!bot@localhost JOIN %s' % (self.nick, channel))
+        elif command == 'PING':
+            self.send(':fake.server PONG %s' % rest)
+        elif command == 'PRIVMSG':
+            target, _, message = rest.partition(' :')
+            self.factory.messageReceived(target, message)
+
+class FakeIrcServer(protocol.ServerFactory):
+    protocol = FakeIrcServerProtocol
+
+    def __init__(self):
+        self.clients = []
+        self.messages = [] # (time, target, message)
+        self.message_callback = None
+
+    def messageReceived(self, target, message):
+        self.messages.append((reactor.seconds(), target, message))
+        if self.message_callback is not None:
+            self.message_callback(target, message)
+
+class ReactorLagMonitor(object):
+    """Measures how late the reactor runs a call that is scheduled periodically."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lags = []
+        self._expected = None
+        self._task = task.LoopingCall(self.tick)
+
+    def start(self):
+        self._expected = reactor.seconds()
+        self._task.start(self.interval)
+
+    def stop(self):
+        if self._task.running:
+            self._task.stop()
+
+    def tick(self):
+        now = reactor.seconds()
+        self.lags.append(max(0, now - self._expected))
+        self._expected = now + self.interval
+
+event_regexp = re.compile(r'\buser(\d+) updated ')
+
+class LoadDriver(object):
+    """Runs the monitor against the fake site and IRC server,
+    generating activity in the projects at events_per_second."""
+
+    def __init__(self, projects, events_per_second, poll_interval=1):
+        self.projects = projects
+        self.events_per_second = events_per_second
+        self.poll_interval = poll_interval
+
+        self.site = FakeGitorious(projects)
+        self.irc = FakeIrcServer()
+        self.irc.message_callback = self.gotMessage
+        self.lag = ReactorLagMonitor()
+
+        self.latencies = []
+        self.factory = None
+        self._ports = []
+        self._connector = None
+        self._activity = task.LoopingCall(self.makeActivity)
+
+    def start(self):
+        http_port = reactor.listenTCP(0, server.Site(self.site), interface='127.0.0.1')
+        irc_port = reactor.listenTCP(0, self.irc, interface='127.0.0.1')
+        self._ports = [http_port, irc_port]
+        self.site.host = 'http://127.0.0.1:%d' % http_port.getHost().port
+
+        # All projects are monitored over one connection
+        self.factory = ircbot.IrcBotFactory('mrqbot')
+        for project in self.projects:
+            self.factory.addProject(self.site.host, project.name, ['#%s' % project.name],
+                                    self.poll_interval, max_poll_interval=self.poll_interval)
+        self._connector = reactor.connectTCP('127.0.0.1', irc_port.getHost().port, self.factory)
+        self.factory.monitor.startService()
+
+        self.lag.start()
+
+    def startActivity(self):
+        if self.events_per_second > 0:
+            self._activity.start(1.0 / self.events_per_second, now=False)
+
+    def makeActivity(self):
+        random.choice(self.projects).addEvent()
+
+    def gotMessage(self, target, message):
+        match = event_regexp.search(message)
+        if match is None:
+            return
+
+        event_id = int(match.group(1))
+        for project in self.projects:
+            if target == '#%s' % project.name and event_id in project.event_times:
+                self.latencies.append(reactor.seconds() - project.event_times[event_id])
+
+    def idle(self):
+        """Whether no fetches or refreshes are in flight."""
+        return scheduler.getScheduler().in_flight == 0
+
+    def stop(self):
+        if self._activity.running:
+            self._activity.stop()
+        self.lag.stop()
+
+        self.factory.monitor.stopService()
+        self.factory.clientConnectionLost = lambda connector, reason: None
+        self._connector.disconnect()
+
+        ports = self._ports
+        self._ports = []
+        return defer.DeferredList([port.stopListening() for port in ports])
+
+    def report(self, duration):
+        polls = self.site.requests.get('feed', 0)
+        total_requests = sum(count for kind, count in self.site.requests.items() if kind != 'not_modified')
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[int(round(fraction * (len(latencies) - 1)))]
+
+        return {
+            'events': sum(len(p.event_times) for p in self.projects),
+            'messages': len(self.irc.messages),
+            'messages_per_second': len(self.irc.messages) / duration,
+            'latency_p50': percentile(0.5),
+            'latency_p90': percentile(0.9),
+            'latency_max': percentile(1.0),
+            'polls': polls,
+            'requests': dict(self.site.requests),
+            'requests_per_poll': float(total_requests) / polls if polls else None,
+            'reactor_lag_max': max(self.lag.lags) if self.lag.lags else None,
+            'reactor_lag_mean': sum(self.lag.lags) / len(self.lag.lags) if self.lag.lags else None,
+        }
@@ -0,0 +1,84 @@
+import unittest, tempfile, shutil, os, sqlite3
+
+from gitorious_mrq import backfill
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'backfill.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def query(self, sql):
+        db = sqlite3.connect(self.output)
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_find_files(self):
+        files = list(backfill.find_files(['tests/data']))
+        self.assertIn(('feed', 'tests/data/maliit.atom.1.txt', 'maliit', None), files)
+        self.assertIn(('listing', 'tests/data/maliit/maliit-framework/merge_requests/index.html',
+                       'maliit', 'maliit-framework'), files)
+        self.assertEqual(len(files), 9)
+
+    def test_fixtures(self):
+        counts = backfill.run(['tests/data'], self.output, processes=2)
+        self.assertEqual((counts['files'], counts['errors'], counts['listings']), (9, 0, 5))
+        # The feeds overlap
+        self.assertEqual(counts['new_events'], len(self.query('SELECT key FROM events')))
+        self.assertTrue(counts['new_events'] < counts['events'])
+
+        # States can contain " to "
+        self.assertEqual(self.query("SELECT new_state FROM events WHERE old_state = 'Recommended to merge'"),
+                         [('Go ahead and merge',)])
+        self.assertEqual(self.query("SELECT merge_requests, merged FROM repository_stats "
+                                    "WHERE repository = 'maliit-framework'"), [(3, 1)])
+        self.assertEqual(self.query("SELECT state, count FROM state_counts WHERE repository = 'maliit-plugins'"),
+                         [('New', 5)])
+
+        # Nothing new the second time
+        self.assertEqual(backfill.run(['tests/data'], self.output, processes=0)['new_events'], 0)
+
+    def test_hours_to_merge(self):
+        store = backfill.BackfillStore(self.output)
+        store.addListing('maliit', 'a', '2012-01-01T00:00:00Z', [('1', 'New', 'Fix', 'jonnor', '2011-12-31T00:00:00Z')])
+        store.addEvents([
+            ('e1', 'maliit', 'a', '1', '2012-01-01T12:00:00Z', 'jonnor', 'state_changed', 'New', 'Merged', ''),
+            ('e2', 'maliit', 'a', '2', '2012-01-01T00:00:00Z', 'jonnor', 'opened', None, None, ''),
+            ('e3', 'maliit', 'a', '2', '2012-01-01T06:00:00Z', 'jonnor', 'state_changed', 'New', 'Merged', ''),
+        ])
+        store.commit()
+        store.writeStatistics()
+        store.close()
+
+        self.assertEqual(self.query('SELECT merge_requests, merged, mean_hours_to_merge, median_hours_to_merge '
+                                    'FROM repository_stats'), [(2, 2, 21.0, 21.0)])
+        self.assertEqual(self.query('SELECT state, count FROM state_counts'), [('Merged', 2)])
+
+    def test_commit_changed(self):
+        store = backfill.BackfillStore(self.output)
+        store.addListing('maliit', 'a', '2012-01-01T00:00:00Z', [('1', 'New', 'Fix', 'jonnor', None),
+                                                                 ('2', 'New', 'Fix', 'jonnor', None)])
+        store.commit()
+        before = store.db.total_changes
+        store.addListing('maliit', 'a', '2012-01-02T00:00:00Z', [('2', 'Merged', 'Fix', 'jonnor', None)])
+        store.commit()
+        self.assertEqual(store.db.total_changes - before, 1)
+        store.close()
+
+        self.assertEqual(self.query('SELECT mrq, first_listed, last_listed, status FROM merge_requests ORDER BY mrq'),
+                         [('1', '2012-01-01T00:00:00Z', '2012-01-01T00:00:00Z', 'New'),
+                          ('2', '2012-01-01T00:00:00Z', '2012-01-02T00:00:00Z', 'Merged')])
+
+    def test_listing_time(self):
+        path = os.path.join(self.directory, 'index.html')
+        open(path, 'w').close()
+        os.utime(path, (0, 0))
+        self.assertEqual(backfill.listing_time(path), '1970-01-01T00:00:00Z')
+
+        open(path + backfill.LISTING_TIME_SUFFIX, 'w').write('2012-01-01T00:00:00Z\n')
+        self.assertEqual(backfill.listing_time(path), '2012-01-01T00:00:00Z')
@@ -0,0 +1,55 @@
+import unittest, time, pstats, tempfile, shutil, os
+
+from gitorious_mrq import diagnostics
+
+class TestTraced(unittest.TestCase):
+
+    def test_stage(self):
+        stages = []
+        traced = diagnostics.traced('parsing feed', lambda x: stages.append(diagnostics.current_stage()) or x)
+        self.assertEqual(traced(1), 1)
+        self.assertEqual(stages, ['parsing feed'])
+        self.assertEqual(diagnostics.current_stage(), None)
+
+class TestWatchdog(unittest.TestCase):
+
+    def blocking_callback(self, watchdog):
+        # Pretend the watchdog thread looks while this blocks the reactor
+        return watchdog.check(time.time() + 10)
+
+    def test_stall_reported(self):
+        watchdog = diagnostics.Watchdog(threshold=5)
+        watchdog.beat()
+
+        self.assertEqual(watchdog.check(time.time()), None)
+
+        report = diagnostics.traced('scraping http://gitorious.org/maliit', self.blocking_callback)(watchdog)
+        self.assertIn('in stage: scraping http://gitorious.org/maliit', report)
+        self.assertIn('blocking_callback', report)
+
+        # Only reported once per stall
+        self.assertEqual(watchdog.check(time.time() + 20), None)
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = diagnostics.profiler
+        diagnostics.profiler = diagnostics.Profiler()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        diagnostics.profiler = self.profiler
+        shutil.rmtree(self.directory)
+
+    def test_profile(self):
+        def profiled_function():
+            return sum(range(100))
+
+        path = os.path.join(self.directory, 'callbacks.prof')
+        diagnostics.profiler.output = path
+        diagnostics.profiler.enable()
+        diagnostics.traced('summing', profiled_function)()
+        diagnostics.profiler.disable()
+
+        functions = [name for (filename, line, name) in pstats.Stats(path).stats]
+        self.assertIn('profiled_function', functions)
@@ -0,0 +1,91 @@
+from twisted.trial import unittest
+from twisted.internet import reactor, defer, task
+
+from gitorious_mrq import workers, httpclient
+
+import loadharness
+
+def wait_for(condition, timeout=10, interval=0.05):
+    """Returns a Deferred firing when condition() is true."""
+
+    d = defer.Deferred()
+    deadline = reactor.seconds() + timeout
+
+    def check():
+        if condition():
+            d.callback(None)
+        elif reactor.seconds() > deadline:
+            d.errback(AssertionError('Timed out waiting for condition'))
+        else:
+            reactor.callLater(interval, check)
+
+    check()
+    return d
+
+class TestEndToEnd(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = workers.executor
+        workers.configure(0)
+
+        self.project = loadharness.FakeProject('maliit', 3, 2)
+        self.driver = loadharness.LoadDriver([self.project], 0, poll_interval=0.2)
+        self.driver.start()
+
+    def tearDown(self):
+        workers.executor = self.executor
+        d = self.driver.stop()
+        d.addCallback(lambda result: httpclient.getClient().close())
+        # Let the disconnects happen
+        d.addCallback(lambda result: task.deferLater(reactor, 0.1, lambda: None))
+        return d
+
+    def test_state_change_reported(self):
+        bot = self.driver.factory.bots[0]
+        # Entries in the first poll of the feed are not reported
+        d = wait_for(lambda: bot.open_merge_requests is not None and not bot.processor.first_run)
+
+        def addEvents(result):
+            self.project.addEvent()
+            self.project.addEvent()
+            return wait_for(lambda: len(self.driver.latencies) == 2)
+
+        def reported(result):
+            targets = [target for time, target, message in self.driver.irc.messages]
+            self.assertEqual(targets, ['#maliit', '#maliit'])
+            self.assertIn('/maliit/repository-', self.driver.irc.messages[0][2])
+
+            report = self.driver.report(1)
+            self.assertEqual(report['events'], 2)
+            self.assertEqual(report['requests']['project'], 1)
+            self.assertTrue(report['requests']['merge_requests'] >= 3)
+
+        d.addCallback(addEvents)
+        d.addCallback(reported)
+        return d
+
+    def test_burst_longer_than_feed_page(self):
+        bot = self.driver.factory.bots[0]
+        d = wait_for(lambda: bot.open_merge_requests is not None and not bot.processor.first_run)
+
+        def addEvent(result):
+            self.project.addEvent()
+            return wait_for(lambda: len(self.driver.latencies) == 1)
+
+        def addBurst(result):
+            # More events between two polls than a page of the feed holds
+            bot.poller.stop()
+            for i in range(loadharness.FEED_SIZE + 10):
+                self.project.addEvent()
+            return bot.checkForUpdates()
+
+        def polled(result):
+            for event_id in self.project.event_times:
+                self.assertIn('tag:gitorious.org,2005:Event/%d' % event_id, bot.processor.seen)
+            self.assertTrue(self.driver.site.requests['feed_pages'] >= 1)
+            return wait_for(self.driver.idle)
+
+        d.addCallback(addEvent)
+        d.addCallback(addBurst)
+        d.addCallback(polled)
+        return d
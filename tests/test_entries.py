@@ -0,0 +1,51 @@
+import unittest
+
+from gitorious_mrq import entries, feedreader, ircbot
+
+def read_feed(number):
+    feed = open('tests/data/maliit.atom.%d.txt' % number).read()
+    return feedreader.parse_feed(feed)
+
+class TestEntryKey(unittest.TestCase):
+
+    def test_atom_id(self):
+        self.assertEqual(entries.entry_key({'id': 'tag:gitorious.org,2005:Event/1'}),
+                         'tag:gitorious.org,2005:Event/1')
+
+    def test_fallback(self):
+        item = {'link': 'http://gitorious.org/maliit', 'updated': '2011-12-18T00:25:30Z'}
+        self.assertEqual(entries.entry_key(item), entries.entry_key(dict(item)))
+        self.assertNotEqual(entries.entry_key(item),
+                            entries.entry_key(dict(item, updated='2011-12-19T00:25:30Z')))
+
+class TestSeenEntries(unittest.TestCase):
+
+    def test_evicts_oldest(self):
+        seen = entries.SeenEntries(max_size=2)
+        seen.add('a')
+        seen.add('b')
+        seen.add('a')
+        seen.add('c')
+        self.assertEqual(list(seen), ['a', 'c'])
+
+class TestGetNewItems(unittest.TestCase):
+
+    def setUp(self):
+        self.messager = ircbot.GitoriousMergeRequestMessager('http://gitorious.org', 'maliit', None)
+
+    def test_new_items(self):
+        first = read_feed(1)
+        self.assertEqual(len(self.messager.getNewItems(first)), len(first['items']))
+        self.assertEqual(self.messager.getNewItems(first), [])
+
+    def test_reordered_and_dropped_items(self):
+        first = read_feed(1)
+        self.messager.getNewItems(first)
+
+        items = list(first['items'])
+        items.reverse()
+        del items[:5]
+        self.assertEqual(self.messager.getNewItems({'items': items}), [])
+
+        # Items that dropped out of the feed are still known
+        self.assertEqual(self.messager.getNewItems(first), [])
@@ -0,0 +1,108 @@
+import os, tempfile
+
+from twisted.trial import unittest
+from twisted.internet import reactor, task, defer, error
+from twisted.web import server, resource
+
+from gitorious_mrq import httpcache, httpclient, scheduler
+
+class Page(resource.Resource):
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.etag = 'v1'
+        self.requests = 0
+
+    def render_GET(self, request):
+        self.requests += 1
+        if request.setETag(self.etag):
+            return ''
+        return 'contents of %s' % self.etag
+
+class TestValidatorCache(unittest.TestCase):
+
+    def test_headers(self):
+        cache = httpcache.ValidatorCache()
+        self.assertEqual(cache.headersFor('http://example.com'), {})
+
+        cache.update('http://example.com', {'etag': ['"abc"'], 'last-modified': ['Sat, 17 Dec 2011 15:35:14 GMT']})
+        self.assertEqual(cache.headersFor('http://example.com'),
+                         {'If-None-Match': '"abc"', 'If-Modified-Since': 'Sat, 17 Dec 2011 15:35:14 GMT'})
+
+    def test_persistence(self):
+        path = os.path.join(tempfile.mkdtemp(), 'validators.json')
+        clock = task.Clock()
+        cache = httpcache.ValidatorCache(path, clock=clock)
+        cache.update('http://example.com', {'etag': ['"abc"']})
+        cache.update('http://example.com/page', {'etag': ['"def"']})
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        clock.advance(cache.save_delay)
+
+        reloaded = httpcache.ValidatorCache(path)
+        self.assertEqual(reloaded.headersFor('http://example.com'), {'If-None-Match': '"abc"'})
+
+class TestConditionalGet(unittest.TestCase):
+
+    def setUp(self):
+        self.page = Page()
+        self.port = reactor.listenTCP(0, server.Site(self.page), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/feed' % self.port.getHost().port
+        self.cache = httpcache.ValidatorCache()
+
+    def tearDown(self):
+        httpclient.getClient().close()
+        return self.port.stopListening()
+
+    def test_not_modified(self):
+        d = httpcache.getPage(self.url, self.cache)
+
+        def gotFirst(page):
+            self.assertEqual(page, 'contents of v1')
+            return self.assertFailure(httpcache.getPage(self.url, self.cache),
+                                      httpcache.NotModified)
+
+        def gotSecond(result):
+            self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+            self.page.etag = 'v2'
+            return httpcache.getPage(self.url, self.cache)
+
+        def gotChanged(page):
+            self.assertEqual(page, 'contents of v2')
+            self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+        d.addCallback(gotFirst)
+        d.addCallback(gotSecond)
+        d.addCallback(gotChanged)
+        return d
+
+    def test_unconditional_not_remembered(self):
+        d = httpcache.getPage(self.url, self.cache, conditional=False)
+
+        def gotPage(page):
+            self.assertEqual(self.cache.validators, {})
+            return httpcache.getPage(self.url, self.cache, conditional=False, remember=True)
+
+        def gotRemembered(page):
+            self.assertEqual(self.cache.headersFor(self.url), {'If-None-Match': 'v1'})
+
+        d.addCallback(gotPage)
+        d.addCallback(gotRemembered)
+        return d
+
+class FailingScheduler(object):
+
+    def fetch(self, url, headers, timeout):
+        return defer.fail(error.ConnectionRefusedError())
+
+class TestLastHeaders(unittest.TestCase):
+
+    def test_cleared_on_error(self):
+        cache = httpcache.ValidatorCache()
+        cache.last_headers['http://example.com/feed'] = {'retry-after': ['3600']}
+        self.patch(scheduler, 'getScheduler', FailingScheduler)
+
+        d = self.assertFailure(httpcache.getPage('http://example.com/feed', cache), error.ConnectionRefusedError)
+        d.addCallback(lambda result: self.assertEqual(cache.last_headers, {}))
+        return d
@@ -0,0 +1,94 @@
+import tempfile, shutil
+
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+from twisted.web import server, resource, error
+
+from gitorious_mrq import httpclient
+
+class Page(resource.Resource):
+    isLeaf = True
+    accept_encoding = None
+
+    def render_GET(self, request):
+        self.accept_encoding = request.getHeader('accept-encoding')
+        if request.path == '/missing':
+            request.setResponseCode(404)
+        return 'x' * 1000
+
+class CountingSite(server.Site):
+
+    connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return server.Site.buildProtocol(self, addr)
+
+class TestHTTPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.page = Page()
+        self.site = CountingSite(resource.EncodingResourceWrapper(self.page, [server.GzipEncoderFactory()]))
+        self.port = reactor.listenTCP(0, self.site, interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % self.port.getHost().port
+        self.client = httpclient.HTTPClient(max_per_host=2)
+
+    def tearDown(self):
+        self.client.close()
+        return self.port.stopListening()
+
+    def test_gzip(self):
+        d = self.client.request(self.url + 'page')
+
+        def gotPage(page):
+            self.assertEqual(page.code, 200)
+            self.assertEqual(page.body, 'x' * 1000)
+            self.assertEqual(self.page.accept_encoding, 'gzip')
+
+        return d.addCallback(gotPage)
+
+    def test_connections_reused(self):
+        d = self.client.request(self.url + 'first')
+        d.addCallback(lambda page: self.client.request(self.url + 'second'))
+
+        def gotSecond(page):
+            self.assertEqual(self.site.connections, 1)
+
+        return d.addCallback(gotSecond)
+
+    def test_error(self):
+        return self.assertFailure(self.client.request(self.url + 'missing'), error.Error)
+
+class TestRecordReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.page = Page()
+        self.port = reactor.listenTCP(0, server.Site(self.page), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % self.port.getHost().port
+        self.directory = tempfile.mkdtemp()
+        self.client = httpclient.RecordingClient(httpclient.HTTPClient(), self.directory)
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.directory)
+        return self.port.stopListening()
+
+    def test_replay(self):
+        d = self.client.request(self.url + 'page')
+        d.addCallback(lambda page: self.assertFailure(self.client.request(self.url + 'missing'), error.Error))
+
+        def recorded(result):
+            replay = httpclient.ReplayClient(self.directory)
+            return defer.gatherResults([replay.request(self.url + 'page'),
+                                        replay.request(self.url + 'page'),
+                                        self.assertFailure(replay.request(self.url + 'missing'), httpclient.HTTPError)])
+
+        def replayed(results):
+            first, again, missing = results
+            self.assertEqual((first.code, first.body), (200, 'x' * 1000))
+            self.assertEqual(again.body, first.body)
+            self.assertEqual(missing.status, '404')
+
+        d.addCallback(recorded)
+        d.addCallback(replayed)
+        return d
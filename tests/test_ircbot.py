@@ -0,0 +1,279 @@
+import unittest, re
+
+from twisted.internet import task, defer
+
+from gitorious_mrq import ircbot, outqueue, httpcache, workers
+
+from test_entries import read_feed
+
+def mrq(repo, id, status='New'):
+    return {'repository': repo, 'id': id, 'status': status, 'summary': 'Summary of %s' % id}
+
+class TestMentionedRepositories(unittest.TestCase):
+
+    def test_feed(self):
+        messager = ircbot.GitoriousMergeRequestMessager('http://gitorious.org', 'maliit', None)
+        items = read_feed(1)['items'][:4]
+        self.assertEqual(messager.mentionedRepositories(items),
+                         set(['maliit-plugins', 'maliit-buildbot-configuration']))
+
+class TestIncrementalUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60)
+        self.bot.updateOpenMergeRequests([mrq('a', '1'), mrq('a', '2'), mrq('b', '3')])
+
+    def test_repositories_updated(self):
+        self.bot.updateRepositories([mrq('a', '2', 'Merged'), mrq('c', '4')], ['a', 'b', 'c'])
+        self.assertEqual([(m['repository'], m['id']) for m in self.bot.open_merge_requests],
+                         [('a', '2'), ('c', '4')])
+
+    def test_failed_update(self):
+        self.bot.updateRepositories(None, ['a'])
+        self.assertEqual(len(self.bot.open_merge_requests), 3)
+
+    def test_index(self):
+        self.assertEqual(self.bot.getMergeRequest('a', '2')['status'], 'New')
+        self.bot.updateRepositories([mrq('a', '2', 'Merged'), mrq('c', '4')], ['a', 'b', 'c'])
+        self.assertEqual(self.bot.getMergeRequest('a', '2')['status'], 'Merged')
+        self.assertEqual(self.bot.getMergeRequest('a', '1'), None)
+        self.assertEqual(self.bot.getMergeRequest('c', '4')['id'], '4')
+
+    def test_changes_reported(self):
+        changes = []
+        self.bot.addChangeListener(lambda bot, c: changes.extend((change.kind, change.mrq.key) for change in c))
+        self.bot.updateRepositories([mrq('a', '2', 'Merged'), mrq('c', '4')], ['a', 'c'])
+        self.assertEqual(changes, [('state_changed', ('a', '2')), ('closed', ('a', '1')), ('opened', ('c', '4'))])
+
+        del changes[:]
+        self.bot.updateOpenMergeRequests([mrq('a', '2', 'Merged'), mrq('c', '4')])
+        self.assertEqual(changes, [('closed', ('b', '3'))])
+
+class TestProjectSpec(unittest.TestCase):
+
+    def test_project(self):
+        self.assertEqual(ircbot.parse_project_spec('maliit', 'http://gitorious.org'),
+                         ('http://gitorious.org', 'maliit', ['#maliit']))
+
+    def test_host_and_channels(self):
+        self.assertEqual(ircbot.parse_project_spec('https://git.example.com/maliit=#a,#b', 'http://gitorious.org'),
+                         ('https://git.example.com', 'maliit', ['#a', '#b']))
+
+    def test_default_channel(self):
+        self.assertEqual(ircbot.parse_project_spec('maliit', 'http://gitorious.org', '#mrq')[2], ['#mrq'])
+
+class TestMultipleProjects(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = ircbot.IrcBotFactory('mrqbot')
+        self.maliit = self.factory.addProject('http://gitorious.org', 'maliit', ['#maliit', '#all'], 60)
+        self.qt = self.factory.addProject('http://qt.gitorious.org', 'qt', ['#qt', '#all'], 60)
+
+    def test_channels(self):
+        self.assertEqual(self.factory.channels, ['#maliit', '#all', '#qt'])
+        self.assertEqual(self.factory.botsForChannel('#maliit'), [self.maliit])
+        self.assertEqual(self.factory.botsForChannel('#all'), [self.maliit, self.qt])
+
+    def test_messages_to_project_channels(self):
+        protocol = self.factory.buildProtocol(None)
+        sent = []
+        protocol.output = outqueue.OutputQueue(lambda channel, message: sent.append((channel, message)))
+        protocol.signed_on = True
+
+        self.qt.outputMessage(u'Merge request updated')
+        self.assertEqual(sent, [('#qt', 'Merge request updated'), ('#all', 'Merge request updated')])
+
+class TestMentions(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = ircbot.IrcBotFactory('mrqbot')
+        self.bot = self.factory.addProject('http://gitorious.org', 'maliit', ['#maliit'], 60)
+        self.bot.clock = task.Clock()
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '12')])
+        self.bot.triggerOpenMergeRequestsUpdate = lambda: self.fail('Should be answered from the snapshot')
+
+        self.protocol = self.factory.buildProtocol(None)
+        self.sent = []
+        self.protocol.output = outqueue.OutputQueue(lambda channel, message: self.sent.append((channel, message)))
+
+    def test_mention_answered_once(self):
+        self.protocol.privmsg('user!u@host', '#maliit', 'Could someone review maliit-framework #12?')
+        self.assertEqual(self.sent, [('#maliit', 'maliit-framework #12: Summary of 12 (New) '
+                                      'http://gitorious.org/maliit/maliit-framework/merge_requests/12')])
+
+        self.protocol.privmsg('user!u@host', '#maliit', 'maliit-framework mrq 12 please')
+        self.assertEqual(len(self.sent), 1)
+        self.bot.clock.advance(self.bot.mention_cooldown.seconds)
+        self.protocol.privmsg('user!u@host', '#maliit', 'maliit-framework mrq 12 please')
+        self.assertEqual(len(self.sent), 2)
+
+    def test_matcher_kept(self):
+        matcher = self.bot.mentionMatcher()
+        self.bot.updateRepositories([mrq('maliit-framework', '13')], ['maliit-framework'])
+        self.assertTrue(self.bot.mentionMatcher() is matcher)
+        self.bot.updateRepositories([mrq('maliit-plugins', '1')], ['maliit-plugins'])
+        self.assertFalse(self.bot.mentionMatcher() is matcher)
+
+    def test_unknown_merge_request(self):
+        self.protocol.privmsg('user!u@host', '#maliit', 'maliit-framework #13 is merged')
+        self.assertEqual(self.sent, [])
+
+    def test_not_digested(self):
+        clock = task.Clock()
+        self.protocol.output = outqueue.OutputQueue(lambda channel, message: self.sent.append((channel, message)),
+                                                    burst=1, clock=clock)
+        for i in range(outqueue.DIGEST_THRESHOLD + 1):
+            self.protocol.output.broadcast('#maliit', 'update %d' % i)
+        self.protocol.privmsg('user!u@host', '#maliit', 'Could someone review maliit-framework #12?')
+        clock.pump([1] * 10)
+
+        self.assertEqual([message.split(':')[0] for channel, message in self.sent],
+                         ['update 0', 'maliit-framework #12', '%d merge request updates' % outqueue.DIGEST_THRESHOLD])
+
+class TestMessageKey(unittest.TestCase):
+
+    def test_key(self):
+        message = 'jonnor updated http://gitorious.org/maliit/maliit-plugins/merge_requests/12  State changed'
+        self.assertEqual(ircbot.message_key(message),
+                         ('http://gitorious.org/maliit/maliit-plugins/merge_requests/12', 'maliit-plugins#12'))
+        self.assertEqual(ircbot.message_key('no link'), (None, None))
+
+class TestListingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60)
+        self.bot.clock = task.Clock()
+        self.triggered = 0
+        def trigger():
+            self.triggered += 1
+        self.bot.triggerOpenMergeRequestsUpdate = trigger
+
+    def listing(self, **kwargs):
+        results = []
+        self.bot.getListing(**kwargs).addCallback(results.append)
+        return results
+
+    def test_fresh(self):
+        self.bot.updateOpenMergeRequests([mrq('a', '1')])
+        self.assertEqual(self.listing(), ['a/1: - New - Summary of 1'])
+        self.assertEqual(self.triggered, 0)
+
+    def test_stale(self):
+        self.bot.updateOpenMergeRequests([mrq('a', '1')])
+        self.bot.clock.advance(ircbot.SNAPSHOT_TTL)
+        self.assertEqual(self.listing(), ['a/1: - New - Summary of 1'])
+        self.assertEqual(self.triggered, 1)
+
+    def test_cold(self):
+        results = self.listing()
+        self.assertEqual((results, self.triggered), ([], 1))
+        self.bot.updateOpenMergeRequests([mrq('a', '1')])
+        self.assertEqual(results, ['a/1: - New - Summary of 1'])
+
+    def test_cold_timeout(self):
+        results = self.listing(timeout=5)
+        self.bot.clock.advance(5)
+        self.assertEqual(results, [None])
+        self.bot.updateOpenMergeRequests([mrq('a', '1')])
+
+    def test_cached_per_version(self):
+        self.bot.updateOpenMergeRequests([mrq('a', '1')])
+        first = self.bot.listing()
+        self.assertTrue(self.bot.listing() is first)
+        self.bot.updateRepositories([mrq('a', '1', 'Merged')], ['a'])
+        self.assertEqual(self.bot.listing(), 'a/1: - Merged - Summary of 1')
+
+class TestFeedGap(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60)
+        self.bot.triggerOpenMergeRequestsUpdate = lambda: None
+        self.messages = []
+        self.bot.processor.callback = self.messages.append
+
+        # Entries 1-2 have been seen, then entries 3-8 happened, 2 per page
+        self.bot.processor.processRss(self.feed(2, 1))
+        self.pages = {2: self.feed(6, 5), 3: self.feed(4, 3), 4: self.feed(2, 1)}
+        self.requested = []
+
+        def getFeedPage(page):
+            self.requested.append(page)
+            return defer.succeed(self.pages[page])
+        self.bot.getFeedPage = getFeedPage
+
+    def feed(self, *ids):
+        title = 'user%d updated merge request maliit/maliit-plugins #%d&#x2192; State changed'
+        return {'items': [{'id': 'event-%d' % id, 'title': title % (id, id)} for id in ids]}
+
+    def reported(self):
+        return [int(re.match(r'user(\d+)', message).group(1)) for message in self.messages]
+
+    def test_gap_closed(self):
+        self.bot.processNewRss(self.feed(8, 7))
+        self.assertEqual(self.requested, [2, 3, 4])
+        self.assertEqual(self.reported(), [3, 4, 5, 6, 7, 8])
+
+    def test_page_budget(self):
+        self.bot.max_feed_pages = 3
+        self.bot.processNewRss(self.feed(8, 7))
+        self.assertEqual(self.requested, [2, 3])
+        self.assertEqual(self.reported(), [3, 4, 5, 6, 7, 8])
+
+    def test_no_gap(self):
+        self.bot.processNewRss(self.feed(3, 2))
+        self.assertEqual(self.requested, [])
+        self.assertEqual(self.reported(), [3])
+
+class TestRestartWithValidators(unittest.TestCase):
+    """With saved validators, the first poll after a restart could be a 304."""
+
+    def setUp(self):
+        self.addCleanup(setattr, workers, 'executor', workers.executor)
+        workers.configure(0)
+        self.addCleanup(setattr, httpcache, 'getPage', httpcache.getPage)
+        httpcache.getPage = self.getPage
+
+        self.feed = open('tests/data/maliit.atom.1.txt').read()
+        self.conditional = []
+        self.bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60)
+        self.bot.triggerOpenMergeRequestsUpdate = lambda: None
+        self.bot.triggerRepositoriesUpdate = lambda repositories: None
+        self.messages = []
+        self.bot.processor.callback = self.messages.append
+
+    def getPage(self, url, conditional=True, timeout=None, remember=None):
+        self.conditional.append(conditional)
+        if conditional and self.feed is None:
+            return defer.fail(httpcache.NotModified(url))
+        feed, self.feed = self.feed, None
+        return defer.succeed(feed)
+
+    def test_first_poll_unconditional(self):
+        self.bot.checkForUpdates()
+        self.bot.checkForUpdates()
+        self.feed = open('tests/data/maliit.atom.2.txt').read()
+        self.bot.checkForUpdates()
+
+        self.assertEqual(self.conditional, [False, True, True])
+        warm = ircbot.GitoriousMergeRequestMessager('http://gitorious.org', 'maliit', [].append)
+        warm.processRss(read_feed(1))
+        self.assertEqual(len(self.messages), len([item for item in warm.getNewItems(read_feed(2))
+                                                  if warm.itemToMessage(item)]))
+        self.assertTrue(self.messages)
+
+class TestPushExpiry(unittest.TestCase):
+
+    def test_pushed_poll_interval(self):
+        bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60)
+        bot.clock = task.Clock()
+        bot.triggerOpenMergeRequestsUpdate = lambda: None
+        bot.pushed_poll_interval = 100
+        bot.processPushedItems([])
+        self.assertEqual(bot.poller.min_interval, 100)
+
+        bot.clock.advance(ircbot.PUSH_EXPIRY*100 - 1)
+        bot.checkPushExpiry()
+        self.assertEqual(bot.poller.min_interval, 100)
+        bot.clock.advance(1)
+        bot.checkPushExpiry()
+        self.assertEqual(bot.poller.min_interval, 60)
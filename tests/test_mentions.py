@@ -0,0 +1,33 @@
+import unittest
+
+from gitorious_mrq import mentions
+
+class TestMentionMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = mentions.MentionMatcher('maliit', ['maliit-framework', 'maliit/maliit-plugins'])
+
+    def test_references(self):
+        self.assertEqual(self.matcher.findMentions('see maliit-framework #12 and Maliit-Plugins mrq 3'),
+                         [('maliit-framework', '12'), ('maliit/maliit-plugins', '3')])
+        self.assertEqual(self.matcher.findMentions('maliit-framework merge request #7'),
+                         [('maliit-framework', '7')])
+
+    def test_urls(self):
+        text = 'http://gitorious.org/maliit/maliit-framework/merge_requests/12 and maliit-framework#12'
+        self.assertEqual(self.matcher.findMentions(text), [('maliit-framework', '12')])
+        self.assertEqual(self.matcher.findMentions('https://gitorious.org/maliit/maliit-plugins/merge_requests/4'),
+                         [('maliit/maliit-plugins', '4')])
+
+    def test_other_text(self):
+        self.assertEqual(self.matcher.findMentions('other-maliit-framework #12, maliit-framework 12, unknown #3'), [])
+        self.assertEqual(mentions.MentionMatcher('maliit', []).findMentions('maliit-framework #12'), [])
+
+class TestCooldown(unittest.TestCase):
+
+    def test_cooldown(self):
+        cooldown = mentions.Cooldown(60)
+        self.assertTrue(cooldown.ready('a', 0))
+        self.assertFalse(cooldown.ready('a', 30))
+        self.assertTrue(cooldown.ready('b', 30))
+        self.assertTrue(cooldown.ready('a', 60))
@@ -0,0 +1,57 @@
+import unittest
+
+from twisted.internet import task
+
+from gitorious_mrq import metrics, scheduler
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_render(self):
+        fetches = self.registry.counter('fetches_total', 'Fetches.')
+        fetches.inc(kind='feed', status=200)
+        fetches.inc(kind='feed', status=200)
+        fetches.inc(kind='feed', status=304)
+        depth = self.registry.gauge('queue_depth', 'Depth.')
+        depth.setFunction(lambda: 3)
+        seconds = self.registry.summary('parse_seconds', 'Parse time.')
+        seconds.observe(0.5, page='feed')
+        seconds.observe(1.5, page='feed')
+
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP gitorious_mrq_fetches_total Fetches.',
+            '# TYPE gitorious_mrq_fetches_total counter',
+            'gitorious_mrq_fetches_total{kind="feed",status="200"} 2',
+            'gitorious_mrq_fetches_total{kind="feed",status="304"} 1',
+            '# HELP gitorious_mrq_queue_depth Depth.',
+            '# TYPE gitorious_mrq_queue_depth gauge',
+            'gitorious_mrq_queue_depth 3',
+            '# HELP gitorious_mrq_parse_seconds Parse time.',
+            '# TYPE gitorious_mrq_parse_seconds summary',
+            'gitorious_mrq_parse_seconds_count{page="feed"} 2',
+            'gitorious_mrq_parse_seconds_sum{page="feed"} 2.0',
+        ])
+        self.assertEqual(self.registry.logLine(),
+                         'Metrics: fetches_total[feed,200]=2 fetches_total[feed,304]=1 queue_depth=3 parse_seconds=1.000')
+
+    def test_declared_once(self):
+        self.assertTrue(self.registry.counter('a', 'A.') is self.registry.counter('a', 'A.'))
+
+class TestLagMonitor(unittest.TestCase):
+
+    def test_lag(self):
+        clock = task.Clock()
+        monitor = metrics.LagMonitor(1.0, clock)
+        monitor.start()
+        clock.advance(1.5)
+        self.assertEqual(metrics.reactor_lag.get(), 0.5)
+        monitor.stop()
+
+class TestUrlKind(unittest.TestCase):
+
+    def test_kinds(self):
+        self.assertEqual(scheduler.url_kind('http://gitorious.org/maliit.atom'), 'feed')
+        self.assertEqual(scheduler.url_kind('http://gitorious.org/maliit/maliit-plugins/merge_requests'), 'merge_requests')
+        self.assertEqual(scheduler.url_kind('http://gitorious.org/maliit'), 'page')
@@ -0,0 +1,45 @@
+import unittest
+
+from gitorious_mrq import model
+
+def mrq(repo, id, status='New'):
+    return model.MergeRequest(repository=repo, id=id, status=status, summary='Summary of %s' % id)
+
+class TestMergeRequest(unittest.TestCase):
+
+    def test_dict_access(self):
+        data = {'repository': 'maliit-framework', 'id': '1', 'status': 'New', 'summary': 'Fix'}
+        m = model.MergeRequest.fromDict(data)
+        self.assertEqual(m['status'], 'New')
+        self.assertEqual(m.get('creator', 'nobody'), 'nobody')
+        self.assertEqual(dict(m), data)
+        self.assertEqual(m, data)
+        self.assertRaises(KeyError, lambda: m['unknown'])
+
+    def test_shared_values(self):
+        a = model.MergeRequest.fromDict({'repository': ''.join(['a', 'b']), 'status': u'New'})
+        b = model.MergeRequest.fromDict({'repository': ''.join(['a', 'b']), 'status': u'New'})
+        self.assertTrue(a.repository is b.repository)
+        self.assertTrue(a.status is b.status)
+
+    def test_no_dict(self):
+        self.assertFalse(hasattr(mrq('a', '1'), '__dict__'))
+
+class TestDiff(unittest.TestCase):
+
+    def test_unchanged(self):
+        self.assertEqual(model.diff([mrq('a', '1')], [mrq('a', '1')]), [])
+
+    def test_changes(self):
+        old = [mrq('a', '1'), mrq('a', '2'), mrq('b', '1')]
+        new = [mrq('a', '2', 'Reviewing'), mrq('b', '1'), mrq('b', '2')]
+        changes = model.diff(old, new)
+        self.assertEqual([(c.kind, c.mrq.key) for c in changes],
+                         [(model.STATE_CHANGED, ('a', '2')), (model.OPENED, ('b', '2')), (model.CLOSED, ('a', '1'))])
+        self.assertEqual(changes[0].old.status, 'New')
+        self.assertEqual(changes[0].new.status, 'Reviewing')
+
+    def test_format(self):
+        change = model.Change(model.STATE_CHANGED, mrq('a', '2'), mrq('a', '2', 'Reviewing'))
+        self.assertEqual(model.format_change(change, 'http://example.com/p/a/merge_requests/2'),
+                         'a #2 state changed from New to Reviewing: Summary of 2 http://example.com/p/a/merge_requests/2')
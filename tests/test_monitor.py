@@ -0,0 +1,87 @@
+import unittest, json, StringIO, tempfile, os
+
+from twisted.internet import task
+
+from gitorious_mrq import monitor, ircbot, outqueue
+
+def mrq(repo, id, status='New'):
+    return {'repository': repo, 'id': id, 'status': status, 'summary': 'Summary of %s' % id}
+
+class Notifier(object):
+    name = 'test'
+
+    def __init__(self):
+        self.batches = []
+
+    def notify(self, events):
+        self.batches.append([event.text for event in events])
+
+class TestMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.monitor = monitor.Monitor(self.clock)
+        self.bot = self.monitor.addBot(ircbot.IrcBot('http://gitorious.org', 'maliit', 60, channels=['#maliit']))
+
+    def test_batched(self):
+        notifier = Notifier()
+        self.monitor.addNotifier(notifier, delay=1.0, max_batch=3)
+        for i in range(4):
+            self.bot.outputMessage('message %d' % i)
+        self.assertEqual(notifier.batches, [['message 0', 'message 1', 'message 2']])
+
+        self.clock.advance(1)
+        self.assertEqual(notifier.batches[1:], [['message 3']])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_without_irc(self):
+        stream = StringIO.StringIO()
+        self.monitor.addNotifier(monitor.StdoutNotifier(stream), delay=None)
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        self.monitor.addNotifier(monitor.JsonLinesNotifier(path), delay=None)
+
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '1')])
+        self.bot.updateRepositories([mrq('maliit-framework', '1', 'Reviewing')], ['maliit-framework'])
+
+        self.assertEqual(stream.getvalue(),
+                         'maliit: maliit-framework #1 state changed from New to Reviewing: Summary of 1 '
+                         'http://gitorious.org/maliit/maliit-framework/merge_requests/1\n')
+        event = json.loads(open(path).read())
+        self.assertEqual((event['kind'], event['project'], event['id'], event['status'], event['old_status']),
+                         ('state_changed', 'maliit', '1', 'Reviewing', 'New'))
+
+    def test_irc_notifier(self):
+        factory = ircbot.IrcBotFactory('mrqbot', monitor_service=self.monitor)
+        protocol = factory.buildProtocol(None)
+        sent = []
+        protocol.output = outqueue.OutputQueue(lambda channel, message: sent.append((channel, message)))
+        protocol.signed_on = True
+
+        self.bot.outputMessage(u'Merge request updated')
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '1')])
+        self.bot.updateOpenMergeRequests([])
+        self.assertEqual(sent, [('#maliit', 'Merge request updated')])
+
+        factory.notifier.report_changes = True
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '2')])
+        self.assertEqual(len(sent), 2)
+        self.assertIn('maliit-framework #2 opened', sent[1][1])
+
+    def test_irc_notifier_disconnected(self):
+        factory = ircbot.IrcBotFactory('mrqbot', monitor_service=self.monitor)
+        self.bot.outputMessage(u'Merge request updated')
+        self.assertEqual(len(factory.notifier.pending), 1)
+
+        protocol = factory.buildProtocol(None)
+        sent = []
+        protocol.output = outqueue.OutputQueue(lambda channel, message: sent.append((channel, message)))
+        # Connected, but messages would be rejected until signed on
+        self.bot.outputMessage(u'Merge request merged')
+        self.assertEqual(sent, [])
+        self.assertEqual(len(factory.notifier.pending), 2)
+
+        protocol.signed_on = True
+        factory.notifier.flush()
+        self.assertEqual(sent, [('#maliit', 'Merge request updated'), ('#maliit', 'Merge request merged')])
+        self.assertEqual(len(factory.notifier.pending), 0)
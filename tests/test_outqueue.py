@@ -0,0 +1,65 @@
+import unittest
+
+from twisted.internet import task
+
+from gitorious_mrq import outqueue
+
+class TestOutputQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.queue = outqueue.OutputQueue(lambda target, line: self.sent.append((target, line)),
+                                          rate=1.0, burst=2, digest_threshold=4, clock=self.clock)
+
+    def test_rate_limited(self):
+        for i in range(4):
+            self.queue.broadcast('#a', 'line %d' % i)
+        self.assertEqual(len(self.sent), 2) # The burst
+        self.assertEqual(self.queue.depth, 2)
+
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 3)
+        self.clock.advance(1)
+        self.assertEqual([line for target, line in self.sent], ['line 0', 'line 1', 'line 2', 'line 3'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_replies_first(self):
+        for i in range(4):
+            self.queue.broadcast('#a', 'line %d' % i)
+        self.queue.reply('#b', 'first\nsecond')
+        self.clock.pump([1, 1])
+        self.assertEqual(self.sent[2:], [('#b', 'first'), ('#b', 'second')])
+
+    def test_superseded(self):
+        self.queue.tokens = 0
+        self.queue.broadcast('#a', 'mrq 1 new', key=1)
+        self.queue.broadcast('#a', 'mrq 2 new', key=2)
+        self.queue.broadcast('#a', 'mrq 1 merged', key=1)
+        self.clock.pump([1, 1, 1])
+        self.assertEqual([line for target, line in self.sent], ['mrq 2 new', 'mrq 1 merged'])
+        self.assertEqual(self.queue.stats()['superseded'], 1)
+
+    def test_digest(self):
+        self.queue.tokens = 0
+        for i in range(5):
+            self.queue.broadcast('#a', 'long line about %d' % i, summary='r#%d' % i)
+        self.queue.broadcast('#b', 'other channel')
+        self.clock.pump([1, 1])
+        self.assertEqual(self.sent, [('#a', '5 merge request updates: r#0, r#1, r#2, r#3, r#4'),
+                                     ('#b', 'other channel')])
+        self.assertEqual(self.queue.stats()['digested'], 5)
+
+    def test_overflow(self):
+        self.queue.tokens = 0
+        self.queue.max_pending = 2
+        for i in range(3):
+            self.queue.broadcast('#a', 'line %d' % i)
+        self.assertEqual(self.queue.depth, 2)
+        self.assertEqual(self.queue.stats()['overflowed'], 1)
+
+    def test_one_pending_call(self):
+        self.queue.tokens = 0
+        for i in range(3):
+            self.queue.broadcast('#a', 'line %d' % i)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
@@ -0,0 +1,89 @@
+import unittest
+
+from twisted.internet import task, defer
+
+from gitorious_mrq import polling
+
+class TestPollHint(unittest.TestCase):
+
+    def test_no_hint(self):
+        self.assertEqual(polling.poll_hint({}), None)
+        self.assertEqual(polling.poll_hint({'cache-control': ['no-cache']}), None)
+
+    def test_hints(self):
+        self.assertEqual(polling.poll_hint({'retry-after': ['120']}), 120)
+        self.assertEqual(polling.poll_hint({'cache-control': ['public, max-age=300']}), 300)
+        self.assertEqual(polling.poll_hint({'retry-after': ['Sat, 17 Dec 2011 15:40:00 GMT']},
+                                           now=1324136100), 300)
+
+class TestAdaptivePoller(unittest.TestCase):
+
+    def setUp(self):
+        self.activity = []
+        self.poller = polling.AdaptivePoller(self.poll, 60, 400, jitter=0)
+        self.poller.clock = task.Clock()
+
+    def poll(self):
+        return self.activity.pop(0)
+
+    def test_interval(self):
+        self.activity = [False, False, False, False, True, False]
+        self.poller.start()
+
+        intervals = []
+        for i in range(len(self.activity)):
+            self.poller.clock.advance(self.poller.interval)
+            intervals.append(self.poller.interval)
+
+        self.assertEqual(intervals, [120, 240, 400, 400, 60, 120])
+
+    def test_server_hint(self):
+        self.activity = [True, True]
+        self.poller.start()
+        self.poller.serverHint(300)
+        self.poller.clock.advance(0)
+        self.assertEqual(self.poller._call.getTime(), 300)
+
+        # Limited to the longest interval
+        self.poller.serverHint(86400)
+        self.poller.clock.advance(300)
+        self.assertEqual(self.poller._call.getTime(), 700)
+
+    def test_restarted_while_polling(self):
+        clock = self.poller.clock
+        polls = []
+        pending = []
+
+        def poll():
+            polls.append(clock.seconds())
+            pending.append(defer.Deferred())
+            return pending[-1]
+        self.poller.function = poll
+
+        self.poller.start()
+        clock.advance(0)
+        self.poller.stop()
+        self.poller.start()
+        clock.advance(0)
+        for d in pending[:]:
+            d.callback(False)
+        for i in range(3):
+            clock.advance(self.poller.interval)
+            pending[-1].callback(False)
+
+        self.assertEqual(polls, [0, 0, 120, 360, 760])
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+
+class TestMinInterval(unittest.TestCase):
+
+    def test_raised_and_restored(self):
+        poller = polling.AdaptivePoller(lambda: False, 10, 100, jitter=0)
+        poller.setMinInterval(1000)
+        self.assertEqual(poller.interval, 1000)
+        poller._call = object() # Running
+        poller.schedule = lambda delay: None
+        poller.polled(False)
+        self.assertEqual(poller.interval, 1000)
+
+        poller.setMinInterval(10)
+        self.assertEqual(poller.interval, 10)
@@ -0,0 +1,96 @@
+import unittest
+
+from twisted.internet import task
+
+from gitorious_mrq import routing, monitor, ircbot, outqueue, model
+
+MESSAGE = (u'jonnor updated http://gitorious.org/maliit/%s/merge_requests/12 '
+           u'\u2192 State changed from Recommended to merge to %s')
+
+def mrq(repo, id, status='New'):
+    return {'repository': repo, 'id': id, 'status': status, 'summary': 'Summary of %s' % id}
+
+class TestParse(unittest.TestCase):
+
+    def test_subscription(self):
+        subscription = routing.parse_subscription('#merges:maliit-*, qt/qtbase:Go ahead and merge:message,state_changed')
+        self.assertEqual((subscription.channel, subscription.repositories, subscription.states, subscription.kinds),
+                         ('#merges', ('maliit-*', 'qt/qtbase'), ('Go ahead and merge',), ('message', 'state_changed')))
+
+    def test_defaults(self):
+        subscription = routing.parse_subscription('#all:')
+        self.assertEqual((subscription.repositories, subscription.states, subscription.kinds),
+                         (('*',), ('*',), ('message',)))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, routing.parse_subscription, '#merges')
+        self.assertRaises(ValueError, routing.parse_subscription, '#merges:*:*:pushed')
+
+    def test_file(self):
+        subscriptions = routing.parse_subscriptions_file(['# Merges\n', '\n', '#merges:maliit-*\n'])
+        self.assertEqual([s.channel for s in subscriptions], ['#merges'])
+
+    def test_state_change(self):
+        self.assertEqual(model.parse_state_change(MESSAGE % ('maliit-framework', 'Go ahead and merge')),
+                         ('Recommended to merge', 'Go ahead and merge'))
+        self.assertEqual(model.parse_state_change('jonnor commented on merge request'), None)
+
+class TestRoutingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60, channels=['#maliit'])
+        self.index = routing.RoutingIndex([routing.parse_subscription(spec) for spec in [
+            '#framework:maliit-framework',
+            '#merges:maliit-*:go ahead and merge',
+            '#plugins:maliit/*-plugins',
+            '#qt:qt/*',
+            '#odd:m?liit-framework:*:message,opened',
+        ]])
+
+    def route(self, repository, state=None, kind=monitor.MESSAGE):
+        return self.index.route(monitor.Event(kind, self.bot, u'', repository=repository, state=state))
+
+    def test_exact_and_glob(self):
+        self.assertEqual(self.route('maliit-framework'), ['#framework', '#odd'])
+
+    def test_state(self):
+        self.assertEqual(self.route('maliit-framework', 'Go ahead and merge'), ['#framework', '#merges', '#odd'])
+        self.assertEqual(self.route('maliit-keyboard', 'Reviewing'), [])
+
+    def test_project(self):
+        self.assertEqual(self.route('maliit/maliit-plugins'), ['#plugins'])
+        self.assertTrue(self.index.subscribes('#plugins', 'maliit'))
+        self.assertFalse(self.index.subscribes('#qt', 'maliit'))
+
+    def test_kinds(self):
+        self.assertEqual(self.route('maliit-framework', kind=model.OPENED), ['#odd'])
+        self.assertEqual(self.route('maliit-framework', kind=model.CLOSED), [])
+
+    def test_without_repository(self):
+        self.assertEqual(self.route(None), [])
+
+class TestSubscribedChannels(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = monitor.Monitor(task.Clock())
+        self.bot = self.monitor.addBot(ircbot.IrcBot('http://gitorious.org', 'maliit', 60, channels=['#maliit']))
+        self.factory = ircbot.IrcBotFactory('mrqbot', monitor_service=self.monitor)
+        self.factory.subscribe([routing.parse_subscription('#merges:maliit-*:Go ahead and merge:message,opened')])
+        protocol = self.factory.buildProtocol(None)
+        self.sent = []
+        protocol.output = outqueue.OutputQueue(lambda channel, message: self.sent.append((channel, message)))
+        protocol.signed_on = True
+
+    def test_channels(self):
+        self.assertEqual(self.factory.channels, ['#maliit', '#merges'])
+        self.assertEqual(self.factory.botsForChannel('#merges'), [self.bot])
+
+    def test_messages(self):
+        self.bot.outputMessage(MESSAGE % ('maliit-framework', 'Reviewing'))
+        self.bot.outputMessage(MESSAGE % ('maliit-framework', 'Go ahead and merge'))
+        self.assertEqual([channel for channel, message in self.sent], ['#maliit', '#maliit', '#merges'])
+
+    def test_changes(self):
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '1')])
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '1'), mrq('maliit-framework', '2', 'Go ahead and merge')])
+        self.assertEqual([channel for channel, message in self.sent], ['#merges'])
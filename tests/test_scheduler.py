@@ -0,0 +1,94 @@
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+from twisted.web import server, resource, error
+
+from gitorious_mrq import scheduler, httpclient
+
+class SlowPage(resource.Resource):
+    """Answers requests when release() is called, failing the first ones with 503."""
+
+    isLeaf = True
+
+    def __init__(self, failures=0):
+        resource.Resource.__init__(self)
+        self.failures = failures
+        self.requests = 0
+        self.pending = []
+        self.max_pending = 0
+
+    def render_GET(self, request):
+        self.requests += 1
+        if self.failures:
+            self.failures -= 1
+            request.setResponseCode(503)
+            return 'Try again'
+
+        self.pending.append(request)
+        self.max_pending = max(self.max_pending, len(self.pending))
+        reactor.callLater(0.01, self.release, request)
+        return server.NOT_DONE_YET
+
+    def release(self, request):
+        self.pending.remove(request)
+        request.write('page %s' % request.path)
+        request.finish()
+
+class TestFetchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.page = SlowPage()
+        self.port = reactor.listenTCP(0, server.Site(self.page), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % self.port.getHost().port
+        self.scheduler = scheduler.FetchScheduler(max_per_host=2, retries=2, backoff=0.01)
+
+    def tearDown(self):
+        httpclient.getClient().close()
+        return self.port.stopListening()
+
+    def test_concurrency_limit(self):
+        d = defer.gatherResults([self.scheduler.fetch(self.url + str(i)) for i in range(6)])
+
+        def gotPages(pages):
+            self.assertEqual([p.body for p in pages], ['page /%d' % i for i in range(6)])
+            self.assertEqual(self.page.max_pending, 2)
+
+        return d.addCallback(gotPages)
+
+    def test_single_flight(self):
+        d = defer.gatherResults([self.scheduler.fetch(self.url + 'same') for i in range(3)])
+
+        def gotPages(pages):
+            self.assertEqual(self.page.requests, 1)
+            self.assertEqual(self.scheduler.coalesced, 2)
+
+        return d.addCallback(gotPages)
+
+    def test_retry(self):
+        self.page.failures = 2
+        d = self.scheduler.fetch(self.url + 'flaky')
+
+        def gotPage(page):
+            self.assertEqual(page.body, 'page /flaky')
+            self.assertEqual(self.page.requests, 3)
+
+        return d.addCallback(gotPage)
+
+    def test_gives_up(self):
+        self.page.failures = 3
+        d = self.assertFailure(self.scheduler.fetch(self.url + 'broken'), error.Error)
+        d.addCallback(lambda e: self.assertEqual(self.page.requests, 3))
+        return d
+
+    def test_coalesce_failure(self):
+        calls = []
+        def refresh():
+            d = defer.Deferred()
+            calls.append(d)
+            return d
+
+        d1 = self.scheduler.coalesce('refresh', refresh)
+        d2 = self.scheduler.coalesce('refresh', refresh)
+        self.assertEqual(len(calls), 1)
+        calls[0].errback(ValueError())
+        return defer.gatherResults([self.assertFailure(d1, ValueError),
+                                    self.assertFailure(d2, ValueError)])
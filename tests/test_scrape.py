@@ -0,0 +1,53 @@
+import unittest
+
+from gitorious_mrq import scrape, htmlstream
+
+import generate
+
+class TestStreamScrape(unittest.TestCase):
+
+    def assertSameAsSoup(self, page):
+        self.assertEqual(scrape.stream_scrape_mrq_status_from_mrq_page(page),
+                         scrape.soup_scrape_mrq_status_from_mrq_page(page))
+
+    def test_merge_request_page(self):
+        for count in (0, 1, 50):
+            rows = generate.merge_request_rows(count, seed=count)
+            self.assertSameAsSoup(generate.merge_request_page('maliit', 'maliit-framework', rows))
+
+    def test_unclosed_cells(self):
+        page = generate.merge_request_page('maliit', 'maliit-framework', generate.merge_request_rows(3))
+        self.assertSameAsSoup(page.replace('</td>', '').replace('</tr>', ''))
+
+    def test_markup_variations(self):
+        page = generate.merge_request_page('maliit', 'maliit-framework', generate.merge_request_rows(3))
+        page = page.replace('<td>', '<TD>').replace('">#', '"> #').replace('</abbr>', '</abbr><br/>')
+        self.assertSameAsSoup(page)
+
+    def test_stops_after_first_table(self):
+        page = generate.merge_request_page('maliit', 'maliit-framework', generate.merge_request_rows(3))
+        self.assertSameAsSoup(page + '<table><tr><td>#1</td></tr></table>')
+
+    def test_nested_table_falls_back(self):
+        page = '<table><tr><td><table><tr><td>x</td></tr></table></td></tr></table>'
+        self.assertRaises(htmlstream.UnsupportedMarkup, scrape.stream_scrape_mrq_status_from_mrq_page, page)
+
+    def test_project_page(self):
+        repositories = generate.repository_names(20) + [u'caf\xe9']
+        page = generate.project_page('maliit', repositories).encode('utf-8')
+        self.assertEqual(scrape.stream_scrape_repositories_from_project_page(page), repositories)
+        self.assertEqual(scrape.soup_scrape_repositories_from_project_page(page), repositories)
+
+    def test_project_page_fixture(self):
+        page = open('tests/data/maliit/index.html').read()
+        self.assertEqual(scrape.stream_scrape_repositories_from_project_page(page),
+                         scrape.soup_scrape_repositories_from_project_page(page))
+
+class TestElement(unittest.TestCase):
+
+    def test_string(self):
+        rows = list(htmlstream.table_rows('<table><tr><td>a &amp; b</td><td> <!--x--></td><td>\n </td></tr></table>'))
+        tds = rows[0]('td')
+        self.assertEqual(tds[0].string, u'a &amp; b')
+        self.assertEqual(tds[1].string, None)
+        self.assertEqual(tds[2].string, u'\n')
@@ -0,0 +1,111 @@
+import json, gzip, StringIO
+
+from twisted.trial import unittest
+from twisted.internet import reactor
+from twisted.web import server, resource, client
+from twisted.web.http_headers import Headers
+
+from gitorious_mrq import ircbot, status
+
+def mrq(repo, id, status='New'):
+    return {'repository': repo, 'id': id, 'status': status, 'summary': 'Summary of <%s>' % id}
+
+class TestStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = ircbot.IrcBotFactory('mrqbot')
+        self.bot = self.factory.addProject('http://gitorious.org', 'maliit', ['#maliit'], 60)
+        self.bot.triggerOpenMergeRequestsUpdate = lambda: self.fail('Should be served from the snapshot')
+        self.bot.updateOpenMergeRequests([mrq('maliit-framework', '12')])
+
+        root = resource.Resource()
+        self.html = status.StatusResource(self.factory, 'html')
+        self.json = status.StatusResource(self.factory, 'json')
+        root.putChild('status', self.html)
+        root.putChild('status.json', self.json)
+        self.port = reactor.listenTCP(0, server.Site(root), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % self.port.getHost().port
+        self.pool = client.HTTPConnectionPool(reactor, persistent=False)
+
+    def tearDown(self):
+        self.pool.closeCachedConnections()
+        return self.port.stopListening()
+
+    def get(self, path, **headers):
+        headers = Headers(dict((name.replace('_', '-'), [value]) for name, value in headers.items()))
+        d = client.Agent(reactor, pool=self.pool).request('GET', self.url + path, headers)
+        def gotResponse(response):
+            d = client.readBody(response)
+            d.addCallback(lambda body: (response, body))
+            return d
+        d.addCallback(gotResponse)
+        return d
+
+    def test_json(self):
+        d = self.get('status.json')
+
+        def got((response, body)):
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.headers.getRawHeaders('Cache-Control'), ['public, max-age=%d' % status.MAX_AGE])
+            project = json.loads(body)['projects'][0]
+            self.assertEqual(project['project'], 'maliit')
+            self.assertEqual(project['merge_requests'][0]['url'],
+                             'http://gitorious.org/maliit/maliit-framework/merge_requests/12')
+        d.addCallback(got)
+        return d
+
+    def test_html_escaped(self):
+        d = self.get('status?project=maliit')
+
+        def got((response, body)):
+            self.assertIn('Summary of &lt;12&gt;', body)
+        d.addCallback(got)
+        return d
+
+    def test_not_modified(self):
+        d = self.get('status.json')
+
+        def got((response, body)):
+            etag = response.headers.getRawHeaders('ETag')[0]
+            return self.get('status.json', If_None_Match=etag)
+        def revalidated((response, body)):
+            self.assertEqual(response.code, 304)
+            self.assertEqual(body, '')
+            self.assertEqual(self.json.renders, 1)
+        d.addCallback(got)
+        d.addCallback(revalidated)
+        return d
+
+    def test_rendered_per_version(self):
+        d = self.get('status', Accept_Encoding='gzip')
+
+        def got((response, body)):
+            self.assertEqual(response.headers.getRawHeaders('Content-Encoding'), ['gzip'])
+            self.assertIn('maliit-framework #12', gzip.GzipFile(fileobj=StringIO.StringIO(body)).read())
+            self.bot.updateRepositories([mrq('maliit-framework', '12', 'Merged')], ['maliit-framework'])
+            return self.get('status')
+        def changed((response, body)):
+            self.assertEqual(response.headers.getRawHeaders('Content-Encoding'), None)
+            self.assertIn('Merged', body)
+            self.assertEqual(self.html.renders, 2)
+        d.addCallback(got)
+        d.addCallback(changed)
+        return d
+
+    def test_unknown_project(self):
+        d = self.get('status.json?project=other')
+        d.addCallback(lambda (response, body): self.assertEqual(response.code, 404))
+        return d
+
+class NoDataBot(object):
+    project = 'maliit'
+
+    def cachedMergeRequests(self):
+        return None
+
+class TestRenderHtml(unittest.TestCase):
+
+    def test_no_data_outside_table(self):
+        html = status.render_html([NoDataBot()])
+        self.assertIn(status.HTML_NO_DATA, html)
+        self.assertNotIn('<table>', html)
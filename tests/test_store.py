@@ -0,0 +1,70 @@
+import os, tempfile, datetime, unittest
+
+from gitorious_mrq import store, entries, ircbot
+
+from test_entries import read_feed
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'state.db')
+        self.store = store.StateStore(self.path, max_seen_entries=3)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_seen_entries(self):
+        self.store.addSeenEntries('p', ['a', 'b', 'c'])
+        self.store.addSeenEntries('p', ['a', 'd'])
+        self.store.addSeenEntries('other', ['x'])
+
+        seen = entries.SeenEntries()
+        store.StateStore(self.path).loadSeenEntries('p', seen)
+        self.assertEqual(list(seen), ['c', 'a', 'd'])
+
+    def test_snapshot(self):
+        self.assertEqual(self.store.loadSnapshot('p'), None)
+
+        mrq = {'repository': u'maliit-framework', 'id': u'127', 'status': u'New', 'summary': u'Summary',
+               'creator': u'mikhas', 'target_branch': '', 'creation': datetime.datetime(2011, 12, 17, 15, 35, 14)}
+        snapshot = ircbot.IrcBot.groupByRepository([mrq])
+        self.store.saveSnapshot('p', snapshot, 1000)
+        self.assertEqual(store.StateStore(self.path).loadSnapshot('p'), snapshot)
+
+    def test_repositories(self):
+        snapshot = ircbot.IrcBot.groupByRepository([{'repository': 'a', 'id': '1'}, {'repository': 'b', 'id': '2'}])
+        self.store.saveSnapshot('p', snapshot, 1000)
+
+        del snapshot['a']
+        snapshot['c'] = ircbot.IrcBot.groupByRepository([{'repository': 'c', 'id': '3'}])['c']
+        snapshot['b'] = ircbot.IrcBot.groupByRepository([{'repository': 'b', 'id': '4'}])['b']
+        self.store.saveRepositories('p', snapshot, ['a', 'b', 'c'])
+
+        self.assertEqual(store.StateStore(self.path).loadSnapshot('p'), snapshot)
+        self.assertEqual(self.store.getValue('p', 'snapshot_time'), 1000)
+
+class TestWarmStart(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'state.db')
+        self.messages = []
+
+    def makeBot(self):
+        bot = ircbot.IrcBot('http://gitorious.org', 'maliit', 60, store=store.StateStore(self.path))
+        bot.outputMessage = self.messages.append
+        bot.processor.callback = self.messages.append
+        return bot
+
+    def test_restart(self):
+        bot = self.makeBot()
+        bot.processor.processRss(read_feed(1))
+        bot.updateOpenMergeRequests([{'repository': 'maliit-framework', 'id': '1'}])
+
+        restarted = self.makeBot()
+        self.assertEqual(restarted.open_merge_requests, [{'repository': 'maliit-framework', 'id': '1'}])
+
+        # Nothing is repeated, and new entries are reported
+        restarted.processor.processRss(read_feed(1))
+        self.assertEqual(self.messages, [])
+        restarted.processor.processRss(read_feed(2))
+        self.assertTrue(self.messages)
@@ -0,0 +1,100 @@
+import json, StringIO
+
+from twisted.trial import unittest
+from twisted.internet import reactor
+from twisted.web import server, resource, client
+from twisted.web.http_headers import Headers
+
+from gitorious_mrq import ircbot, webhook
+
+TITLE = 'jonnor updated merge request maliit/maliit-plugins #12&#x2192; State changed from New to Merged'
+
+def event(id, title=TITLE):
+    return {'id': 'tag:gitorious.org,2005:Event/%d' % id, 'title': title}
+
+class TestWebhook(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = ircbot.IrcBotFactory('mrqbot')
+        self.bot = self.factory.addProject('http://gitorious.org', 'maliit', ['#maliit'], 60)
+
+        self.messages = []
+        self.bot.processor.callback = self.messages.append
+        self.refreshed = []
+        self.bot.triggerOpenMergeRequestsUpdate = lambda: self.refreshed.append(None)
+        self.bot.triggerRepositoriesUpdate = self.refreshed.append
+
+        root = resource.Resource()
+        root.putChild('webhook', webhook.WebhookResource(self.factory, token='secret'))
+        self.port = reactor.listenTCP(0, server.Site(root), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/webhook' % self.port.getHost().port
+        self.pool = client.HTTPConnectionPool(reactor, persistent=False)
+
+    def tearDown(self):
+        self.pool.closeCachedConnections()
+        return self.port.stopListening()
+
+    def post(self, data, token='secret'):
+        body = data if isinstance(data, str) else json.dumps(data)
+        headers = Headers({'Content-Type': ['application/json'], webhook.TOKEN_HEADER: [token]})
+        d = client.Agent(reactor, pool=self.pool).request('POST', self.url, headers,
+                                                          client.FileBodyProducer(StringIO.StringIO(body)))
+        def gotResponse(response):
+            d = client.readBody(response)
+            d.addCallback(lambda body: (response.code, json.loads(body)))
+            return d
+        d.addCallback(gotResponse)
+        return d
+
+    def test_events_reported(self):
+        self.bot._repo_snapshot = {}
+        d = self.post({'project': 'maliit', 'events': [event(2), event(1)]})
+
+        def posted(result):
+            self.assertEqual(result, (202, {'events': 2, 'new': 2}))
+            self.assertEqual(len(self.messages), 2)
+            self.assertIn('http://gitorious.org/maliit/maliit-plugins/merge_requests/12', self.messages[0])
+            self.assertEqual(self.refreshed, [set(['maliit-plugins'])])
+            # Polling is now a safety net
+            self.assertEqual(self.bot.poller.min_interval, ircbot.PUSHED_POLL_INTERVAL)
+
+            return self.post({'project': 'maliit', 'events': [event(2)]})
+
+        def postedAgain(result):
+            self.assertEqual(result, (202, {'events': 1, 'new': 0}))
+            self.assertEqual(len(self.messages), 2)
+
+        d.addCallback(posted)
+        d.addCallback(postedAgain)
+        return d
+
+    def test_title_only(self):
+        self.bot._repo_snapshot = {}
+        titles = [TITLE.replace('#12', '#%d' % id) for id in (13, 14)]
+        d = self.post({'project': 'maliit', 'events': [{'title': titles[0]}]})
+        d.addCallback(lambda result: self.post({'project': 'maliit', 'events': [{'title': titles[1]}]}))
+
+        def posted(result):
+            self.assertEqual(result, (202, {'events': 1, 'new': 1}))
+            self.assertEqual(len(self.messages), 2)
+
+        d.addCallback(posted)
+        return d
+
+    def test_invalid(self):
+        d = self.post('{"project": ')
+        d.addCallback(lambda result: self.assertEqual(result[0], 400))
+        d.addCallback(lambda result: self.post({'project': 'maliit', 'events': [{'id': 'x'}]}))
+        d.addCallback(lambda result: self.assertEqual(result[0], 400))
+        return d
+
+    def test_unknown_project(self):
+        d = self.post({'project': 'qt', 'events': [event(1)]})
+        d.addCallback(lambda result: self.assertEqual(result[0], 404))
+        return d
+
+    def test_token(self):
+        d = self.post({'project': 'maliit', 'events': [event(1)]}, token='wrong')
+        d.addCallback(lambda result: self.assertEqual(result[0], 403))
+        d.addCallback(lambda result: self.assertEqual(self.messages, []))
+        return d
@@ -0,0 +1,73 @@
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from gitorious_mrq import workers, feedreader, scrape
+
+import generate
+
+def fail():
+    raise ValueError('parse error')
+
+def die():
+    os._exit(1)
+
+def unpicklable():
+    return lambda: None
+
+# Created before any test starts threads in the reactor,
+# and after the functions the workers need to call
+process_executor = workers.ProcessExecutor(2)
+short_timeout_executor = workers.ProcessExecutor(1, timeout=0.5)
+
+class ExecutorTests(object):
+
+    def test_parse_feed(self):
+        feed = open('tests/data/maliit.atom.1.txt').read()
+        d = self.executor.run(feedreader.parse_feed, feed)
+
+        def gotParsed(parsed):
+            self.assertEqual(len(parsed['items']), 30)
+
+        return d.addCallback(gotParsed)
+
+    def test_scrape(self):
+        rows = generate.merge_request_rows(10)
+        page = generate.merge_request_page('maliit', 'maliit-framework', rows)
+        d = self.executor.run(scrape.scrape_repository_mrqs, page, 'maliit-framework')
+
+        def gotScraped(mrqs):
+            self.assertEqual([m['id'] for m in mrqs], [row[0] for row in rows])
+            self.assertEqual(mrqs, scrape.scrape_repository_mrqs(page, 'maliit-framework'))
+
+        return d.addCallback(gotScraped)
+
+    def test_error(self):
+        return self.assertFailure(self.executor.run(fail), Exception)
+
+    def test_malformed_feed(self):
+        d = self.executor.run(feedreader.parse_feed, '<html><body>Error<p></body>')
+        d.addCallback(lambda parsed: self.assertTrue(parsed['bozo']))
+        return d
+
+class TestInlineExecutor(ExecutorTests, unittest.TestCase):
+    executor = workers.InlineExecutor()
+
+class TestThreadExecutor(ExecutorTests, unittest.TestCase):
+
+    def setUp(self):
+        self.executor = workers.ThreadExecutor(2)
+
+    def tearDown(self):
+        self.executor.pool.stop()
+
+class TestProcessExecutor(ExecutorTests, unittest.TestCase):
+    executor = process_executor
+
+    def test_worker_died(self):
+        return self.assertFailure(short_timeout_executor.run(die), defer.TimeoutError)
+
+    def test_unpicklable_result(self):
+        # Fails at once, instead of when timing out
+        return self.assertFailure(short_timeout_executor.run(unpicklable), workers.WorkerError)